@@ -1,16 +1,666 @@
 #!/usr/bin/env python3
 
 import os
+import re
+import json
+import stat
+import time
+import zlib
+import gzip
+import bisect
+import select
+import struct
+import hashlib
+import functools
 import subprocess
 import zipfile
 import datetime
 import logging
 import argparse
 import shutil
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+try:
+    import numpy as np  # Optional: vectorised chunk boundary search for the dedup store
+except ImportError:
+    np = None
+
+class RsyncStats:
+    """Counters parsed from a running 'rsync --progress', one output line at a time (constant memory)."""
+    PROGRESS = re.compile(r"^\s*([\d,]+)\s+(\d+)%\s+\S+\s+\S+(?:\s+\(xf(?:e)?r#(\d+),)?")  # xfer# before rsync 3.1
+    SUMMARY = re.compile(r"^sent ([\d,]+) bytes\s+received ([\d,]+) bytes\s+([\d,.]+) bytes/sec")
+    ERROR_LINES = 20  # Error lines kept for the log; the rest are only counted
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.files = 0
+        self.bytes = 0
+        self.sent = 0
+        self.received = 0
+        self.rate = 0.0
+        self.errors = 0
+        self.error_lines = deque(maxlen=self.ERROR_LINES)
+
+    def feed(self, line):
+        match = self.PROGRESS.match(line)
+        if match:
+            if match.group(3):  # File finished
+                self.files = int(match.group(3))
+                self.bytes += int(match.group(1).replace(",", ""))
+            return
+        match = self.SUMMARY.match(line)
+        if match:
+            self.sent, self.received = (int(n.replace(",", "")) for n in match.group(1, 2))
+            self.rate = float(match.group(3).replace(",", ""))
+
+    def error(self, line):
+        self.errors += 1
+        self.error_lines.append(line)
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        rate = self.rate or (self.bytes / elapsed if elapsed else 0.0)
+        return (f"{self.files} files, {self.bytes / 1e6:.1f} MB transferred in {elapsed:.1f}s "
+                f"({rate / 1e6:.2f} MB/s), {self.errors} errors")
+
+# Gear table for content-defined chunking: one pseudo-random 32-bit value per byte value
+GEAR = tuple(int.from_bytes(hashlib.sha256(bytes([i])).digest()[:4], "big") for i in range(256))
+GEAR_ARRAY = np.array(GEAR, dtype=np.uint32) if np is not None else None
+
+def cdc_cut_points(context, buffer, min_size, avg_size, max_size, final=False):
+    """
+    Content-defined cut points (offsets into buffer, ascending) using a 32-bit gear hash. The hash at a byte depends
+    only on that byte and the 31 before it ('context' supplies those for the start of buffer), so boundaries move with
+    the content and an edit only changes the chunks around it. Chunks are min_size..max_size, about avg_size on
+    average. Without 'final', the tail after the last cut is left for the next call.
+    """
+    bits = max(1, (avg_size - min_size).bit_length() - 1)
+    shift = 32 - bits
+    data = context[-31:] + buffer
+    skip = len(data) - len(buffer)
+    if np is not None:
+        hashes = GEAR_ARRAY.take(np.frombuffer(data, dtype=np.uint8))
+        shifted = np.empty_like(hashes)
+        for k in (1, 2, 4, 8, 16):  # Window sums by doubling: after the pass for k, each hash covers 2k bytes
+            np.left_shift(hashes[:-k], np.uint32(k), out=shifted[k:])
+            hashes[k:] += shifted[k:]
+        np.right_shift(hashes, np.uint32(shift), out=shifted)
+        candidates = (np.flatnonzero(shifted[skip:] == 0) + 1).tolist()
+    else:
+        candidates = []
+        h = 0
+        for i, byte in enumerate(data):
+            h = ((h << 1) + GEAR[byte]) & 0xFFFFFFFF
+            if i >= skip and h >> shift == 0:
+                candidates.append(i - skip + 1)
+    cuts = []
+    start = 0
+    while True:
+        i = bisect.bisect_left(candidates, start + min_size)
+        if i < len(candidates) and candidates[i] - start <= max_size:
+            start = candidates[i]
+        elif len(buffer) - start >= max_size:
+            start += max_size
+        else:
+            break
+        cuts.append(start)
+    if final and start < len(buffer):
+        cuts.append(len(buffer))
+    return cuts
+
+def cdc_chunks(file, min_size=64 << 10, avg_size=256 << 10, max_size=1 << 20):
+    """Yield the content-defined chunks of binary 'file', reading max_size bytes at a time."""
+    context = b""
+    pending = b""
+    while True:
+        block = file.read(max_size)
+        buffer = pending + block
+        start = 0
+        for cut in cdc_cut_points(context, buffer, min_size, avg_size, max_size, final=not block):
+            yield buffer[start:cut]
+            start = cut
+        if not block:
+            return
+        context = buffer[max(0, start - 31):start] if start else context
+        pending = buffer[start:]
+
+class ChunkStore:
+    """
+    Content-addressed chunk store with per-snapshot manifests, as an alternative to --link-dest snapshots.
+    Layout under root:
+      chunks/ab/<sha256>  - zlib-compressed chunk, named by the SHA-256 of its content
+      index               - one "<sha256> <size> <stored size>" line per chunk, loaded at start
+      snapshots/<name>.ndjson - one JSON line per directory, symlink or file (with its chunk list)
+    Files are split with content-defined chunking (cdc_chunks), so storage grows with changed bytes.
+    """
+    def __init__(self, root, workers=4):
+        self.root = Path(root)
+        self.chunk_dir = self.root / "chunks"
+        self.snapshot_dir = self.root / "snapshots"
+        self.chunk_dir.mkdir(parents=True, exist_ok=True)
+        self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.root / "index"
+        self.index = {}
+        if self.index_path.exists():
+            with open(self.index_path) as index:
+                for line in index:
+                    digest, size, stored = line.split()
+                    self.index[digest] = (int(size), int(stored))
+        self.index_file = open(self.index_path, "a")
+        self.lock = threading.Lock()
+        self.workers = max(1, workers)
+        self.stats = Counter()
+        self.new_dirs = set()  # Chunk directories with renames not yet synced, see sync()
+
+    def close(self):
+        self.index_file.close()
+
+    def chunk_path(self, digest):
+        return self.chunk_dir / digest[:2] / digest
+
+    def put(self, chunk):
+        """Store chunk unless already present; returns its SHA-256 hex digest."""
+        digest = hashlib.sha256(chunk).hexdigest()
+        with self.lock:
+            self.stats["bytes"] += len(chunk)
+            if digest in self.index:
+                return digest
+        data = zlib.compress(chunk, 1)
+        path = self.chunk_path(digest)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_name(f"{digest}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as out:
+            out.write(data)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.new_dirs.add(path.parent)
+            if digest not in self.index:
+                self.index[digest] = (len(chunk), len(data))
+                self.index_file.write(f"{digest} {len(chunk)} {len(data)}\n")
+                self.stats["new_bytes"] += len(chunk)
+                self.stats["stored_bytes"] += len(data)
+                self.stats["new_chunks"] += 1
+        return digest
+
+    def put_file(self, path, executor):
+        """Chunk and store a file; hashing and compression run on the executor (both release the GIL)."""
+        with open(path, "rb") as file:
+            futures = deque()
+            digests = []
+            for chunk in cdc_chunks(file):
+                futures.append(executor.submit(self.put, chunk))
+                if len(futures) >= 2 * self.workers:
+                    digests.append(futures.popleft().result())
+            digests.extend(future.result() for future in futures)
+        return digests
+
+    def sync(self):
+        """fsync the chunk directories written to since the last call, so the chunk renames survive a crash."""
+        with self.lock:
+            dirs, self.new_dirs = self.new_dirs, set()
+        for path in dirs:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def get(self, digest):
+        """Chunk content, checked against its digest."""
+        with open(self.chunk_path(digest), "rb") as file:
+            chunk = zlib.decompress(file.read())
+        if hashlib.sha256(chunk).hexdigest() != digest:
+            raise ValueError(f"Chunk {digest} is corrupt")
+        return chunk
+
+    def snapshots(self):
+        return sorted(self.snapshot_dir.glob("*.ndjson"))
+
+    def manifest(self, name):
+        """Iterate the entries of snapshot 'name' (manifest file name with or without .ndjson), header first."""
+        path = self.snapshot_dir / name
+        if not path.exists():
+            path = self.snapshot_dir / f"{name}.ndjson"
+        with open(path) as manifest:
+            for line in manifest:
+                yield json.loads(line)
+
+    def snapshot(self, name, sources, excludes=(), previous=None):
+        """
+        Write snapshot 'name' of the source directories. Files whose size, mtime and inode match the
+        'previous' snapshot reuse its chunk list without being read. Returns the manifest path.
+        """
+        known = {}
+        if previous is not None:
+            known = {entry["path"]: entry for entry in self.manifest(previous) if entry.get("type") == "file"}
+        path = self.snapshot_dir / f"{name}.ndjson"
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w") as manifest, ThreadPoolExecutor(self.workers) as executor:
+            manifest.write(json.dumps({"snapshot": name, "created": time.time(), "sources": [str(s) for s in sources]}) + "\n")
+            for source in sources:
+                for root, dirs, files in os.walk(source):
+                    rel_root = Path(source.name) / Path(root).relative_to(source)
+                    dirs[:] = [d for d in dirs if not self.excluded(rel_root / d, excludes)]
+                    for file_name in [""] + sorted(files) + [d for d in dirs if os.path.islink(os.path.join(root, d))]:
+                        if file_name and self.excluded(rel_root / file_name, excludes):
+                            continue
+                        full_path = os.path.join(root, file_name) if file_name else root
+                        entry = self.entry(full_path, (rel_root / file_name).as_posix(), known, executor)
+                        if entry is not None:
+                            manifest.write(json.dumps(entry) + "\n")
+            manifest.flush()
+            os.fsync(manifest.fileno())
+        self.sync()
+        self.index_file.flush()
+        os.fsync(self.index_file.fileno())
+        os.replace(tmp_path, path)
+        return path
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def exclude_regex(pattern):
+        """rsync wildcards: '*', '?' and '[...]' stop at '/', '**' crosses it, a trailing '/***' also matches the directory itself."""
+        tail = ""
+        if pattern.endswith("/***"):
+            pattern, tail = pattern[:-4], "(?:/.*)?"
+        regex, i = "", 0
+        while i < len(pattern):
+            char = pattern[i]
+            if pattern.startswith("**", i):
+                regex += ".*"
+                i += 2
+                continue
+            if char == "*":
+                regex += "[^/]*"
+            elif char == "?":
+                regex += "[^/]"
+            elif char == "[" and pattern.find("]", i + 2) > 0:
+                end = pattern.find("]", i + 2)  # A ']' straight after '[' is part of the set
+                body = pattern[i + 1:end].replace("\\", "\\\\")
+                regex += "(?!/)[" + ("^" + body[1:] if body.startswith("!") else body) + "]"
+                i = end + 1
+                continue
+            else:
+                regex += re.escape(char)
+            i += 1
+        return re.compile(regex + tail, re.DOTALL)
+
+    @staticmethod
+    def excluded(rel_path, excludes):
+        """rsync-style --exclude match for <source name>/<path>: a pattern matches any trailing part of the path, or from the source root if it starts with '/'"""
+        parts = rel_path.parts
+        for pattern in excludes:
+            pattern = pattern.rstrip("/") if not pattern.endswith("/***") else pattern
+            regex = ChunkStore.exclude_regex(pattern.lstrip("/"))
+            if pattern.startswith("/"):
+                if regex.fullmatch("/".join(parts[1:])):
+                    return True
+            elif any(regex.fullmatch("/".join(parts[i:])) for i in range(1, len(parts))):
+                return True
+        return False
+
+    def entry(self, full_path, rel_path, known, executor):
+        try:
+            st = os.lstat(full_path)
+            entry = {"path": rel_path, "mode": stat.S_IMODE(st.st_mode), "mtime_ns": st.st_mtime_ns}
+            if stat.S_ISLNK(st.st_mode):
+                entry.update(type="symlink", target=os.readlink(full_path))
+            elif stat.S_ISDIR(st.st_mode):
+                entry["type"] = "dir"
+            elif stat.S_ISREG(st.st_mode):
+                entry.update(type="file", size=st.st_size, ino=st.st_ino)
+                old = known.get(rel_path)
+                if old and (old["size"], old["mtime_ns"], old["ino"]) == (st.st_size, st.st_mtime_ns, st.st_ino):
+                    entry["chunks"] = old["chunks"]
+                    self.stats["bytes_skipped"] += st.st_size
+                else:
+                    entry["chunks"] = self.put_file(full_path, executor)
+                self.stats["files"] += 1
+            else:
+                return None  # Devices, sockets and fifos are not stored
+            return entry
+        except OSError as e:
+            logging.warning(f"Skipping {full_path}: {str(e)}")
+            self.stats["errors"] += 1
+            return None
+
+    def restore(self, name, target, prefix=""):
+        """Stream snapshot 'name' (only paths under 'prefix') into target, one chunk in memory at a time."""
+        target = Path(target)
+        directories = []
+        restored = 0
+        for entry in self.manifest(name):
+            if "path" not in entry or not entry["path"].startswith(prefix):
+                continue
+            path = target / entry["path"]
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if entry["type"] == "dir":
+                path.mkdir(exist_ok=True)
+                directories.append((path, entry))  # Times and modes set last, after the contents are written
+                continue
+            if entry["type"] == "symlink":
+                if path.is_symlink():
+                    path.unlink()
+                os.symlink(entry["target"], path)
+                continue
+            with open(path, "wb") as out:
+                for digest in entry["chunks"]:
+                    out.write(self.get(digest))
+            os.chmod(path, entry["mode"])
+            os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+            restored += 1
+        for path, entry in reversed(directories):
+            os.chmod(path, entry["mode"])
+            os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+        return restored
+
+    def verify(self, name):
+        """Names of chunks referenced by snapshot 'name' that are missing from the store."""
+        missing = set()
+        for entry in self.manifest(name):
+            for digest in entry.get("chunks", ()):
+                if digest not in self.index or not self.chunk_path(digest).exists():
+                    missing.add(digest)
+        return missing
+
+    def gc(self):
+        """Delete chunks no snapshot references and rewrite the index. Returns the bytes freed."""
+        live = set()
+        for path in self.snapshots():
+            for entry in self.manifest(path.name):
+                live.update(entry.get("chunks", ()))
+        freed = 0
+        with self.lock:
+            for digest in [d for d in self.index if d not in live]:
+                freed += self.index.pop(digest)[1]
+                self.chunk_path(digest).unlink(missing_ok=True)
+            self.index_file.close()
+            tmp_path = self.index_path.with_suffix(".tmp")
+            with open(tmp_path, "w") as index:
+                index.writelines(f"{d} {size} {stored}\n" for d, (size, stored) in self.index.items())
+            os.replace(tmp_path, self.index_path)
+            self.index_file = open(self.index_path, "a")
+        return freed
+
+class FileIndex:
+    """
+    Persistent metadata index of the source trees: path -> (type, size, mtime_ns, inode, sha256), with paths as laid
+    out in a snapshot (<source name>/<relative path>). Saved as gzipped NDJSON next to each snapshot and carried
+    forward: a full scan() only stats, reusing hashes of unchanged files, and update() rescans just the directories
+    an inotify ChangeWatcher reported. Both record what changed against the previous index.
+    """
+    def __init__(self, entries=None, created=None):
+        self.entries = entries if entries is not None else {}
+        self.created = created if created is not None else time.time()
+        self.added, self.modified, self.deleted = set(), set(), set()
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, "rt") as index:
+            header = json.loads(index.readline())
+            entries = {}
+            for line in index:
+                path_, *entry = json.loads(line)
+                entries[path_] = tuple(entry)
+        return cls(entries, header["created"])
+
+    def save(self, path):
+        tmp_path = path.with_name(path.name + ".tmp")
+        with gzip.open(tmp_path, "wt", compresslevel=1) as index:
+            index.write(json.dumps({"created": self.created, "entries": len(self.entries)}) + "\n")
+            for path_, entry in self.entries.items():
+                index.write(json.dumps([path_, *entry]) + "\n")
+        os.replace(tmp_path, path)
+
+    def changed(self):
+        return bool(self.added or self.modified or self.deleted)
+
+    def summary(self):
+        return f"{len(self.entries)} entries, {len(self.added)} added, {len(self.modified)} modified, {len(self.deleted)} deleted"
+
+    @staticmethod
+    def file_hash(path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _record(self, full_path, rel_path, previous, hash_files):
+        """Stat one path into the index, reusing the previous hash when size, mtime and inode are unchanged."""
+        try:
+            st = os.lstat(full_path)
+        except OSError:
+            return
+        if stat.S_ISDIR(st.st_mode):
+            kind = "d"
+        elif stat.S_ISLNK(st.st_mode):
+            kind = "l"
+        elif stat.S_ISREG(st.st_mode):
+            kind = "f"
+        else:
+            kind = "s"  # FIFO, socket or device: never opened, a FIFO would block the scan
+        old = previous.get(rel_path)
+        if old is not None and old[:4] == (kind, st.st_size, st.st_mtime_ns, st.st_ino):
+            self.entries[rel_path] = old
+            return
+        digest = None
+        if kind == "f" and hash_files:
+            try:
+                digest = self.file_hash(full_path)
+            except OSError as e:
+                logging.warning(f"Could not hash {full_path}: {str(e)}")
+        self.entries[rel_path] = (kind, st.st_size, st.st_mtime_ns, st.st_ino, digest)
+        (self.modified if old is not None else self.added).add(rel_path)
+
+    @classmethod
+    def scan(cls, sources, excludes=(), previous=None, hash_files=False):
+        """Full walk of the sources (stat only, plus hashing of new and changed files)."""
+        index = cls()
+        old = previous.entries if previous is not None else {}
+        for source in sources:
+            for root, dirs, files in os.walk(source):
+                rel_root = Path(source.name) / Path(root).relative_to(source)
+                dirs[:] = [d for d in dirs if not ChunkStore.excluded(rel_root / d, excludes)]
+                index._record(root, rel_root.as_posix(), old, hash_files)
+                for name in files + [d for d in dirs if os.path.islink(os.path.join(root, d))]:
+                    if not ChunkStore.excluded(rel_root / name, excludes):
+                        index._record(os.path.join(root, name), (rel_root / name).as_posix(), old, hash_files)
+        index.deleted = set(old) - set(index.entries)
+        return index
+
+    def update(self, sources, dirty_dirs, excludes=(), hash_files=False):
+        """
+        New index from this one with only 'dirty_dirs' (absolute directory paths) rescanned: their direct
+        entries are re-stated, removed ones dropped along with everything below them.
+        """
+        index = FileIndex(dict(self.entries))
+        rel_dirs = set()
+        for directory in dirty_dirs:
+            for source in sources:
+                try:
+                    rel_dirs.add((Path(source.name) / Path(directory).relative_to(source)).as_posix())
+                except ValueError:
+                    continue
+        children = {}
+        for path_ in self.entries:
+            parent = path_.rpartition("/")[0]
+            if parent in rel_dirs:
+                children.setdefault(parent, []).append(path_)
+        for rel_dir in sorted(rel_dirs):
+            source = next(s for s in sources if rel_dir == s.name or rel_dir.startswith(s.name + "/"))
+            full_dir = source.parent / rel_dir
+            if ChunkStore.excluded(Path(rel_dir), excludes):
+                continue
+            seen = set()
+            try:
+                with os.scandir(full_dir) as listing:
+                    for item in listing:
+                        rel_path = f"{rel_dir}/{item.name}"
+                        if not ChunkStore.excluded(Path(rel_path), excludes):
+                            index._record(item.path, rel_path, self.entries, hash_files)
+                            seen.add(rel_path)
+                index._record(str(full_dir), rel_dir, self.entries, hash_files)
+            except OSError:
+                index.entries.pop(rel_dir, None)
+                if rel_dir in self.entries:
+                    index.deleted.add(rel_dir)
+            for path_ in children.get(rel_dir, ()):
+                if path_ not in seen:
+                    index.entries.pop(path_, None)
+                    index.deleted.add(path_)
+        if index.deleted:  # Removed or moved-away directories take everything below them along
+            prefixes = tuple(f"{p}/" for p in index.deleted if self.entries.get(p, ("",))[0] == "d")
+            if prefixes:
+                for path_ in [p for p in index.entries if p.startswith(prefixes)]:
+                    del index.entries[path_]
+                    index.deleted.add(path_)
+        return index
+
+class ChangeWatcher:
+    """
+    inotify (Linux) watcher that records changed source directories between backups, so backup() can rescan only
+    those (FileIndex.update) instead of walking every tree. Changed directories are appended to index_dir/dirty once a
+    second; the watcher's pid, start time, sources and excludes go to watcher.json next to it. A queue overflow, a
+    failed watch (see fs.inotify.max_user_watches) or a source root going away writes an '!overflow' line, which makes
+    the next backup do a full scan.
+    """
+    JOURNAL = "dirty"
+    STATE = "watcher.json"
+    IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE = 0x2, 0x4, 0x8
+    IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x40, 0x80, 0x100, 0x200
+    IN_DELETE_SELF, IN_MOVE_SELF, IN_Q_OVERFLOW, IN_IGNORED, IN_ISDIR = 0x400, 0x800, 0x4000, 0x8000, 0x40000000
+    MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    OVERFLOW = "!overflow"
+
+    def __init__(self, sources, index_dir, excludes=()):
+        import ctypes
+        self.sources = sources
+        self.journal_path = Path(index_dir) / self.JOURNAL
+        self.state_path = Path(index_dir) / self.STATE
+        self.excludes = excludes
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}  # wd -> directory path
+        self.inodes = {}  # wd -> inode of the directory, to tell a renamed watch from a stale one
+        self.dirty = set()
+        self.header = struct.Struct("iIII")
+
+    def rel_path(self, path):
+        """<source name>/<relative path> of an absolute path, as FileIndex and ChunkStore.excluded use, or None"""
+        for source in self.sources:
+            try:
+                return Path(source.name) / Path(path).relative_to(source)
+            except ValueError:
+                continue
+        return None
+
+    def watch_tree(self, top):
+        """Watch top and every directory below it, marking them all dirty (their contents are new to us)."""
+        rel_top = self.rel_path(top)
+        if rel_top is None or ChunkStore.excluded(rel_top, self.excludes):
+            return
+        for root, dirs, _ in os.walk(top):
+            rel_root = self.rel_path(root)
+            dirs[:] = [d for d in dirs if not ChunkStore.excluded(rel_root / d, self.excludes)]
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(root), self.MASK)
+            if wd < 0:
+                logging.warning(f"Cannot watch {root}, falling back to full scans")
+                self.dirty.add(self.OVERFLOW)
+                continue
+            self.watches[wd] = root  # A renamed directory keeps its wd, this remaps it to the new path
+            try:
+                self.inodes[wd] = os.stat(root).st_ino
+            except OSError:
+                pass
+            self.dirty.add(root)
+
+    def forget(self, wd):
+        """Drop a watch that is gone or no longer points into the sources"""
+        directory = self.watches.pop(wd, None)
+        self.inodes.pop(wd, None)
+        if directory is not None and Path(directory) in self.sources:
+            logging.warning(f"Source {directory} went away, falling back to full scans")
+            self.dirty.add(self.OVERFLOW)
+
+    def flush(self):
+        if self.dirty:
+            with open(self.journal_path, "a") as journal:
+                journal.writelines(f"{path}\n" for path in sorted(self.dirty))
+            self.dirty.clear()
+
+    def start(self):
+        """Watch the sources and record this watcher in watcher.json"""
+        started = time.time()
+        for source in self.sources:
+            self.watch_tree(source)
+        self.dirty = {self.OVERFLOW} & self.dirty  # Existing trees are covered by the last index, not dirty
+        with open(self.state_path, "w") as state:
+            json.dump({"pid": os.getpid(), "started": started, "sources": sorted(str(s) for s in self.sources),
+                       "excludes": sorted(self.excludes)}, state)
+        logging.info(f"Watching {len(self.watches)} directories, journal {self.journal_path}")
+
+    def poll(self, timeout=1.0):
+        """Wait up to timeout for inotify events and mark the directories they touch dirty"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return
+        data = os.read(self.fd, 1 << 16)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.header.unpack_from(data, offset)
+            name = data[offset + self.header.size:offset + self.header.size + length].rstrip(b"\0")
+            offset += self.header.size + length
+            if mask & self.IN_Q_OVERFLOW:
+                self.dirty.add(self.OVERFLOW)
+                continue
+            if mask & self.IN_IGNORED:  # Watch removed by the kernel (directory deleted) or by forget()
+                self.forget(wd)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            self.dirty.add(directory)
+            if mask & self.IN_ISDIR and name:
+                path = os.path.join(directory, os.fsdecode(name))
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    self.watch_tree(path)
+                else:
+                    self.dirty.add(path)
+            if mask & self.IN_MOVE_SELF:
+                # Moved within the sources: IN_MOVED_TO came first and watch_tree() remapped the wd to the
+                # new path, so the inode there matches. Anything else moved out of the sources.
+                try:
+                    moved_within = os.stat(directory).st_ino == self.inodes.get(wd)
+                except OSError:
+                    moved_within = False
+                if not moved_within:
+                    self.libc.inotify_rm_watch(self.fd, wd)
+                    self.forget(wd)
+
+    def run(self):
+        self.start()
+        next_flush = time.monotonic() + 1
+        while True:
+            self.poll()
+            if time.monotonic() >= next_flush:
+                self.flush()
+                next_flush = time.monotonic() + 1
+
 class RsyncBackupTool:
-    def __init__(self, source_dirs, dest_dir, retain_months=3, retain_weeks=4, retain_days=7, excludes=None, retain_logs=10):
+    ARCHIVE_SUFFIXES = (".zip", ".tar.zst")
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, source_dirs, dest_dir, retain_months=3, retain_weeks=4, retain_days=7, excludes=None, retain_logs=10,
+                 jobs=4, source_device_limit=1, dest_device_limit=2, archive_format="tar.zst", archive_level=3, mode="rsync",
+                 index_hash=False):
         self.source_dirs = [Path(src).resolve() for src in source_dirs]
         self.dest_dir = Path(dest_dir).resolve()
         self.dest_dir.mkdir(parents=True, exist_ok=True)
@@ -21,6 +671,18 @@ class RsyncBackupTool:
         self.excludes = excludes or []
         self.retain_logs = retain_logs
         self.unzipped_days = 10  # Keep unzipped for 10 days
+        self.archive_format = archive_format  # "tar.zst" (tar + zstd on all cores, hard links stored once) or "zip"
+        self.archive_level = archive_level  # zstd compression level
+        self.mode = mode  # "rsync" (--link-dest snapshot directories) or "dedup" (ChunkStore under dest_dir/dedup)
+        self.index_dir = self.dest_dir / "index"  # FileIndex per snapshot and the ChangeWatcher journal
+        self.index_hash = index_hash  # Also hash new and changed files into the index (reads them a second time)
+        self.progress_interval = 30  # Seconds between rsync progress log lines
+        self.rsync_stats = {}  # source -> RsyncStats of the last rsync_copy
+
+        # Parallel rsync: at most 'jobs' at once, and at most N per source / destination device
+        self.jobs = max(1, jobs)
+        self.source_device_limit = max(1, source_device_limit)
+        self.dest_device_limit = max(1, dest_device_limit)
 
         # Ntfy settings
         self.ntfy_url = "http://172.25.47.113:3030"
@@ -53,34 +715,203 @@ class RsyncBackupTool:
             rsync_cmd.extend([source_str, str(dest)])
             
             logging.info(f"Executing rsync command: {' '.join(rsync_cmd)}")
-            result = subprocess.run(rsync_cmd, check=True, text=True, capture_output=True)
-            logging.info(f"rsync output for {source}: {result.stdout}")
-            if result.stderr:
-                logging.warning(f"rsync warnings for {source}: {result.stderr}")
+            stats = self.rsync_stats[source] = RsyncStats()
+            # Universal newlines also split the \r-separated progress updates into lines
+            process = subprocess.Popen(rsync_cmd, text=True, errors="replace", stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+            def read_stderr():
+                for line in process.stderr:
+                    if line.strip():
+                        stats.error(line.rstrip())
+
+            stderr_reader = threading.Thread(target=read_stderr)
+            stderr_reader.start()
+            next_report = time.monotonic() + self.progress_interval
+            try:
+                for line in process.stdout:
+                    stats.feed(line)
+                    if time.monotonic() >= next_report:
+                        logging.info(f"rsync progress for {source}: {stats.summary()}")
+                        next_report = time.monotonic() + self.progress_interval
+                process.wait()
+            finally:
+                self.reap(process)  # Kills rsync if anything, KeyboardInterrupt included, ended the loop early
+                stderr_reader.join()
+            returncode = process.returncode
+            for line in stats.error_lines:
+                logging.warning(f"rsync warnings for {source}: {line}")
+            if stats.errors > len(stats.error_lines):
+                logging.warning(f"rsync warnings for {source}: {stats.errors - len(stats.error_lines)} earlier lines not logged")
+            logging.info(f"rsync summary for {source}: {stats.summary()}")
+            if returncode != 0:
+                logging.error(f"rsync failed for {source} (exit code: {returncode})")
+                logging.error(f"Failed command: {' '.join(rsync_cmd)}")
+                return False
             return True
-        except subprocess.CalledProcessError as e:
-            logging.error(f"rsync failed for {source}: {e.stderr} (exit code: {e.returncode})")
-            logging.error(f"Failed command: {' '.join(rsync_cmd)}")
+        except OSError as e:
+            logging.error(f"rsync failed for {source}: {str(e)}")
             return False
 
+    def rsync_all(self, jobs, incremental=False, previous_backup=None):
+        """
+        Run rsync_copy for each (source, dest) in jobs on up to self.jobs threads, never running more than
+        source_device_limit rsyncs reading one device or dest_device_limit writing one device.
+        Returns True only if every rsync succeeded.
+        """
+        def devices(job):
+            source, dest = job
+            return ("source", source.stat().st_dev), ("dest", dest.parent.stat().st_dev)
+
+        limits = {"source": self.source_device_limit, "dest": self.dest_device_limit}
+        pending = [(job, devices(job)) for job in jobs]
+        active = Counter()
+        results = []
+        ready = threading.Condition()
+
+        def take():
+            # Next job whose devices both have a free slot, waiting until one does
+            with ready:
+                while pending:
+                    for entry in pending:
+                        if all(active[device] < limits[device[0]] for device in entry[1]):
+                            pending.remove(entry)
+                            active.update(entry[1])
+                            return entry
+                    ready.wait()
+                return None
+
+        def worker():
+            while (entry := take()) is not None:
+                (source, dest), keys = entry
+                try:
+                    success = self.rsync_copy(source, dest, incremental=incremental, previous_backup=previous_backup)
+                except Exception as e:
+                    logging.error(f"rsync failed for {source}: {str(e)}")
+                    success = False
+                if not success:
+                    logging.warning(f"Continuing despite rsync failure for {source}")
+                with ready:
+                    results.append(success)
+                    active.subtract(keys)
+                    ready.notify_all()
+
+        threads = [threading.Thread(target=worker, name=f"rsync-{n}") for n in range(min(self.jobs, len(pending)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return all(results)
+
     def archive_directory(self, directory):
-        """Convert a directory to a .zip file and delete the original."""
-        zip_path = self.dest_dir / f"{directory.name}.zip"
+        """Convert a directory to a .tar.zst (or .zip) archive, verify it and delete the original."""
+        archive_format = self.archive_format
+        if archive_format == "tar.zst" and not shutil.which("zstd"):
+            logging.warning("zstd not found, archiving as zip")
+            archive_format = "zip"
+        archive_path = self.dest_dir / f"{directory.name}.{archive_format}"
+        partial_path = archive_path.with_name(archive_path.name + ".part")
         try:
-            with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-                for root, _, files in os.walk(directory):
-                    for file in files:
-                        file_path = Path(root) / file
-                        rel_path = file_path.relative_to(directory)
-                        zipf.write(file_path, rel_path)
-                        logging.info(f"Archived {rel_path} into {zip_path}")
+            started = time.monotonic()
+            if archive_format == "tar.zst":
+                raw_bytes = self.write_tar_zst(directory, partial_path)
+            else:
+                raw_bytes = self.write_zip(directory, partial_path)
+            elapsed = time.monotonic() - started
+            size = partial_path.stat().st_size
+            os.replace(partial_path, archive_path)
+            logging.info(f"Archived {directory}: {raw_bytes / 1e6:.1f} MB -> {size / 1e6:.1f} MB "
+                         f"(ratio {raw_bytes / max(size, 1):.2f}) in {elapsed:.1f}s ({raw_bytes / 1e6 / max(elapsed, 1e-6):.1f} MB/s)")
             shutil.rmtree(directory)
-            logging.info(f"Converted {directory} to {zip_path}")
-            return zip_path
+            logging.info(f"Converted {directory} to {archive_path}")
+            return archive_path
         except Exception as e:
             logging.error(f"Failed to archive {directory}: {str(e)}")
+            if partial_path.exists():
+                os.remove(partial_path)
             return None
 
+    def write_tar_zst(self, directory, archive_path):
+        """
+        Stream 'tar' of directory through 'zstd -T0' (all cores) into archive_path. tar stores every hard-linked
+        inode once, later names become link entries. The archive is decompressed and its tar stream compared
+        (SHA-256) with what was written before returning; raises RuntimeError on any failure.
+        Returns the uncompressed tar size in bytes.
+        """
+        digest = hashlib.sha256()
+        raw_bytes = 0
+        with open(archive_path, "wb") as out:
+            tar = subprocess.Popen(["tar", "-C", str(directory), "-cf", "-", "."], stdout=subprocess.PIPE)
+            zstd = None
+            try:
+                zstd = subprocess.Popen(["zstd", "-q", "-T0", f"-{self.archive_level}", "-c"], stdin=subprocess.PIPE, stdout=out)
+                for chunk in iter(lambda: tar.stdout.read(self.CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    raw_bytes += len(chunk)
+                    zstd.stdin.write(chunk)
+                zstd.stdin.close()
+                if tar.wait() != 0 or zstd.wait() != 0:
+                    raise RuntimeError(f"tar exit code {tar.returncode}, zstd exit code {zstd.returncode}")
+            finally:
+                self.reap(tar, zstd)
+
+        check = hashlib.sha256()
+        unzstd = subprocess.Popen(["zstd", "-q", "-d", "-c", str(archive_path)], stdout=subprocess.PIPE)
+        try:
+            for chunk in iter(lambda: unzstd.stdout.read(self.CHUNK_SIZE), b""):
+                check.update(chunk)
+            if unzstd.wait() != 0 or check.digest() != digest.digest():
+                raise RuntimeError(f"verification of {archive_path} failed")
+        finally:
+            self.reap(unzstd)
+        return raw_bytes
+
+    @staticmethod
+    def reap(*processes):
+        """Close the pipes of processes, killing and waiting for any still running (error paths)."""
+        for process in processes:
+            if process is None:
+                continue
+            for pipe in (process.stdin, process.stdout):
+                if pipe is not None:
+                    try:
+                        pipe.close()
+                    except OSError:
+                        pass  # BrokenPipeError flushing a stdin the process already closed
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+
+    def write_zip(self, directory, archive_path):
+        """Zip directory into archive_path (one copy per hard link) and test it. Returns the uncompressed size in bytes."""
+        raw_bytes = 0
+        with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_DEFLATED) as zipf:
+            for root, _, files in os.walk(directory):
+                for file in files:
+                    file_path = Path(root) / file
+                    zipf.write(file_path, file_path.relative_to(directory))
+                    raw_bytes += file_path.lstat().st_size
+        with zipfile.ZipFile(archive_path) as zipf:
+            bad = zipf.testzip()
+        if bad is not None:
+            raise RuntimeError(f"verification of {archive_path} failed at {bad}")
+        return raw_bytes
+
+    def verify_archive(self, archive_path):
+        """Check that an archive decompresses and lists cleanly."""
+        if archive_path.name.endswith(".zip"):
+            with zipfile.ZipFile(archive_path) as zipf:
+                return zipf.testzip() is None
+        unzstd = None
+        try:
+            unzstd = subprocess.Popen(["zstd", "-q", "-d", "-c", str(archive_path)], stdout=subprocess.PIPE)
+            listed = subprocess.run(["tar", "-tf", "-"], stdin=unzstd.stdout, stdout=subprocess.DEVNULL)
+            unzstd.stdout.close()
+            return unzstd.wait() == 0 and listed.returncode == 0
+        except OSError as e:
+            logging.error(f"Could not verify {archive_path}: {str(e)}")
+            self.reap(unzstd)
+            return False
+
     def send_ntfy_notification(self, message):
         if not self.ntfy_token:
             logging.warning("Ntfy notification skipped: Token not provided.")
@@ -115,42 +946,32 @@ class RsyncBackupTool:
         )
         return backups[0] if backups else None
 
-    def cleanup_old_backups(self):
-        now = datetime.datetime.now()
-        backups = sorted(
-            [f for f in self.dest_dir.glob("*_backup_*") if f.is_dir() or f.suffix == ".zip"],
-            key=lambda x: x.stat().st_mtime
-        )
+    def backup_times(self, backups):
+        """{backup: date} for the backups whose name carries a <name>_backup_<YYYYMMDD>... timestamp"""
         backup_times = {}
-        for backup in backups:
+        for backup in sorted(backups, key=lambda x: x.stat().st_mtime):
             try:
-                timestamp_str = backup.name.split("_")[2].replace(".zip", "")
+                timestamp_str = backup.name.split("_")[2].split(".")[0]
                 backup_time = datetime.datetime.strptime(timestamp_str, "%Y%m%d")
                 backup_times[backup] = backup_time
             except (IndexError, ValueError):
                 logging.warning(f"Skipping {backup} - invalid timestamp format")
                 continue
+        return backup_times
 
-        if not backup_times:
-            return
-
+    def expired_backups(self, backup_times):
+        """The backups of backup_times outside the monthly, weekly and daily retention"""
+        now = datetime.datetime.now()
         daily_cutoff = now - datetime.timedelta(days=self.retain_days)
         weekly_cutoff = now - datetime.timedelta(weeks=self.retain_weeks)
         monthly_cutoff = now - datetime.timedelta(days=self.retain_months * 30)
-        unzipped_cutoff = now - datetime.timedelta(days=self.unzipped_days)
 
-        monthly_kept, weekly_kept, daily_kept = [], [], []
+        monthly_kept, weekly_kept, daily_kept, expired = [], [], [], []
         for backup, backup_time in sorted(backup_times.items(), key=lambda x: x[1], reverse=True):
             backup_date = backup_time.date()
             week_start = backup_date - datetime.timedelta(days=backup_date.weekday())
             month_start = backup_date.replace(day=1)
 
-            # Archive directories older than 10 days
-            if backup.is_dir() and backup_time < unzipped_cutoff:
-                archived = self.archive_directory(backup)
-                if archived:
-                    backup = archived
-
             # Retention logic
             if backup_time > monthly_cutoff and month_start not in [d.replace(day=1) for d in monthly_kept]:
                 if len(monthly_kept) < self.retain_months:
@@ -164,15 +985,37 @@ class RsyncBackupTool:
                 if len(daily_kept) < self.retain_days:
                     daily_kept.append(backup_date)
                     continue
-
-            # Remove if not kept
-            logging.info(f"Removing old backup: {backup}")
-            if backup.is_dir():
-                shutil.rmtree(backup)
-            else:
-                os.remove(backup)
+            expired.append(backup)
 
         logging.info(f"Kept {len(monthly_kept)} monthly, {len(weekly_kept)} weekly, {len(daily_kept)} daily backups")
+        return expired
+
+    def cleanup_old_backups(self):
+        backup_times = self.backup_times(
+            f for f in self.dest_dir.glob("*_backup_*") if f.is_dir() or f.name.endswith(self.ARCHIVE_SUFFIXES))
+        if not backup_times:
+            return
+        expired = set(self.expired_backups(backup_times))
+        unzipped_cutoff = datetime.datetime.now() - datetime.timedelta(days=self.unzipped_days)
+        for backup, backup_time in backup_times.items():
+            if backup in expired:
+                logging.info(f"Removing old backup: {backup}")
+                self.index_path(backup).unlink(missing_ok=True)
+                if backup.is_dir():
+                    shutil.rmtree(backup)
+                else:
+                    os.remove(backup)
+            elif backup.is_dir() and backup_time < unzipped_cutoff:
+                self.archive_directory(backup)  # Archive kept directories older than 10 days
+
+    def cleanup_dedup_snapshots(self, store):
+        """Apply the backup retention to the dedup snapshots, then delete the chunks only expired ones used."""
+        expired = self.expired_backups(self.backup_times(store.snapshots()))
+        for manifest in expired:
+            logging.info(f"Removing old dedup snapshot: {manifest}")
+            manifest.unlink()
+        if expired:
+            logging.info(f"Dedup gc freed {store.gc() / 1e6:.1f} MB")
 
     def cleanup_old_logs(self):
         logs = sorted([f for f in self.log_dir.glob("backup_*.log") if f.is_file()], key=lambda x: x.stat().st_mtime, reverse=True)
@@ -182,9 +1025,111 @@ class RsyncBackupTool:
             logging.info(f"Removing old log file: {old_log}")
             os.remove(old_log)
 
+    def dedup_backup(self):
+        """Snapshot the sources into the content-addressed store under dest_dir/dedup (see ChunkStore)."""
+        store = ChunkStore(self.dest_dir / "dedup", workers=self.jobs)
+        snapshots = store.snapshots()
+        previous = snapshots[-1].name if snapshots else None
+        sources = []
+        for source_dir in self.source_dirs:
+            if not source_dir.exists():
+                logging.warning(f"Source {source_dir} does not exist, skipping.")
+                continue
+            sources.append(source_dir)
+        logging.info(f"Starting dedup snapshot of {len(sources)} sources (previous: {previous})")
+        try:
+            manifest = store.snapshot(f"dedup_backup_{self.timestamp}", sources, self.excludes, previous)
+            self.cleanup_dedup_snapshots(store)
+        finally:
+            store.close()
+        stats = store.stats
+        logging.info(f"Dedup snapshot {manifest}: {stats['files']} files, {stats['bytes'] / 1e6:.1f} MB read, "
+                     f"{stats['bytes_skipped'] / 1e6:.1f} MB unchanged, {stats['new_bytes'] / 1e6:.1f} MB new in "
+                     f"{stats['new_chunks']} chunks ({stats['stored_bytes'] / 1e6:.1f} MB stored), {stats['errors']} errors")
+        print(f"Dedup backup completed to: {manifest}")
+        self.send_ntfy_notification(f"Dedup backup completed: {manifest}")
+        self.cleanup_old_logs()
+        return manifest
+
+    def restore(self, snapshot, target, prefix=""):
+        """Restore dedup snapshot 'snapshot' (or the paths under 'prefix') into target."""
+        store = ChunkStore(self.dest_dir / "dedup")
+        try:
+            restored = store.restore(snapshot, target, prefix)
+        finally:
+            store.close()
+        logging.info(f"Restored {restored} files from {snapshot} to {target}")
+        print(f"Restored {restored} files from {snapshot} to {target}")
+        return restored
+
+    def index_path(self, backup):
+        """FileIndex file of a snapshot directory (or its archive)"""
+        return self.index_dir / f"{Path(backup).name.split('.')[0]}.ndjson.gz"
+
+    def watcher_covers(self, index, sources):
+        """True if a ChangeWatcher on the same sources and excludes has been running since before 'index' was taken"""
+        try:
+            with open(self.index_dir / ChangeWatcher.STATE) as state_file:
+                state = json.load(state_file)
+            os.kill(state["pid"], 0)
+        except (OSError, ValueError, KeyError):
+            return False
+        return (state["started"] <= index.created and state.get("sources") == sorted(str(s) for s in sources)
+                and state.get("excludes") == sorted(self.excludes))
+
+    def scan_sources(self, sources, previous):
+        """
+        FileIndex of the sources and the change journal files it consumed. With a previous index and a
+        ChangeWatcher running since it was taken, only the directories in the journal are rescanned.
+        """
+        journal = self.index_dir / ChangeWatcher.JOURNAL
+        if journal.exists():
+            os.replace(journal, journal.with_name(f"{journal.name}.{self.timestamp}"))
+        consumed = sorted(self.index_dir.glob(f"{ChangeWatcher.JOURNAL}.*"))  # Includes journals of failed runs
+        if previous is not None and self.watcher_covers(previous, sources):
+            dirty = set()
+            for path in consumed:
+                with open(path) as journal_file:
+                    dirty.update(line.rstrip("\n") for line in journal_file)
+            if ChangeWatcher.OVERFLOW not in dirty:
+                index = previous.update(sources, dirty, self.excludes, self.index_hash)
+                logging.info(f"Index updated from {len(dirty)} changed directories: {index.summary()}")
+                return index, consumed
+            logging.warning("Change journal incomplete, doing a full scan")
+        index = FileIndex.scan(sources, self.excludes, previous, self.index_hash)
+        logging.info(f"Index scanned: {index.summary()}")
+        return index, consumed
+
+    def watch(self):
+        """Run a ChangeWatcher on the sources until interrupted."""
+        self.index_dir.mkdir(exist_ok=True)
+        ChangeWatcher([s for s in self.source_dirs if s.exists()], self.index_dir, self.excludes).run()
+
     def backup(self):
         """Automatically decide between full or incremental backup."""
+        if self.mode == "dedup":
+            return self.dedup_backup()
         latest_backup = self.get_latest_backup()
+        backup_type = "Full" if not latest_backup else "Incremental"
+
+        sources = []
+        for source_dir in self.source_dirs:
+            if not source_dir.exists():
+                logging.warning(f"Source {source_dir} does not exist, skipping.")
+                continue
+            sources.append(source_dir)
+        self.index_dir.mkdir(exist_ok=True)
+        previous_index = None
+        if latest_backup and self.index_path(latest_backup).exists():
+            previous_index = FileIndex.load(self.index_path(latest_backup))
+        index, consumed = self.scan_sources(sources, previous_index)
+        if previous_index is not None and not index.changed():
+            logging.info(f"No changes since {latest_backup}, skipping incremental backup.")
+            for path in consumed:
+                os.remove(path)
+            self.cleanup_old_backups()
+            self.cleanup_old_logs()
+            return None
         
         if not latest_backup:
             # First run: full backup
@@ -202,29 +1147,23 @@ class RsyncBackupTool:
                 shutil.rmtree(backup_dir)
             backup_dir.mkdir()
 
-            all_success = True
-            for source_dir in self.source_dirs:
-                if not source_dir.exists():
-                    logging.warning(f"Source {source_dir} does not exist, skipping.")
-                    continue
-                dest_subdir = backup_dir / source_dir.name
-                if not self.rsync_copy(source_dir, dest_subdir, incremental=bool(latest_backup), previous_backup=latest_backup):
-                    all_success = False
-                    logging.warning(f"Continuing despite rsync failure for {source_dir}")
+            jobs = [(source_dir, backup_dir / source_dir.name) for source_dir in sources]
+            all_success = self.rsync_all(jobs, incremental=bool(latest_backup), previous_backup=latest_backup)
 
             if not all_success:
                 logging.warning("Some rsync operations failed, but proceeding with backup")
 
-            if not latest_backup and not any(backup_dir.rglob("*")):
-                logging.info("No files copied in full backup, removing empty directory.")
-                shutil.rmtree(backup_dir)
-                return None
-            elif latest_backup and not any(backup_dir.rglob("*")):
-                logging.info("No changes detected in incremental backup, removing empty directory.")
+            if not index.entries:
+                logging.info(f"No files copied in {backup_type.lower()} backup, removing empty directory.")
                 shutil.rmtree(backup_dir)
                 return None
 
-            backup_type = "Full" if not latest_backup else "Incremental"
+            if all_success:
+                index.save(self.index_path(backup_dir))
+                for path in consumed:
+                    os.remove(path)
+            else:
+                logging.warning("Index not saved for a partial backup, the next run compares against the previous one")
             logging.info(f"{backup_type} backup completed to: {backup_dir}")
             print(f"{backup_type} backup completed to: {backup_dir}")
 
@@ -246,15 +1185,42 @@ class RsyncBackupTool:
             print(f"Backup {backup_path} not found.")
             return False
         if backup_path.is_dir():
-            files = list(backup_path.rglob("*"))
-            if not files:
+            index_path = self.index_path(backup_path)
+            if index_path.exists():
+                # Check against the snapshot's index instead of listing the tree
+                entries = FileIndex.load(index_path).entries
+                missing = sum(1 for path in entries if not os.path.lexists(backup_path / path))
+                if missing:
+                    logging.error(f"Backup directory {backup_path} is missing {missing} of {len(entries)} indexed items.")
+                    print(f"Backup directory {backup_path} is missing {missing} of {len(entries)} indexed items.")
+                    return False
+                count = len(entries)
+            else:
+                count = sum(1 for _ in backup_path.rglob("*"))
+            if not count:
                 logging.error(f"Backup directory {backup_path} is empty.")
                 print(f"Backup directory {backup_path} is empty.")
                 return False
-            logging.info(f"Backup directory {backup_path} verified: contains {len(files)} items.")
+            logging.info(f"Backup directory {backup_path} verified: contains {count} items.")
             print(f"Backup directory {backup_path} verified.")
-        else:  # .zip
-            logging.info(f"Backup file {backup_path} exists.")
+        elif backup_path.suffix == ".ndjson":  # Dedup snapshot manifest
+            store = ChunkStore(backup_path.parent.parent)
+            try:
+                missing = store.verify(backup_path.name)
+            finally:
+                store.close()
+            if missing:
+                logging.error(f"Snapshot {backup_path} references {len(missing)} missing chunks.")
+                print(f"Snapshot {backup_path} references {len(missing)} missing chunks.")
+                return False
+            logging.info(f"Snapshot {backup_path} verified.")
+            print(f"Snapshot {backup_path} verified.")
+        else:  # .zip or .tar.zst
+            if not self.verify_archive(backup_path):
+                logging.error(f"Backup file {backup_path} is damaged.")
+                print(f"Backup file {backup_path} is damaged.")
+                return False
+            logging.info(f"Backup file {backup_path} verified.")
             print(f"Backup file {backup_path} verified.")
         return True
 
@@ -269,6 +1235,17 @@ def main():
     parser.add_argument("--retain-days", type=int, default=7, help="Number of days to retain backups (default: 7)")
     parser.add_argument("--exclude", action="append", help="Directories or files to exclude (can be used multiple times)")
     parser.add_argument("--retain-logs", type=int, default=10, help="Number of log files to retain (default: 10)")
+    parser.add_argument("--jobs", type=int, default=4, help="Sources to rsync in parallel (default: 4)")
+    parser.add_argument("--source-device-limit", type=int, default=1, help="Parallel rsyncs reading from one source device (default: 1)")
+    parser.add_argument("--dest-device-limit", type=int, default=2, help="Parallel rsyncs writing to one destination device (default: 2)")
+    parser.add_argument("--archive-format", choices=["tar.zst", "zip"], default="tar.zst", help="Format for backups older than 10 days (default: tar.zst, zip if zstd is missing)")
+    parser.add_argument("--archive-level", type=int, default=3, help="zstd compression level for tar.zst archives (default: 3)")
+    parser.add_argument("--mode", choices=["rsync", "dedup"], default="rsync", help="rsync: --link-dest snapshot directories (default); dedup: chunk store under DESTINATION/dedup")
+    parser.add_argument("--restore", nargs=2, metavar=("SNAPSHOT", "TARGET"), help="Restore a dedup snapshot into TARGET")
+    parser.add_argument("--restore-prefix", default="", help="With --restore, only restore paths starting with this prefix")
+    parser.add_argument("--dedup-gc", action="store_true", help="Delete dedup chunks no snapshot manifest references")
+    parser.add_argument("--watch", action="store_true", help="Record changed source directories with inotify until interrupted, so backups only rescan those")
+    parser.add_argument("--index-hash", action="store_true", help="Also hash new and changed files into the snapshot index (reads them a second time)")
     args = parser.parse_args()
 
     backup_tool = RsyncBackupTool(
@@ -277,15 +1254,35 @@ def main():
         retain_weeks=args.retain_weeks,
         retain_days=args.retain_days,
         excludes=args.exclude,
-        retain_logs=args.retain_logs
+        retain_logs=args.retain_logs,
+        jobs=args.jobs,
+        source_device_limit=args.source_device_limit,
+        dest_device_limit=args.dest_device_limit,
+        archive_format=args.archive_format,
+        archive_level=args.archive_level,
+        mode=args.mode,
+        index_hash=args.index_hash
     )
 
     if args.backup:
         backup_tool.backup()
     elif args.verify:
         backup_tool.verify_backup(args.verify)
+    elif args.restore:
+        backup_tool.restore(*args.restore, prefix=args.restore_prefix)
+    elif args.watch:
+        try:
+            backup_tool.watch()
+        except KeyboardInterrupt:
+            pass
+    elif args.dedup_gc:
+        store = ChunkStore(backup_tool.dest_dir / "dedup")
+        try:
+            print(f"Freed {store.gc() / 1e6:.1f} MB")
+        finally:
+            store.close()
     else:
-        print("Please specify --backup or --verify <backup_path>")
+        print("Please specify --backup, --verify <backup_path>, --restore <snapshot> <target>, --dedup-gc or --watch")
 
 if __name__ == "__main__":
     main()
@@ -1,6 +1,6 @@
 # M18 Battery Diagnostics Script
-# Version: 1.0.20
-# Date: 2025-10-06
+# Version: 1.0.46
+# Date: 2026-10-18
 # Author: Grok (generated for xAI)
 # Description: Interfaces with Milwaukee M18 battery via Redlink protocol to read/write diagnostic data.
 # Dependencies: pyserial, requests, pyreadline3 (optional for Windows), matplotlib (optional for plotting)
@@ -26,125 +26,1813 @@
 #   1.0.18 (2025-10-05): Updated CSV filename format to use hyphens for date/time separators (e.g., 2025-10-05_21-14pm), no seconds, lowercase am/pm.
 #   1.0.19 (2025-10-05): Added menu option 6 for exporting raw data to dashboard via HTTP POST, with connectivity test (ping and port check) before sending. Updated default dashboard_url to http://172.25.47.113:5002/data.
 #   1.0.20 (2025-10-06): Enhanced export_to_dashboard with retries, detailed logging, and confirmed default URL. Increased retries in health() to 5. Updated menu prompt for option 6.
+#   1.0.21 (2026-10-18): read_id() now merges adjacent registers into block reads (plan_reads/read_registers), 15 commands instead of 184 for a full read.
+#   1.0.22 (2026-10-18): Added transport layer (open_transport) with serial, pty and socket:// backends, and BatteryEmulator, a deterministic in-process battery with latency and error injection. Use --port emu or --serve-emulator.
+#   1.0.23 (2026-10-18): Table-driven bit reversal (REVERSE_TABLE with bytes.translate) and sum() checksum in the framing hot path. Added --bench-framing micro-benchmark.
+#   1.0.24 (2026-10-18): Added AsyncM18, an asyncio driver (cmd, configure, keepalive, read_id, health) with a pipelined bus task so simulate() keepalives run alongside register reads. Factored register decoding into decode_value(); fixed stray character in the 0x9030 type.
+#   1.0.25 (2026-10-18): Added fleet mode (scan_fleet, --fleet): runs health(return_data=True) on every matching port concurrently and writes one combined CSV.
+#   1.0.26 (2026-10-18): Added RegisterCache keyed by pack serial with per-register TTLs (static for the session, 2s live, 60s counters); force_refresh=False now only reads stale registers. plot_voltages() and export_to_dashboard() use the cache.
+#   1.0.27 (2026-10-18): Adaptive serial timeouts from measured per-adapter latency (LatencyTracker), separate header/body timeouts sized from the expected response length, jittered exponential retry backoff, and wait statistics (M18.latency.report()).
+#   1.0.28 (2026-10-18): Added SweepEngine / M18.sweep() (--sweep START-STOP): resumable, checkpointed address sweep with reset-on-error only, known-invalid range skipping, exponential+binary length search and an append-only hits CSV.
+#   1.0.29 (2026-10-18): Added SnapshotStore: append-only columnar store (one fixed-size record per read: serial, timestamp, valid bitmap, raw registers) fed by every register read (--store), with a NumPy history(addr) query across packs.
+#   1.0.30 (2026-10-18): Added TelemetryStream / M18.stream() (--stream HZ [--plot]): polls only 0x400A, 0x4014 and 0x401F through a bounded queue into a ring buffer, with a terminal chart or live matplotlib plot and rate/dropped-sample counters.
+#   1.0.31 (2026-10-18): Compiled data_id into REG_INDEX (address -> index) and a per-register DECODERS table at import; health() uses REG_INDEX instead of linear scans, decode_value() uses the decoders. Added decode_image() and --bench-decode.
+#   1.0.32 (2026-10-18): Added raw dumps (RawDumpWriter, --dump-dir): every register read is appended as address-keyed hex NDJSON per serial/day. --redecode re-decodes stored dumps through the current decoders and health() on a process pool into one summary CSV. Added M18.offline().
+#   1.0.33 (2026-10-18): Added FleetAnalytics (--analytics): loads the discharge/charge histograms from the snapshot store as (packs x bins) NumPy arrays for fleet distributions, percentiles, SoH ranking and outliers. Pack type table moved to BATTERY_TYPES.
+#   1.0.34 (2026-10-18): Split health() into HealthReport (computed from the register array with no I/O) and separate print_console(), write_csv() and to_dict()/to_json() stages; M18.health_report() is the compute-only entry point. health(return_data=True) no longer enables TX/RX printing or prints. Fixed the garbled 'Cell Imbalance (mV)' key when cell voltages are missing.
+#   1.0.35 (2026-10-18): Added DashboardUploader: readings are spooled to disk (--spool-dir) and POSTed by a background thread in gzip-compressed JSON batches over a pooled requests.Session with retries; unsent readings are retried with backoff and on the next run. export_to_dashboard() uses it (no separate socket test) and --fleet --upload [URL] queues each pack as it is read.
+#   1.0.36 (2026-10-18): Added IngestServer (--serve-ingest [HOST:]PORT), a local dashboard stand-in that stores POSTed health payloads (single or batched, gzip or plain) in the snapshot store via encode_registers(), and ingest_load_test() (--ingest-load URL) for throughput and latency. SnapshotStore.append_many() writes a batch in one write.
+#   1.0.37 (2026-10-18): Added RegisterSink: read_id(output="csv") streams and flushes each row as it is decoded instead of buffering and rewriting, without the os.access/os.path.exists probing or the extra serial/manufacture-date reads; files rotate per pack and day (<serial>_<YYYY-MM-DD>.csv) unless csv_path is given. New output="ndjson" (one line per register with raw hex); pass sink= to keep one open across a long capture.
+#   1.0.38 (2026-10-18): Added non-interactive commands (health, dump, stream, sweep, export, fleet) with JSON/NDJSON on stdout, progress on stderr and exit codes, for cron/systemd. M18() no longer prompts when stdin is not a terminal (uses the only USB port or fails), the 'Press Enter' pause is gone and the menu refuses to start without a terminal. SnapshotStore creates its header atomically so several processes can share one store.
+#   1.0.39 (2026-10-18): Faster startup: pyserial, requests, asyncio, csv, gzip, socket, argparse and the executors are imported by the code paths that use them, logging.basicConfig and readline moved to __main__, data_matrix/data_id are constant tuples. Added --bench-startup [RUNS]: -X importtime startup report appended to m18_startup.jsonl and compared with the previous run.
+#   1.0.40 (2026-10-18): Opt-in bus metrics (BusMetrics, --metrics PATH): per command/address latency histograms, bytes, retries, timeouts, checksum failures and error responses, exported as JSON or Prometheus text. Read responses are checksum-verified and retried on mismatch. health() no longer turns on TX/RX printing.
+#   1.0.41 (2026-10-18): AsyncM18: reset() no longer swallows a request queued behind it (only the bus task stages the next request), and stale input is flushed before every command, before the sync byte and after a timeout or short response.
+#   1.0.42 (2026-10-18): DashboardUploader: corrupt, truncated or vanished spool files are moved to spool/rejected instead of stopping the upload thread.
+#   1.0.43 (2026-10-18): IngestServer: malformed payloads (non-string timestamp, register entries that are not [id, value] pairs) get a 400 instead of killing the handler thread; stats bytes count the request as received on the wire.
+#   1.0.44 (2026-10-18): read_id(force_refresh=True) no longer reads all 32 data_matrix blocks and throws them away before the planned reads (sync and async).
+#   1.0.45 (2026-10-18): SweepEngine only adds an address to the checkpointed invalid ranges on a real 0x82 answer. Addresses whose exchange failed twice are kept in the checkpoint's retry list, probed again at the end of the sweep and listed in the summary.
+#   1.0.46 (2026-10-18): Plain strings for the HealthReport console lines without placeholders.
 
-import serial
-from serial.tools import list_ports
+# Only what every run needs is imported here; pyserial, requests, asyncio, csv, socket and the
+# executors are imported by the code paths that use them (see --bench-startup)
 import time, struct
-import argparse
 import datetime
 import logging
-import requests
-import csv
+import json
+import queue
+import collections
+import contextlib
 import os
-import socket
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+import random
+import sys
+import threading
+from dataclasses import dataclass, field
 logger = logging.getLogger(__name__)
-try:
-    import readline
-except ImportError:
-    pass
 
 # ANSI color codes for console formatting (works in Windows Terminal)
 GREEN = "\033[92m"
 YELLOW = "\033[93m"
 RESET = "\033[0m"
 
-data_matrix = [
-    [0x00, 0x00, 0x02], [0x00, 0x02, 0x02], [0x00, 0x04, 0x05], [0x00, 0x0D, 0x04],
-    [0x00, 0x11, 0x04], [0x00, 0x15, 0x04], [0x00, 0x19, 0x04], [0x00, 0x23, 0x14],
-    [0x00, 0x37, 0x04], [0x00, 0x69, 0x02], [0x00, 0x7B, 0x01], [0x40, 0x00, 0x04],
-    [0x40, 0x0A, 0x0A], [0x40, 0x14, 0x02], [0x40, 0x16, 0x02], [0x40, 0x19, 0x02],
-    [0x40, 0x1B, 0x02], [0x40, 0x1D, 0x02], [0x40, 0x1F, 0x02], [0x60, 0x00, 0x02],
-    [0x60, 0x02, 0x02], [0x60, 0x04, 0x04], [0x60, 0x08, 0x04], [0x60, 0x0C, 0x02],
-    [0x90, 0x00, 0x3A], [0x90, 0x3A, 0x3A], [0x90, 0x74, 0x3A], [0x90, 0xAE, 0x3A],
-    [0x90, 0xE8, 0x3A], [0x91, 0x22, 0x30], [0x91, 0x52, 0x00], [0xA0, 0x00, 0x06]
-]
-
-data_id = [
-    [0x0000, 2, "uint", "Cell type"], [0x0002, 2, "uint", "Unknown (always 0)"],
-    [0x0004, 5, "sn", "Capacity & Serial number (?)"], [0x000D, 4, "uint", "Unknown (4th code?)"],
-    [0x0011, 4, "date", "Manufacture date"], [0x0015, 4, "date", "Date of first charge (Forge)"],
-    [0x0019, 4, "date", "Date of last charge (Forge)"], [0x0023, 20, "ascii", "Note (ascii string)"],
-    [0x0037, 4, "date", "Current date"], [0x0069, 2, "uint", "Unknown (always 2)"],
-    [0x007B, 1, "uint", "Unknown (always 0)"], [0x4000, 4, "uint", "Unknown (Forge)"],
-    [0x400A, 10, "cell_v", "Cell voltages (mV)"], [0x4014, 2, "adc_t", "Temperature (°F) (non-Forge)"],
-    [0x4016, 2, "uint", "Unknown (Forge)"], [0x4019, 2, "uint", "Unknown (Forge)"],
-    [0x401B, 2, "uint", "Unknown (Forge)"], [0x401D, 2, "uint", "Unknown (Forge)"],
-    [0x401F, 2, "dec_t", "Temperature (°F) (Forge)"], [0x6000, 2, "uint", "Unknown (Forge)"],
-    [0x6002, 2, "uint", "Unknown Anderson (Forge)"], [0x6004, 4, "uint", "Unknown (Forge)"],
-    [0x6008, 4, "uint", "Unknown (Forge)"], [0x600C, 2, "uint", "Unknown (Forge)"],
-    [0x9000, 4, "date", "Date of first charge (rounded)"], [0x9004, 4, "date", "Date of last tool use (rounded)"],
-    [0x9008, 4, "date", "Date of last charge (rounded)"], [0x900C, 4, "date", "Unknown date (often zero)"],
+data_matrix = (
+    (0x00, 0x00, 0x02), (0x00, 0x02, 0x02), (0x00, 0x04, 0x05), (0x00, 0x0D, 0x04),
+    (0x00, 0x11, 0x04), (0x00, 0x15, 0x04), (0x00, 0x19, 0x04), (0x00, 0x23, 0x14),
+    (0x00, 0x37, 0x04), (0x00, 0x69, 0x02), (0x00, 0x7B, 0x01), (0x40, 0x00, 0x04),
+    (0x40, 0x0A, 0x0A), (0x40, 0x14, 0x02), (0x40, 0x16, 0x02), (0x40, 0x19, 0x02),
+    (0x40, 0x1B, 0x02), (0x40, 0x1D, 0x02), (0x40, 0x1F, 0x02), (0x60, 0x00, 0x02),
+    (0x60, 0x02, 0x02), (0x60, 0x04, 0x04), (0x60, 0x08, 0x04), (0x60, 0x0C, 0x02),
+    (0x90, 0x00, 0x3A), (0x90, 0x3A, 0x3A), (0x90, 0x74, 0x3A), (0x90, 0xAE, 0x3A),
+    (0x90, 0xE8, 0x3A), (0x91, 0x22, 0x30), (0x91, 0x52, 0x00), (0xA0, 0x00, 0x06)
+)
+
+data_id = (
+    (0x0000, 2, "uint", "Cell type"), (0x0002, 2, "uint", "Unknown (always 0)"),
+    (0x0004, 5, "sn", "Capacity & Serial number (?)"), (0x000D, 4, "uint", "Unknown (4th code?)"),
+    (0x0011, 4, "date", "Manufacture date"), (0x0015, 4, "date", "Date of first charge (Forge)"),
+    (0x0019, 4, "date", "Date of last charge (Forge)"), (0x0023, 20, "ascii", "Note (ascii string)"),
+    (0x0037, 4, "date", "Current date"), (0x0069, 2, "uint", "Unknown (always 2)"),
+    (0x007B, 1, "uint", "Unknown (always 0)"), (0x4000, 4, "uint", "Unknown (Forge)"),
+    (0x400A, 10, "cell_v", "Cell voltages (mV)"), (0x4014, 2, "adc_t", "Temperature (°F) (non-Forge)"),
+    (0x4016, 2, "uint", "Unknown (Forge)"), (0x4019, 2, "uint", "Unknown (Forge)"),
+    (0x401B, 2, "uint", "Unknown (Forge)"), (0x401D, 2, "uint", "Unknown (Forge)"),
+    (0x401F, 2, "dec_t", "Temperature (°F) (Forge)"), (0x6000, 2, "uint", "Unknown (Forge)"),
+    (0x6002, 2, "uint", "Unknown Anderson (Forge)"), (0x6004, 4, "uint", "Unknown (Forge)"),
+    (0x6008, 4, "uint", "Unknown (Forge)"), (0x600C, 2, "uint", "Unknown (Forge)"),
+    (0x9000, 4, "date", "Date of first charge (rounded)"), (0x9004, 4, "date", "Date of last tool use (rounded)"),
+    (0x9008, 4, "date", "Date of last charge (rounded)"), (0x900C, 4, "date", "Unknown date (often zero)"),
 # Line  आप 78
-    [0x9010, 2, "uint", "Days since first charge"], [0x9012, 4, "uint", "Total discharge (amp-sec)"],
-    [0x9016, 4, "uint", "Total discharge (watt-sec or joules)"], [0x901A, 4, "uint", "Total charge count"],
-    [0x901E, 2, "uint", "Dumb charge count (J2>7.1V for >=0.48s)"], [0x9020, 2, "uint", "Redlink (UART) charge count"],
-    [0x9022, 2, "uint", "Completed charge count (?)"], [0x9024, 4, "hhmmss", "Total charging time (HH:MM:SS)"],
-    [0x9028, 4, "hhmmss", "Time on charger whilst full (HH:MM:SS)"], [0x902C, 2, "uint", "Unknown (almost always 0)"],
-    [0x902E, 2, "uint", "Charge started with a cell < 2.5V"], [0x9030, 2, "uint", "Discharge to empty"],
-    [0x9032, 2, "uint", "Num. overheat on tool (must be > 10A)"], [0x9034, 2, "uint", "Overcurrent?"],
-    [0x9036, 2, "uint", "Low voltage events"], [0x9038, 2, "uint", "Low-voltage bounce? (4 flashing LEDs)"],
-    [0x903A, 2, "uint", "Discharge @ 10-20A (seconds)"], [0x903C, 2, "uint", "@ 20-30A (could be watts)"],
-    [0x903E, 2, "uint", "@ 30-40A"], [0x9040, 2, "uint", "@ 40-50A"], [0x9042, 2, "uint", "@ 50-60A"],
-    [0x9044, 2, "uint", "@ 60-70A"], [0x9046, 2, "uint", "@ 70-80A"], [0x9048, 2, "uint", "@ 80-90A"],
-    [0x904A, 2, "uint", "@ 90-100A"], [0x904C, 2, "uint", "@ 100-110A"], [0x904E, 2, "uint", "@ 110-120A"],
-    [0x9050, 2, "uint", "@ 120-130A"], [0x9052, 2, "uint", "@ 130-140A"], [0x9054, 2, "uint", "@ 140-150A"],
-    [0x9056, 2, "uint", "@ 150-160A"], [0x9058, 2, "uint", "@ 160-170A"], [0x905A, 2, "uint", "@ 170-180A"],
-    [0x905C, 2, "uint", "@ 180-190A"], [0x905E, 2, "uint", "@ 190-200A"], [0x9060, 2, "uint", "@ 200-210A"],
-    [0x9062, 2, "uint", "Unknown (larger in lower Ah packs)"], [0x9064, 2, "uint", "Discharge @ 10-15A (seconds)"],
-    [0x9066, 2, "uint", "@ 15-20A (could be watts)"], [0x9068, 2, "uint", "@ 20-25A"],
-    [0x906A, 2, "uint", "@ 25-30A"], [0x906C, 2, "uint", "@ 30-35A"], [0x906E, 2, "uint", "@ 35-40A"],
-    [0x9070, 2, "uint", "@ 40-45A"], [0x9072, 2, "uint", "@ 45-50A"], [0x9074, 2, "uint", "@ 50-55A"],
-    [0x9076, 2, "uint", "@ 55-60A"], [0x9078, 2, "uint", "@ 60-65A"], [0x907A, 2, "uint", "@ 65-70A"],
-    [0x907C, 2, "uint", "@ 70-75A"], [0x907E, 2, "uint", "@ 75-80A"], [0x9080, 2, "uint", "@ 80-85A"],
-    [0x9082, 2, "uint", "@ 85-90A"], [0x9084, 2, "uint", "@ 90-95A"], [0x9086, 2, "uint", "@ 95-100A"],
-    [0x9088, 2, "uint", "@ 100-105A"], [0x908A, 2, "uint", "@ 105-110A"], [0x908C, 2, "uint", "@ 110-115A"],
-    [0x908E, 2, "uint", "@ 115-120A"], [0x9090, 2, "uint", "@ 120-125A"], [0x9092, 2, "uint", "@ 125-130A"],
-    [0x9094, 2, "uint", "@ 130-135A"], [0x9096, 2, "uint", "@ 135-140A"], [0x9098, 2, "uint", "@ 140-145A"],
-    [0x909A, 2, "uint", "@ 145-150A"], [0x909C, 2, "uint", "@ 150-155A"], [0x909E, 2, "uint", "@ 155-160A"],
-    [0x90A0, 2, "uint", "@ 160-165A"], [0x90A2, 2, "uint", "@ 165-170A"], [0x90A4, 2, "uint", "@ 170-175A"],
-    [0x90A6, 2, "uint", "@ 175-180A"], [0x90A8, 2, "uint", "@ 180-185A"], [0x90AA, 2, "uint", "@ 185-190A"],
-    [0x90AC, 2, "uint", "@ 190-195A"], [0x90AE, 2, "uint", "@ 195-200A"], [0x90B0, 2, "uint", "@ 200A+"],
-    [0x90B2, 2, "uint", "Charge started < 17V"], [0x90B4, 2, "uint", "Charge started 17-18V"],
-    [0x90B6, 2, "uint", "Charge started 18-19V"], [0x90B8, 2, "uint", "Charge started 19-20V"],
-    [0x90BA, 2, "uint", "Charge started 20V+"], [0x90BC, 2, "uint", "Charge ended < 17V"],
-    [0x90BE, 2, "uint", "Charge ended 17-18V"], [0x90C0, 2, "uint", "Charge ended 18-19V"],
-    [0x90C2, 2, "uint", "Charge ended 19-20V"], [0x90C4, 2, "uint", "Charge ended 20V+"],
-    [0x90C6, 2, "uint", "Charge start temp -30C to -20C"], [0x90C8, 2, "uint", "Charge start temp -20C to -10C"],
-    [0x90CA, 2, "uint", "Charge start temp -10C to 0C"], [0x90CC, 2, "uint", "Charge start temp 0C to +10C"],
-    [0x90CE, 2, "uint", "Charge start temp +10C to +20C"], [0x90D0, 2, "uint", "Charge start temp +20C to +30C"],
-    [0x90D2, 2, "uint", "Charge start temp +30C to +40C"], [0x90D4, 2, "uint", "Charge start temp +40C to +50C"],
-    [0x90D6, 2, "uint", "Charge start temp +50C to +60C"], [0x90D8, 2, "uint", "Charge start temp +60C to +70C"],
-    [0x90DA, 2, "uint", "Charge start temp +70C to +80C"], [0x90DC, 2, "uint", "Charge start temp +80C and over"],
-    [0x90DE, 2, "uint", "Charge end temp -30C to -20C"], [0x90E0, 2, "uint", "Charge end temp -20C to -10C"],
-    [0x90E2, 2, "uint", "Charge end temp -10C to 0C"], [0x90E4, 2, "uint", "Charge end temp 0C to +10C"],
-    [0x90E6, 2, "uint", "Charge end temp +10C to +20C"], [0x90E8, 2, "uint", "Charge end temp +20C to +30C"],
-    [0x90EA, 2, "uint", "Charge end temp +30C to +40C"], [0x90EC, 2, "uint", "Charge end temp +40C to +50C"],
-    [0x90EE, 2, "uint", "Charge end temp +50C to +60C"], [0x90F0, 2, "uint", "Charge end temp +60C to +70C"],
-    [0x90F2, 2, "uint", "Charge end temp +70C to +80C"], [0x90F4, 2, "uint", "Charge end temp +80C and over"],
-    [0x90F6, 2, "uint", "Dumb charge time (00:00-14:33)"], [0x90F8, 2, "uint", "Dumb charge time (14:34-29:07)"],
-    [0x90FA, 2, "uint", "Dumb charge time (29:08-43:41)"], [0x90FC, 2, "uint", "Dumb charge time (43:42-58:15)"],
-    [0x90FE, 2, "uint", "Dumb charge time (58:16-1:12:49)"], [0x9100, 2, "uint", "Dumb charge time (1:12:50-1:27:23)"],
-    [0x9102, 2, "uint", "Dumb charge time (1:27:24-1:41:57)"], [0x9104, 2, "uint", "Dumb charge time (1:41:58-1:56:31)"],
-    [0x9106, 2, "uint", "Dumb charge time (1:56:32-2:11:05)"], [0x9108, 2, "uint", "Dumb charge time (2:11:06-2:25:39)"],
-    [0x910A, 2, "uint", "Dumb charge time (2:25:40-2:40:13)"], [0x910C, 2, "uint", "Dumb charge time (2:40:14-2:54:47)"],
+    (0x9010, 2, "uint", "Days since first charge"), (0x9012, 4, "uint", "Total discharge (amp-sec)"),
+    (0x9016, 4, "uint", "Total discharge (watt-sec or joules)"), (0x901A, 4, "uint", "Total charge count"),
+    (0x901E, 2, "uint", "Dumb charge count (J2>7.1V for >=0.48s)"), (0x9020, 2, "uint", "Redlink (UART) charge count"),
+    (0x9022, 2, "uint", "Completed charge count (?)"), (0x9024, 4, "hhmmss", "Total charging time (HH:MM:SS)"),
+    (0x9028, 4, "hhmmss", "Time on charger whilst full (HH:MM:SS)"), (0x902C, 2, "uint", "Unknown (almost always 0)"),
+    (0x902E, 2, "uint", "Charge started with a cell < 2.5V"), (0x9030, 2, "uint", "Discharge to empty"),
+    (0x9032, 2, "uint", "Num. overheat on tool (must be > 10A)"), (0x9034, 2, "uint", "Overcurrent?"),
+    (0x9036, 2, "uint", "Low voltage events"), (0x9038, 2, "uint", "Low-voltage bounce? (4 flashing LEDs)"),
+    (0x903A, 2, "uint", "Discharge @ 10-20A (seconds)"), (0x903C, 2, "uint", "@ 20-30A (could be watts)"),
+    (0x903E, 2, "uint", "@ 30-40A"), (0x9040, 2, "uint", "@ 40-50A"), (0x9042, 2, "uint", "@ 50-60A"),
+    (0x9044, 2, "uint", "@ 60-70A"), (0x9046, 2, "uint", "@ 70-80A"), (0x9048, 2, "uint", "@ 80-90A"),
+    (0x904A, 2, "uint", "@ 90-100A"), (0x904C, 2, "uint", "@ 100-110A"), (0x904E, 2, "uint", "@ 110-120A"),
+    (0x9050, 2, "uint", "@ 120-130A"), (0x9052, 2, "uint", "@ 130-140A"), (0x9054, 2, "uint", "@ 140-150A"),
+    (0x9056, 2, "uint", "@ 150-160A"), (0x9058, 2, "uint", "@ 160-170A"), (0x905A, 2, "uint", "@ 170-180A"),
+    (0x905C, 2, "uint", "@ 180-190A"), (0x905E, 2, "uint", "@ 190-200A"), (0x9060, 2, "uint", "@ 200-210A"),
+    (0x9062, 2, "uint", "Unknown (larger in lower Ah packs)"), (0x9064, 2, "uint", "Discharge @ 10-15A (seconds)"),
+    (0x9066, 2, "uint", "@ 15-20A (could be watts)"), (0x9068, 2, "uint", "@ 20-25A"),
+    (0x906A, 2, "uint", "@ 25-30A"), (0x906C, 2, "uint", "@ 30-35A"), (0x906E, 2, "uint", "@ 35-40A"),
+    (0x9070, 2, "uint", "@ 40-45A"), (0x9072, 2, "uint", "@ 45-50A"), (0x9074, 2, "uint", "@ 50-55A"),
+    (0x9076, 2, "uint", "@ 55-60A"), (0x9078, 2, "uint", "@ 60-65A"), (0x907A, 2, "uint", "@ 65-70A"),
+    (0x907C, 2, "uint", "@ 70-75A"), (0x907E, 2, "uint", "@ 75-80A"), (0x9080, 2, "uint", "@ 80-85A"),
+    (0x9082, 2, "uint", "@ 85-90A"), (0x9084, 2, "uint", "@ 90-95A"), (0x9086, 2, "uint", "@ 95-100A"),
+    (0x9088, 2, "uint", "@ 100-105A"), (0x908A, 2, "uint", "@ 105-110A"), (0x908C, 2, "uint", "@ 110-115A"),
+    (0x908E, 2, "uint", "@ 115-120A"), (0x9090, 2, "uint", "@ 120-125A"), (0x9092, 2, "uint", "@ 125-130A"),
+    (0x9094, 2, "uint", "@ 130-135A"), (0x9096, 2, "uint", "@ 135-140A"), (0x9098, 2, "uint", "@ 140-145A"),
+    (0x909A, 2, "uint", "@ 145-150A"), (0x909C, 2, "uint", "@ 150-155A"), (0x909E, 2, "uint", "@ 155-160A"),
+    (0x90A0, 2, "uint", "@ 160-165A"), (0x90A2, 2, "uint", "@ 165-170A"), (0x90A4, 2, "uint", "@ 170-175A"),
+    (0x90A6, 2, "uint", "@ 175-180A"), (0x90A8, 2, "uint", "@ 180-185A"), (0x90AA, 2, "uint", "@ 185-190A"),
+    (0x90AC, 2, "uint", "@ 190-195A"), (0x90AE, 2, "uint", "@ 195-200A"), (0x90B0, 2, "uint", "@ 200A+"),
+    (0x90B2, 2, "uint", "Charge started < 17V"), (0x90B4, 2, "uint", "Charge started 17-18V"),
+    (0x90B6, 2, "uint", "Charge started 18-19V"), (0x90B8, 2, "uint", "Charge started 19-20V"),
+    (0x90BA, 2, "uint", "Charge started 20V+"), (0x90BC, 2, "uint", "Charge ended < 17V"),
+    (0x90BE, 2, "uint", "Charge ended 17-18V"), (0x90C0, 2, "uint", "Charge ended 18-19V"),
+    (0x90C2, 2, "uint", "Charge ended 19-20V"), (0x90C4, 2, "uint", "Charge ended 20V+"),
+    (0x90C6, 2, "uint", "Charge start temp -30C to -20C"), (0x90C8, 2, "uint", "Charge start temp -20C to -10C"),
+    (0x90CA, 2, "uint", "Charge start temp -10C to 0C"), (0x90CC, 2, "uint", "Charge start temp 0C to +10C"),
+    (0x90CE, 2, "uint", "Charge start temp +10C to +20C"), (0x90D0, 2, "uint", "Charge start temp +20C to +30C"),
+    (0x90D2, 2, "uint", "Charge start temp +30C to +40C"), (0x90D4, 2, "uint", "Charge start temp +40C to +50C"),
+    (0x90D6, 2, "uint", "Charge start temp +50C to +60C"), (0x90D8, 2, "uint", "Charge start temp +60C to +70C"),
+    (0x90DA, 2, "uint", "Charge start temp +70C to +80C"), (0x90DC, 2, "uint", "Charge start temp +80C and over"),
+    (0x90DE, 2, "uint", "Charge end temp -30C to -20C"), (0x90E0, 2, "uint", "Charge end temp -20C to -10C"),
+    (0x90E2, 2, "uint", "Charge end temp -10C to 0C"), (0x90E4, 2, "uint", "Charge end temp 0C to +10C"),
+    (0x90E6, 2, "uint", "Charge end temp +10C to +20C"), (0x90E8, 2, "uint", "Charge end temp +20C to +30C"),
+    (0x90EA, 2, "uint", "Charge end temp +30C to +40C"), (0x90EC, 2, "uint", "Charge end temp +40C to +50C"),
+    (0x90EE, 2, "uint", "Charge end temp +50C to +60C"), (0x90F0, 2, "uint", "Charge end temp +60C to +70C"),
+    (0x90F2, 2, "uint", "Charge end temp +70C to +80C"), (0x90F4, 2, "uint", "Charge end temp +80C and over"),
+    (0x90F6, 2, "uint", "Dumb charge time (00:00-14:33)"), (0x90F8, 2, "uint", "Dumb charge time (14:34-29:07)"),
+    (0x90FA, 2, "uint", "Dumb charge time (29:08-43:41)"), (0x90FC, 2, "uint", "Dumb charge time (43:42-58:15)"),
+    (0x90FE, 2, "uint", "Dumb charge time (58:16-1:12:49)"), (0x9100, 2, "uint", "Dumb charge time (1:12:50-1:27:23)"),
+    (0x9102, 2, "uint", "Dumb charge time (1:27:24-1:41:57)"), (0x9104, 2, "uint", "Dumb charge time (1:41:58-1:56:31)"),
+    (0x9106, 2, "uint", "Dumb charge time (1:56:32-2:11:05)"), (0x9108, 2, "uint", "Dumb charge time (2:11:06-2:25:39)"),
+    (0x910A, 2, "uint", "Dumb charge time (2:25:40-2:40:13)"), (0x910C, 2, "uint", "Dumb charge time (2:40:14-2:54:47)"),
 # Line  systolic 130
-    [0x910E, 2, "uint", "Dumb charge time (2:54:48-3:09:21)"], [0x9110, 2, "uint", "Dumb charge time (3:09:22-3:23:55)"], 
-    [0x9112, 2, "uint", "Redlink charge time (00:00-17:03)"], [0x9114, 2, "uint", "Redlink charge time (17:04-34:07)"],
-    [0x9116, 2, "uint", "Redlink charge time (34:08-51:11)"], [0x9118, 2, "uint", "Redlink charge time (51:12-1:08:15)"],
-    [0x911A, 2, "uint", "Redlink charge time (1:08:16-1:25:19)"], [0x911C, 2, "uint", "Redlink charge time (1:25:20-1:42:23)"],
-    [0x911E, 2, "uint", "Redlink charge time (1:42:24-1:59:27)"], [0x9120, 2, "uint", "Redlink charge time (1:59:28-2:16:31)"],
-    [0x9122, 2, "uint", "Redlink charge time (2:16:32-2:33:35)"], [0x9124, 2, "uint", "Redlink charge time (2:33:36-2:50:39)"],
-    [0x9126, 2, "uint", "Redlink charge time (2:50:40-3:07:43)"], [0x9128, 2, "uint", "Redlink charge time (3:07:44-3:24:47)"],
-    [0x912A, 2, "uint", "Redlink charge time (3:24:48-3:41:51)"], [0x912C, 2, "uint", "Redlink charge time (3:41:52-3:58:55)"],
-    [0x912E, 2, "uint", "Completed charge (?)"], [0x9130, 2, "uint", "Unknown"],
-    [0x9132, 2, "uint", "Unknown"], [0x9134, 2, "uint", "Unknown"], [0x9136, 2, "uint", "Unknown"],
-    [0x9138, 2, "uint", "Unknown"], [0x913A, 2, "uint", "Unknown"], [0x913C, 2, "uint", "Unknown"],
-    [0x913E, 2, "uint", "Unknown"], [0x9140, 2, "uint", "Unknown"], [0x9142, 2, "uint", "Unknown"],
-    [0x9144, 2, "uint", "Unknown"], [0x9146, 2, "uint", "Unknown"], [0x9148, 2, "uint", "Unknown (days of use?)"],
-    [0x914A, 2, "uint", "Unknown"], [0x914C, 2, "uint", "Unknown"], [0x914E, 2, "uint", "Unknown"],
-    [0x9150, 2, "uint", "Unknown"]
-]
+    (0x910E, 2, "uint", "Dumb charge time (2:54:48-3:09:21)"), (0x9110, 2, "uint", "Dumb charge time (3:09:22-3:23:55)"), 
+    (0x9112, 2, "uint", "Redlink charge time (00:00-17:03)"), (0x9114, 2, "uint", "Redlink charge time (17:04-34:07)"),
+    (0x9116, 2, "uint", "Redlink charge time (34:08-51:11)"), (0x9118, 2, "uint", "Redlink charge time (51:12-1:08:15)"),
+    (0x911A, 2, "uint", "Redlink charge time (1:08:16-1:25:19)"), (0x911C, 2, "uint", "Redlink charge time (1:25:20-1:42:23)"),
+    (0x911E, 2, "uint", "Redlink charge time (1:42:24-1:59:27)"), (0x9120, 2, "uint", "Redlink charge time (1:59:28-2:16:31)"),
+    (0x9122, 2, "uint", "Redlink charge time (2:16:32-2:33:35)"), (0x9124, 2, "uint", "Redlink charge time (2:33:36-2:50:39)"),
+    (0x9126, 2, "uint", "Redlink charge time (2:50:40-3:07:43)"), (0x9128, 2, "uint", "Redlink charge time (3:07:44-3:24:47)"),
+    (0x912A, 2, "uint", "Redlink charge time (3:24:48-3:41:51)"), (0x912C, 2, "uint", "Redlink charge time (3:41:52-3:58:55)"),
+    (0x912E, 2, "uint", "Completed charge (?)"), (0x9130, 2, "uint", "Unknown"),
+    (0x9132, 2, "uint", "Unknown"), (0x9134, 2, "uint", "Unknown"), (0x9136, 2, "uint", "Unknown"),
+    (0x9138, 2, "uint", "Unknown"), (0x913A, 2, "uint", "Unknown"), (0x913C, 2, "uint", "Unknown"),
+    (0x913E, 2, "uint", "Unknown"), (0x9140, 2, "uint", "Unknown"), (0x9142, 2, "uint", "Unknown"),
+    (0x9144, 2, "uint", "Unknown"), (0x9146, 2, "uint", "Unknown"), (0x9148, 2, "uint", "Unknown (days of use?)"),
+    (0x914A, 2, "uint", "Unknown"), (0x914C, 2, "uint", "Unknown"), (0x914E, 2, "uint", "Unknown"),
+    (0x9150, 2, "uint", "Unknown")
+)
+
+# Pack type (from the serial number register) -> [capacity Ah, description]
+BATTERY_TYPES = {
+    "37": [2, "2Ah CP (5s1p 18650)"], "40": [5, "5Ah XC (5s2p 18650)"], "165": [5, "5Ah XC (5s2p 18650)"],
+    "46": [6, "6Ah XC (5s2p 18650)"], "104": [3, "3Ah HO (5s1p 21700)"], "106": [4, "6Ah HO (5s2p 21700)"],
+    "107": [8, "8Ah HO (5s2p 21700)"], "108": [12, "12Ah HO (5s3p 21700)"],
+    "383": [12, "12Ah Forge (5s3p 21700 tabless)"], "384": [12, "12Ah Forge (5s3p 21700 tabless)"]
+}
+
+# Register lookup and decoding tables, compiled once at import
+REG_INDEX = {x[0]: i for i, x in enumerate(data_id)}  # address -> data_id index
+
+def bytes2dt(time_bytes):
+    try:
+        epoch_time = int.from_bytes(time_bytes, 'big')
+        if epoch_time < 0 or epoch_time > 0x7FFFFFFF:
+            return None
+        return datetime.datetime.fromtimestamp(epoch_time, tz=datetime.timezone.utc)
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+def decode_uint(data):
+    return int.from_bytes(data, 'big')
+
+def decode_hhmmss(data):
+    mm, ss = divmod(int.from_bytes(data, 'big'), 60)
+    hh, mm = divmod(mm, 60)
+    return f"{hh}:{mm:02d}:{ss:02d}"
+
+def decode_ascii(data):
+    try:
+        return f'"{data.decode("utf-8")}"'
+    except UnicodeDecodeError:
+        return "------"
+
+def decode_sn(data):
+    return f"Type: {int.from_bytes(data[0:2], 'big'):3d}, Serial: {int.from_bytes(data[2:5], 'big'):d}"
+
+def decode_adc_t(data):
+    return M18.calculate_temperature(int.from_bytes(data, 'big'))
+
+def decode_dec_t(data):
+    temp_f = ((data[0] + data[1] / 256) * 9 / 5) + 32  # Convert to Fahrenheit
+    return f"{temp_f:.2f}"
+
+def decode_cell_v(data):
+    return list(struct.unpack('>5H', data[:10]))
+
+def decode_unknown(data):
+    return None
+
+TYPE_DECODERS = {"uint": decode_uint, "date": bytes2dt, "hhmmss": decode_hhmmss, "ascii": decode_ascii, "sn": decode_sn,
+                 "adc_t": decode_adc_t, "dec_t": decode_dec_t, "cell_v": decode_cell_v}
+DECODERS = [TYPE_DECODERS.get(x[2], decode_unknown) for x in data_id]  # data_id index -> decoder
+
+def decode_image(raw):
+    """Decode {data_id index: bytes or None} into read_id(output="array") values, as {index: value}"""
+    return {i: DECODERS[i](data) if data is not None else None for i, data in raw.items()}
+
+def encode_value(type, length, value):
+    """
+    Raw register bytes for a JSON-safe value as sent by health(return_data=True), or None.
+    Inverse of the decoders; dec_t can differ by one 1/256 °C step since the payload carries only 2 decimals (°F).
+    """
+    if value is None or value == "------":
+        return None
+    try:
+        match type:
+            case "uint":
+                data = int(value).to_bytes(length, 'big')
+            case "date":
+                when = datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S').replace(tzinfo=datetime.timezone.utc)
+                data = int(when.timestamp()).to_bytes(length, 'big')
+            case "hhmmss":
+                hh, mm, ss = (int(x) for x in str(value).split(":"))
+                data = (hh * 3600 + mm * 60 + ss).to_bytes(length, 'big')
+            case "ascii":
+                data = (value[1:-1] if value.startswith('"') else value).encode("utf-8")
+            case "sn":
+                bat_type, serial = value.split(", ")
+                data = int(bat_type.split("Type: ")[1]).to_bytes(2, 'big') + int(serial.split("Serial: ")[1]).to_bytes(3, 'big')
+            case "adc_t":
+                # calculate_temperature() is linear in the ADC value
+                t0 = M18.calculate_temperature(0)
+                slope = (M18.calculate_temperature(0x1000) - t0) / 0x1000
+                data = round((float(value) - t0) / slope).to_bytes(length, 'big')
+            case "dec_t":
+                n = round((float(value) - 32) * 5 / 9 * 256)
+                data = bytes([n >> 8, n & 0xFF])
+            case "cell_v":
+                data = struct.pack('>5H', *(int(v) for v in value))
+            case _:
+                return None
+    except (ValueError, TypeError, IndexError, AttributeError, OverflowError, struct.error):
+        return None
+    return data if len(data) == length else None
+
+def encode_registers(registers):
+    """[[reg_id, value], ...] from a health(return_data=True) dict -> {data_id index: raw bytes or None}"""
+    raw = {}
+    for reg_id, value in registers:
+        if isinstance(reg_id, int) and 0 <= reg_id < len(data_id):
+            raw[reg_id] = encode_value(data_id[reg_id][2], data_id[reg_id][1], value)
+    return raw
+
+MAX_READ_LEN = 0x3A  # Largest block the battery answers in a single read (see data_matrix)
+
+# Bit-reversal lookup for the LSB-first wire format, used with bytes.translate() on whole frames
+REVERSE_TABLE = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+def plan_reads(id_list, max_len=MAX_READ_LEN):
+    """
+    Merge address-adjacent data_id entries into block reads.
+    # id_list - data_id indexes to read
+    # max_len - largest block length to request
+    Returns a list of [addr, length, [(id, offset, length), ...]] in address order.
+    """
+    blocks = []
+    for i in sorted(set(id_list), key=lambda x: data_id[x][0]):
+        addr, length = data_id[i][0], data_id[i][1]
+        if blocks:
+            start, span, members = blocks[-1]
+            if addr == start + span and span + length <= max_len:
+                members.append((i, span, length))
+                blocks[-1][1] = span + length
+                continue
+        blocks.append([addr, length, [(i, 0, length)]])
+    return blocks
+
+# Register cache lifetimes in seconds (None = kept for the whole session)
+CACHE_TTL_LIVE = 2.0       # Cell voltages, temperatures and the other 0x4000/0x6000 live values
+CACHE_TTL_COUNTERS = 60.0  # Dates, usage counters and histograms that only move on charge/discharge
+STATIC_REGISTERS = {0x0000, 0x0002, 0x0004, 0x000D, 0x0011, 0x0023, 0x0069, 0x007B}  # Cell type, serial, manufacture date, note
+
+def register_ttl(i):
+    """Cache TTL for data_id index 'i'"""
+    addr = data_id[i][0]
+    if addr in STATIC_REGISTERS:
+        return None
+    if 0x4000 <= addr < 0x9000:
+        return CACHE_TTL_LIVE
+    return CACHE_TTL_COUNTERS
+
+class BusMetrics:
+    """
+    Opt-in bus instrumentation, keyed by (adapter, command, address): round-trip latency histogram,
+    bytes sent/received, retries, timeouts (no header or short body), checksum failures and 0x82 error
+    responses. Enable for every M18 with M18.metrics = BusMetrics() (or per instance); thread-safe, so one
+    instance can collect a whole fleet. Export with to_dict()/save(*.json) or prometheus()/save(*.prom).
+    """
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)  # Latency histogram upper bounds, seconds
+    COMMANDS = {0x01: "read", 0xAA: "sync", 0x60: "configure", 0x61: "snapchat", 0x62: "keepalive", 0x55: "calibrate"}
+    COUNTERS = ("sent", "bytes_tx", "bytes_rx", "retries", "timeouts", "checksum_failures", "errors")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    @classmethod
+    def key(cls, adapter, frame):
+        """(adapter, command, address) for an LSB-first command frame"""
+        command = cls.COMMANDS.get(frame[0], f"0x{frame[0]:02X}")
+        if frame[0] == 0x01 and len(frame) >= 6:
+            return adapter, "read" if frame[1] == 0x04 else "write", f"0x{(frame[3] << 8) | frame[4]:04X}"
+        return adapter, command, ""
+
+    @staticmethod
+    def read_key(adapter, addr):
+        return adapter, "read", f"0x{addr:04X}"
+
+    def _entry(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = dict.fromkeys(self.COUNTERS, 0)
+            entry.update(count=0, sum=0.0, max=0.0, buckets=[0] * (len(self.BUCKETS) + 1))
+        return entry
+
+    def sent(self, key, size):
+        with self.lock:
+            entry = self._entry(key)
+            entry["sent"] += 1
+            entry["bytes_tx"] += size
+
+    def response(self, key, seconds, size, error=False, short=False):
+        with self.lock:
+            entry = self._entry(key)
+            entry["count"] += 1
+            entry["sum"] += seconds
+            entry["max"] = max(entry["max"], seconds)
+            entry["buckets"][next((n for n, bound in enumerate(self.BUCKETS) if seconds <= bound), len(self.BUCKETS))] += 1
+            entry["bytes_rx"] += size
+            entry["errors"] += error
+            entry["timeouts"] += short
+
+    def _count(self, key, counter):
+        with self.lock:
+            self._entry(key)[counter] += 1
+
+    def timeout(self, key):
+        self._count(key, "timeouts")
+
+    def checksum_failure(self, key):
+        self._count(key, "checksum_failures")
+
+    def retry(self, key):
+        self._count(key, "retries")
+
+    def quantile(self, entry, q):
+        """Latency quantile estimated from the histogram (upper bound of the bucket it falls in)"""
+        rank = q * entry["count"]
+        seen = 0
+        for bound, n in zip(self.BUCKETS + (entry["max"],), entry["buckets"]):
+            seen += n
+            if n and seen >= rank:
+                return min(bound, entry["max"])
+        return 0.0
+
+    def to_dict(self):
+        with self.lock:
+            items = sorted((key, dict(entry, buckets=list(entry["buckets"]))) for key, entry in self.entries.items())
+        commands = []
+        for (adapter, command, address), entry in items:
+            latency = {"count": entry["count"], "sum": round(entry["sum"], 6), "max": round(entry["max"], 6),
+                       "p50": round(self.quantile(entry, 0.5), 6), "p95": round(self.quantile(entry, 0.95), 6),
+                       "buckets": dict(zip([str(b) for b in self.BUCKETS] + ["+Inf"], entry["buckets"]))}
+            commands.append({"adapter": adapter, "command": command, "address": address, "latency": latency,
+                             **{counter: entry[counter] for counter in self.COUNTERS}})
+        return {"commands": commands}
+
+    @staticmethod
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    def prometheus(self):
+        """Prometheus text exposition format"""
+        def labels(adapter, command, address, extra=""):
+            values = (("adapter", adapter), ("command", command), ("address", address))
+            return "{" + ",".join(f'{name}="{self.escape(value)}"' for name, value in values) + extra + "}"
+
+        with self.lock:
+            items = sorted((key, dict(entry, buckets=list(entry["buckets"]))) for key, entry in self.entries.items())
+        lines = ["# HELP m18_command_latency_seconds Round-trip time from command sent to response complete",
+                 "# TYPE m18_command_latency_seconds histogram"]
+        for key, entry in items:
+            cumulative = 0
+            for bound, n in zip([str(b) for b in self.BUCKETS] + ["+Inf"], entry["buckets"]):
+                cumulative += n
+                bucket = labels(*key, f',le="{bound}"')
+                lines.append(f"m18_command_latency_seconds_bucket{bucket} {cumulative}")
+            lines.append(f"m18_command_latency_seconds_sum{labels(*key)} {entry['sum']:.6f}")
+            lines.append(f"m18_command_latency_seconds_count{labels(*key)} {entry['count']}")
+        for counter, metric, text in (("sent", "m18_commands_sent_total", "Commands sent"),
+                                      ("bytes_tx", "m18_bytes_sent_total", "Command bytes written"),
+                                      ("bytes_rx", "m18_bytes_received_total", "Response bytes read"),
+                                      ("retries", "m18_retries_total", "Retried commands"),
+                                      ("timeouts", "m18_timeouts_total", "Responses missing or cut short"),
+                                      ("checksum_failures", "m18_checksum_failures_total", "Responses with a bad checksum"),
+                                      ("errors", "m18_error_responses_total", "0x82 error responses")):
+            lines.append(f"# HELP {metric} {text}")
+            lines.append(f"# TYPE {metric} counter")
+            lines.extend(f"{metric}{labels(*key)} {entry[counter]}" for key, entry in items)
+        return "\n".join(lines) + "\n"
+
+    def save(self, path):
+        """Write Prometheus text if 'path' ends in .prom, else JSON"""
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(self.prometheus() if path.endswith(".prom") else json.dumps(self.to_dict(), indent=1))
+
+    def report(self, top=10):
+        """Print the slowest command/address pairs by mean latency and the per-adapter totals"""
+        data = self.to_dict()["commands"]
+        rows = sorted((c for c in data if c["latency"]["count"]), key=lambda c: -c["latency"]["sum"] / c["latency"]["count"])
+        print(f"{'Adapter':<20} {'Command':<10} {'Address':<7} {'Count':>6} {'Mean ms':>8} {'p95 ms':>7} {'Retry':>5} {'T/O':>4} {'Cksum':>5}")
+        for c in rows[:top]:
+            lat = c["latency"]
+            print(f"{c['adapter']:<20} {c['command']:<10} {c['address']:<7} {lat['count']:6d} {lat['sum'] / lat['count'] * 1000:8.1f} "
+                  f"{lat['p95'] * 1000:7.1f} {c['retries']:5d} {c['timeouts']:4d} {c['checksum_failures']:5d}")
+        adapters = {}
+        for c in data:
+            total = adapters.setdefault(c["adapter"], collections.Counter())
+            total.update({counter: c[counter] for counter in self.COUNTERS})
+            total.update(count=c["latency"]["count"], sum=c["latency"]["sum"])
+        for adapter, total in adapters.items():
+            mean = f"{total['sum'] / total['count'] * 1000:.1f} ms" if total['count'] else "------"
+            print(f"{adapter}: {total['sent']} commands, mean {mean}, {total['bytes_tx']} B sent, {total['bytes_rx']} B received, "
+                  f"{total['retries']} retries, {total['timeouts']} timeouts, {total['checksum_failures']} checksum failures")
+
+class LatencyTracker:
+    """
+    Per-adapter response latency and wait statistics. Timeouts follow the measured latency
+    (smoothed latency + 4 x deviation, as TCP does for retransmits) plus wire time for the
+    expected bytes, instead of a fixed 0.8 s. Until the first response they stay at MAX_TIMEOUT.
+    """
+    MIN_TIMEOUT = 0.05
+    MAX_TIMEOUT = 0.8
+    BYTE_TIME = 11 / 4800  # Start + 8 data + 2 stop bits at 4800 baud
+    BACKOFF_BASE = 0.05
+    BACKOFF_CAP = 1.0
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = 0.0
+        self.stats = {"responses": 0, "timeouts": 0, "short_reads": 0, "retries": 0,
+                      "response_wait": 0.0, "timeout_wait": 0.0, "backoff_wait": 0.0, "reset_wait": 0.0}
+
+    def header_timeout(self):
+        if self.srtt is None:
+            return self.MAX_TIMEOUT
+        return min(self.MAX_TIMEOUT, max(self.MIN_TIMEOUT, self.srtt + 4 * self.rttvar))
+
+    def body_timeout(self, size):
+        return max(self.MIN_TIMEOUT, 2 * size * self.BYTE_TIME + self.header_timeout() / 2)
+
+    def record_response(self, latency):
+        self.stats["responses"] += 1
+        self.stats["response_wait"] += latency
+        if self.srtt is None:
+            self.srtt, self.rttvar = latency, latency / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - latency)
+            self.srtt = 0.875 * self.srtt + 0.125 * latency
+
+    def record_timeout(self, waited):
+        self.stats["timeouts"] += 1
+        self.stats["timeout_wait"] += waited
+
+    def record_body(self, waited, short):
+        if short:
+            self.stats["short_reads"] += 1
+            self.stats["timeout_wait"] += waited
+        else:
+            self.stats["response_wait"] += waited
+
+    def backoff_delay(self, attempt):
+        """Jittered exponential backoff for retry 'attempt' (0-based): half fixed, half random"""
+        delay = min(self.BACKOFF_CAP, self.BACKOFF_BASE * 2 ** attempt)
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        self.stats["retries"] += 1
+        self.stats["backoff_wait"] += delay
+        return delay
+
+    def report(self):
+        s = self.stats
+        latency = f"{self.srtt * 1000:.1f} ms" if self.srtt is not None else "------"
+        print(f"Latency: {latency} (timeout {self.header_timeout() * 1000:.0f} ms), responses: {s['responses']}, "
+              f"timeouts: {s['timeouts']}, short reads: {s['short_reads']}, retries: {s['retries']}")
+        print(f"Waiting: responses {s['response_wait']:.1f}s, timeouts {s['timeout_wait']:.1f}s, "
+              f"backoff {s['backoff_wait']:.1f}s, resets {s['reset_wait']:.1f}s")
+
+class RegisterCache:
+    """Raw register data keyed by pack serial, each entry expiring after register_ttl()"""
+    def __init__(self):
+        self.packs = {}  # serial -> {id: (monotonic time read, data)}
+
+    def lookup(self, serial, id_list, now=None):
+        """Returns {id: data} for the registers of 'serial' that are still fresh"""
+        now = time.monotonic() if now is None else now
+        entries = self.packs.get(serial, {})
+        fresh = {}
+        for i in id_list:
+            if i in entries:
+                read_at, data = entries[i]
+                ttl = REGISTER_TTL[i]
+                if ttl is None or now - read_at <= ttl:
+                    fresh[i] = data
+        return fresh
+
+    def store(self, serial, values, now=None):
+        now = time.monotonic() if now is None else now
+        entries = self.packs.setdefault(serial, {})
+        for i, data in values.items():
+            if data is not None:
+                entries[i] = (now, data)
+
+    def invalidate(self, serial=None):
+        if serial is None:
+            self.packs.clear()
+        else:
+            self.packs.pop(serial, None)
+
+class SnapshotStore:
+    """
+    Append-only columnar store of register snapshots, one fixed-size record per read:
+    serial (u4), timestamp (f8, epoch), valid bitmap, then every data_id register's raw bytes in data_id order.
+    Records are written with struct (no dependencies); queries map the file with NumPy as a structured
+    array with one typed column per register (r0004, r400A, ...).
+    # path - store file, created with a header on first append
+    """
+    MAGIC = b"M18S"
+    VERSION = 1
+    HEADER = struct.Struct(">4sHHI")  # magic, version, register count, record size
+
+    def __init__(self, path="m18_snapshots.m18s"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.offsets = []
+        offset = 0
+        for addr, length, type, label in data_id:
+            self.offsets.append(offset)
+            offset += length
+        self.mask_len = (len(data_id) + 7) // 8
+        self.record = struct.Struct(f">Id{self.mask_len}s{offset}s")
+
+    def append(self, serial, timestamp, values):
+        """Append one snapshot. 'values' is {data_id index: raw bytes or None}."""
+        self.append_many([(serial, timestamp, values)])
+
+    def append_many(self, snapshots):
+        """Append [(serial, timestamp, values), ...] with a single write"""
+        records = []
+        for serial, timestamp, values in snapshots:
+            mask = bytearray(self.mask_len)
+            image = bytearray(self.record.size - 12 - self.mask_len)
+            for i, data in values.items():
+                if data is not None and len(data) == data_id[i][1]:
+                    mask[i // 8] |= 1 << (i % 8)
+                    image[self.offsets[i]:self.offsets[i] + len(data)] = data
+            records.append(self.record.pack(serial, timestamp, bytes(mask), bytes(image)))
+        with self.lock:
+            if not os.path.exists(self.path):
+                # Create the header atomically: other processes may be appending to the same store
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as file:
+                    file.write(self.HEADER.pack(self.MAGIC, self.VERSION, len(data_id), self.record.size))
+                try:
+                    os.link(tmp_path, self.path)
+                except FileExistsError:
+                    pass
+                finally:
+                    os.remove(tmp_path)
+            with open(self.path, 'ab') as file:
+                file.write(b"".join(records))
+
+    def dtype(self):
+        import numpy as np
+        fields = [("serial", ">u4"), ("timestamp", ">f8"), ("valid", "u1", (self.mask_len,))]
+        for addr, length, type, label in data_id:
+            match type:
+                case "cell_v":
+                    field = (">u2", (5,))
+                case "dec_t":
+                    field = ("u1", (2,))
+                case "ascii":
+                    field = (f"S{length}",)
+                case "sn":
+                    field = (f"V{length}",)
+                case _:
+                    field = ({1: "u1", 2: ">u2", 4: ">u4"}.get(length, f"V{length}"),)
+            fields.append((f"r{addr:04X}", *field))
+        return np.dtype(fields)
+
+    def load(self):
+        """Memory-map every snapshot as a NumPy structured array (empty if the store doesn't exist)"""
+        try:
+            import numpy as np
+        except ImportError:
+            raise ImportError("Install numpy: pip install numpy")
+        dtype = self.dtype()
+        if not os.path.exists(self.path) or os.path.getsize(self.path) <= self.HEADER.size:
+            return np.zeros(0, dtype=dtype)
+        with open(self.path, 'rb') as file:
+            magic, version, count, size = self.HEADER.unpack(file.read(self.HEADER.size))
+        if magic != self.MAGIC or count != len(data_id) or size != dtype.itemsize:
+            raise ValueError(f"{self.path} was written with a different register layout")
+        rows = (os.path.getsize(self.path) - self.HEADER.size) // size
+        return np.memmap(self.path, dtype=dtype, mode='r', offset=self.HEADER.size, shape=(rows,))
+
+    def history(self, addr, serials=None, start=None, end=None):
+        """
+        History of register 'addr' across packs.
+        # serials - only these pack serials (default all)
+        # start / end - datetime or epoch bounds on the snapshot time
+        Returns {'serial', 'timestamp', 'value'} NumPy arrays, sorted by time, valid readings only.
+        Values are numeric: dates/hhmmss as seconds, temperatures in °F, cell voltages as an (n, 5) array.
+        """
+        import numpy as np
+        i = REG_INDEX[addr]
+        rows = self.load()
+        keep = (rows["valid"][:, i // 8] >> (i % 8)) & 1 == 1
+        if serials is not None:
+            keep &= np.isin(rows["serial"], list(serials))
+        if start is not None:
+            keep &= rows["timestamp"] >= (start.timestamp() if isinstance(start, datetime.datetime) else start)
+        if end is not None:
+            keep &= rows["timestamp"] <= (end.timestamp() if isinstance(end, datetime.datetime) else end)
+        rows = rows[keep]
+        order = np.argsort(rows["timestamp"], kind="stable")
+        rows = rows[order]
+        column = rows[f"r{addr:04X}"]
+        match data_id[i][2]:
+            case "adc_t":
+                value = np.array([M18.calculate_temperature(v) for v in column.tolist()], dtype=float)
+            case "dec_t":
+                value = (column[:, 0] + column[:, 1] / 256) * 9 / 5 + 32
+            case "sn":
+                raw = np.frombuffer(column.tobytes(), dtype="u1").reshape(-1, 5).astype(np.int64)
+                value = (raw[:, 2] << 16) | (raw[:, 3] << 8) | raw[:, 4]
+            case "ascii":
+                value = np.char.decode(column, "utf-8", "replace")
+            case _:
+                value = column.astype(np.int64)
+        return {"serial": rows["serial"].astype(np.int64), "timestamp": rows["timestamp"].astype(float), "value": value}
+
+    def serials(self):
+        import numpy as np
+        return [int(s) for s in np.unique(self.load()["serial"])]
+
+class RawDumpWriter:
+    """
+    Raw register dumps, one JSON line per read in <directory>/<serial>_<YYYY-MM-DD>.ndjson.
+    Registers are keyed by address (not data_id index) so old dumps stay decodable after data_id
+    changes; re-decode them with redecode_dumps().
+    """
+    def __init__(self, directory="m18_dumps"):
+        self.directory = directory
+        self.lock = threading.Lock()
+
+    def write(self, serial, timestamp, raw):
+        when = datetime.datetime.fromtimestamp(timestamp)
+        record = {"serial": serial, "timestamp": when.strftime("%Y-%m-%d %H:%M:%S"),
+                  "registers": {f"0x{data_id[i][0]:04X}": data.hex().upper() for i, data in raw.items() if data is not None}}
+        path = os.path.join(self.directory, f"{serial}_{when.strftime('%Y-%m-%d')}.ndjson")
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(record) + "\n")
+
+class RegisterSink:
+    """
+    Streaming writer for read_id(output="csv" | "ndjson"). Each register row is written and flushed as it is
+    decoded, so an interrupted read keeps what it got and long capture sessions stay flat in memory.
+    Files rotate per pack and day (<directory>/<serial>_<YYYY-MM-DD>.csv or .ndjson) unless 'path' is given.
+    # format - "csv" (a Timestamp block per read) or "ndjson" (one self-contained line per register, with raw hex)
+    # path - append everything to this one file instead of rotating
+    # directory - where rotated files go
+    # stream - write to this open text stream instead (e.g. sys.stdout); it is flushed but never closed
+    """
+    def __init__(self, format="csv", path=None, directory=".", stream=None):
+        import csv
+        self.format = format
+        self.path = path
+        self.directory = directory
+        self.stream = stream
+        self.current = getattr(stream, "name", "<stream>") if stream is not None else None
+        self.file = stream
+        self.writer = csv.writer(stream) if stream is not None and format == "csv" else None
+        self.serial = None
+        self.timestamp = None
+        self.rows = 0
+
+    def begin(self, serial, timestamp):
+        """Start one read of pack 'serial' at epoch 'timestamp': switch files if needed and write the CSV block header"""
+        import csv
+        when = datetime.datetime.fromtimestamp(timestamp)
+        path = self.path or os.path.join(self.directory, f"{serial or 'unknown'}_{when.strftime('%Y-%m-%d')}.{self.format}")
+        if self.stream is None and path != self.current:
+            self.close()
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.file = open(path, 'a', newline='', encoding='utf-8')
+            self.writer = csv.writer(self.file) if self.format == "csv" else None
+            self.current = path
+        self.serial = serial
+        self.timestamp = when.strftime("%Y-%m-%d %H:%M:%S")
+        if self.writer is not None:
+            if self.stream is None and self.file.tell() > 0:
+                self.writer.writerow([])
+                self.writer.writerow(["Timestamp", self.timestamp])
+            else:
+                self.writer.writerow(["Timestamp", self.timestamp])
+                self.writer.writerow(["ID", "Address", "Length", "Type", "Label", "Value"])
+            self.file.flush()
+
+    def row(self, i, value, data=None):
+        """Write register 'i' with its decoded 'value' (and raw bytes 'data' for NDJSON) and flush"""
+        addr, length, type, label = data_id[i][:4]
+        if self.writer is not None:
+            self.writer.writerow([i, f"0x{addr:04X}", length, type, label, value])
+        else:
+            if isinstance(value, datetime.datetime):
+                value = value.strftime('%Y-%m-%d %H:%M:%S')
+            self.file.write(json.dumps({"timestamp": self.timestamp, "serial": self.serial, "id": i, "address": f"0x{addr:04X}",
+                                        "type": type, "label": label, "value": value,
+                                        "raw": data.hex().upper() if data is not None else None}) + "\n")
+        self.file.flush()
+        self.rows += 1
+
+    def end(self):
+        """Finish one read: make it durable"""
+        if self.file is not None:
+            self.file.flush()
+            if self.stream is None:
+                os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None and self.stream is None:
+            self.end()
+            self.file.close()
+            self.file = self.writer = self.current = None
+
+def read_dumps(path):
+    """Yield (serial, timestamp, {data_id index: bytes}) for every dump line in 'path'; unknown addresses are skipped"""
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            raw = {}
+            for addr, value in record["registers"].items():
+                i = REG_INDEX.get(int(addr, 16))
+                data = bytes.fromhex(value)
+                if i is not None and len(data) == data_id[i][1]:
+                    raw[i] = data
+            yield record["serial"], record["timestamp"], raw
+
+def redecode_file(path):
+    """Re-decode every dump in 'path' through the current decoders and health(); returns summary rows (dicts)"""
+    m = M18.offline()
+    rows = []
+    for serial, timestamp, raw in read_dumps(path):
+        values = decode_image(raw)
+        array = [timestamp] + [[i, values.get(i)] for i in range(len(data_id))]
+        data = m.health(return_data=True, array=array)
+        rows.append({"File": os.path.basename(path), "E-Serial": serial, "Timestamp": timestamp, **(data or {}).get("summary", {})})
+    return rows
+
+def redecode_dumps(paths, csv_path="m18_redecoded.csv", workers=None):
+    """
+    Batch re-decode stored raw dumps on a process pool into one summary CSV.
+    # paths - dump files and/or directories of *.ndjson dumps
+    # workers - pool size (default: CPU count)
+    """
+    import csv
+    from concurrent.futures import ProcessPoolExecutor
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(".ndjson")))
+        else:
+            files.append(path)
+    begin_time = time.time()
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for file_rows in pool.map(redecode_file, files, chunksize=max(1, len(files) // 64)):
+            rows.extend(file_rows)
+    columns = []
+    for row in rows:
+        for key in row:
+            if key not in columns:
+                columns.append(key)
+    try:
+        with open(csv_path, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.DictWriter(file, fieldnames=columns, restval="------")
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"Re-decoded {len(rows)} dumps from {len(files)} files in {time.time() - begin_time:.1f}s, written to {csv_path}")
+    except IOError as e:
+        print(f"Error writing CSV: {e}")
+    return rows
+
+# Histogram registers: name -> (first address, last address), one 2-byte bin per register
+HISTOGRAMS = {
+    "discharge_10a": (0x903A, 0x9060),      # Discharge time per 10A band, 10-210A
+    "discharge_5a": (0x9064, 0x90B0),       # Discharge time per 5A band, 10A to 200A+
+    "charge_start_v": (0x90B2, 0x90BA),     # Charge start voltage, <17V to 20V+
+    "charge_end_v": (0x90BC, 0x90C4),       # Charge end voltage, <17V to 20V+
+    "charge_start_temp": (0x90C6, 0x90DC),  # Charge start temperature, -30C to +80C and over
+    "charge_end_temp": (0x90DE, 0x90F4),    # Charge end temperature, -30C to +80C and over
+}
+
+class FleetAnalytics:
+    """
+    Vectorised fleet analytics over SnapshotStore snapshots. Each histogram in HISTOGRAMS is loaded
+    as a (packs x bins) NumPy array; distributions, percentiles, SoH and outliers are whole-array operations.
+    # store - SnapshotStore
+    # latest - if True, one row per pack (its most recent snapshot with all histograms); else every snapshot
+    """
+    def __init__(self, store, latest=True):
+        import numpy as np
+        rows = store.load()
+        ids = [REG_INDEX[addr] for first, last in HISTOGRAMS.values() for addr in range(first, last + 1, 2)]
+        ids += [REG_INDEX[0x0004], REG_INDEX[0x9012]]
+        ids = np.array(ids)
+        valid = ((rows["valid"][:, ids // 8] >> (ids % 8)) & 1).all(axis=1)
+        rows = rows[valid]
+        if latest and len(rows):
+            order = np.lexsort((rows["timestamp"], rows["serial"]))
+            rows = rows[order]
+            last = np.r_[rows["serial"][1:] != rows["serial"][:-1], True]
+            rows = rows[last]
+        self.serials = rows["serial"].astype(np.int64)
+        self.timestamps = rows["timestamp"].astype(float)
+        self.hist = {name: np.stack([rows[f"r{addr:04X}"] for addr in range(first, last + 1, 2)], axis=1).astype(float)
+                     for name, (first, last) in HISTOGRAMS.items()}
+        pack_type = np.frombuffer(rows["r0004"].tobytes(), dtype="u1").reshape(-1, 5)[:, :2].copy().view(">u2").ravel()
+        types, inverse = np.unique(pack_type, return_inverse=True)
+        capacity_by_type = np.array([BATTERY_TYPES.get(str(t), [0, "Unknown"])[0] for t in types], dtype=float)
+        self.capacity = capacity_by_type[inverse] if len(rows) else np.zeros(0)
+        discharge_ah = rows["r9012"].astype(float) / 3600
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.cycles = np.where(self.capacity > 0, discharge_ah / self.capacity, np.nan)
+        self.soh = np.clip(100 - self.cycles / 500 * 100, 0, None)
+
+    def shares(self, name):
+        """Per-pack histogram normalised to fractions of that pack's total (rows with no counts are zero)"""
+        import numpy as np
+        h = self.hist[name]
+        totals = h.sum(axis=1, keepdims=True)
+        return np.divide(h, totals, out=np.zeros_like(h), where=totals > 0)
+
+    def distribution(self, name):
+        """Fleet-wide distribution: summed bins as fractions of the fleet total"""
+        h = self.hist[name].sum(axis=0)
+        return h / h.sum() if h.sum() else h
+
+    def percentiles(self, name, q=(5, 25, 50, 75, 95)):
+        """Per-bin percentiles of per-pack shares, as a (len(q) x bins) array"""
+        import numpy as np
+        return np.percentile(self.shares(name), q, axis=0)
+
+    def ranking(self):
+        """Packs ordered from lowest to highest SoH, as (serial, SoH, cycles) tuples"""
+        import numpy as np
+        order = np.argsort(np.nan_to_num(self.soh, nan=np.inf), kind="stable")
+        return list(zip(self.serials[order].tolist(), self.soh[order].tolist(), self.cycles[order].tolist()))
+
+    def outliers(self, name, threshold=3.5):
+        """
+        Packs whose histogram shape is far from the fleet median: robust z-score (median/MAD) of each
+        pack's L1 distance to the median share vector. Returns (serial, score) tuples above 'threshold'.
+        """
+        import numpy as np
+        shares = self.shares(name)
+        if not len(shares):
+            return []
+        distance = np.abs(shares - np.median(shares, axis=0)).sum(axis=1)
+        mad = np.median(np.abs(distance - np.median(distance)))
+        score = 0.6745 * (distance - np.median(distance)) / mad if mad else np.zeros_like(distance)
+        hits = np.flatnonzero(score > threshold)
+        hits = hits[np.argsort(-score[hits])]
+        return list(zip(self.serials[hits].tolist(), score[hits].tolist()))
+
+    def report(self, top=10):
+        import numpy as np
+        print(f"{YELLOW}=== FLEET ANALYTICS ({len(self.serials)} snapshots) ==={RESET}")
+        if not len(self.serials):
+            return
+        soh = self.soh[~np.isnan(self.soh)]
+        if len(soh):
+            p5, p50, p95 = np.percentile(soh, [5, 50, 95])
+            print(f"SoH: median {p50:.1f}%, 5th {p5:.1f}%, 95th {p95:.1f}%, below 50%: {int((soh < 50).sum())}")
+        print("Lowest SoH:")
+        for serial, pack_soh, cycles in self.ranking()[:top]:
+            print(f"  {serial:>10}  SoH {pack_soh:5.1f}%  cycles {cycles:7.2f}")
+        for name, (first, last) in HISTOGRAMS.items():
+            median = self.percentiles(name, (50,))[0]
+            bars = " ".join(f"{share * 100:4.1f}" for share in self.distribution(name))
+            print(f"{name:<18} fleet % per bin: {bars}")
+            print(f"{'':<18} median pack %:   {' '.join(f'{share * 100:4.1f}' for share in median)}")
+            outliers = self.outliers(name)
+            if outliers:
+                print(f"{'':<18} outliers: {', '.join(f'{serial} ({score:.1f})' for serial, score in outliers[:top])}")
+
+@dataclass(slots=True)
+class HealthReport:
+    """
+    Health metrics computed from one full read_id(output="array") read. Building it does no I/O;
+    print_console(), write_csv() and to_dict()/to_json() are separate, optional rendering stages.
+    # timestamp - report time, "%Y-%m-%d %H:%M:%S"
+    # registers - [[reg_id, value], ...] for all registers (the read_id array without its timestamp)
+    # discharge - total discharge in amp-seconds, None if not read
+    # tool_time - seconds on tool above 10A (sum of the 10A discharge bands)
+    """
+    timestamp: str
+    registers: list
+    bat_type: str = "Unknown"
+    bat_text: list = field(default_factory=lambda: [0, "Unknown"])
+    serial_number: str = None
+    cell_voltages: list = None
+    imbalance: int = 0
+    discharge: float = None
+    discharge_cycles: float = 0
+    soh: float = 0
+    tool_time: int = 0
+    warnings: list = field(default_factory=list)
+
+    @classmethod
+    def from_array(cls, array, timestamp=None):
+        """Compute the report from a read_id(output="array") result; raises ValueError if it is incomplete"""
+        if not array or len(array) < len(data_id) + 1:
+            raise ValueError("Incomplete data from read_id")
+        report = cls(timestamp or datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), array[1:])
+        sn = report.value(0x0004)
+        if isinstance(sn, str):
+            bat_text = sn.split(', ')
+            if len(bat_text) >= 2 and 'Type: ' in bat_text[0] and 'Serial: ' in bat_text[1]:
+                report.bat_type = bat_text[0].split('Type: ')[1].strip()
+                report.serial_number = bat_text[1].split('Serial: ')[1].strip()
+                report.bat_text = BATTERY_TYPES.get(report.bat_type, [0, "Unknown"])
+        logger.debug(f"E-Serial: {report.serial_number or 'None'}, Type: {report.bat_type}")
+
+        cell_v = report.value(0x400A)
+        if isinstance(cell_v, list) and len(cell_v) == 5:
+            report.cell_voltages = cell_v
+            report.imbalance = max(cell_v) - min(cell_v)
+            if report.imbalance > 100:
+                report.warnings.append("High cell imbalance (>100 mV). Consider using a balancing charger.")
+
+        discharge = report.value(0x9012)
+        if isinstance(discharge, (int, float)):
+            report.discharge = discharge
+            if report.bat_text[0] != 0:
+                report.discharge_cycles = discharge / 3600 / report.bat_text[0]
+                report.soh = max(0, 100 - (report.discharge_cycles / 500 * 100))
+                if report.soh < 50:
+                    report.warnings.append("Low SoH (<50%). Battery may need replacement soon.")
+
+        if report.value(0x9030) or report.value(0x9036):
+            report.warnings.append("Avoid deep discharges to extend battery life.")
+        report.tool_time = sum(t for t in report.tool_time_bands() if isinstance(t, (int, float)))
+        time_idle = report.value(0x9028)
+        if isinstance(time_idle, str) and int(time_idle.split(':')[0]) > 100:
+            report.warnings.append("High idle time on charger. Remove after full charge.")
+        return report
+
+    def value(self, addr):
+        """Decoded value of the register at 'addr', or None"""
+        i = REG_INDEX.get(addr)
+        return self.registers[i][1] if i is not None else None
+
+    def tool_time_bands(self):
+        """Time on tool per 10A band (0x903A-0x9060, 10-210A)"""
+        return [self.registers[i][1] for i in range(REG_INDEX[0x903A], REG_INDEX[0x9060] + 1)]
+
+    def metric_rows(self):
+        """[label, value] rows for the computed metrics (the summary sent by to_dict())"""
+        rows = []
+        if self.cell_voltages:
+            rows.append(["Cell Imbalance (mV)", str(self.imbalance)])
+            rows.append(["Cell Voltages (mV)", ", ".join(map(str, self.cell_voltages))])
+            rows.append(["Pack Voltage", f"{sum(self.cell_voltages)/1000:.2f} V"])
+        else:
+            rows.append(["Cell Imbalance (mV)", "------"])
+            rows.append(["Cell Voltages (mV)", "------"])
+            rows.append(["Pack Voltage", "------"])
+        if self.discharge is not None and self.bat_text[0] != 0:
+            rows.append(["Total Discharge (Ah)", f"{self.discharge/3600:.2f}"])
+            rows.append(["Total Discharge Cycles", f"{self.discharge_cycles:.2f}"])
+            rows.append(["Estimated SoH (%)", f"{self.soh:.1f}"])
+        rows.append(["Total Time on Tool (>10A)", str(datetime.timedelta(seconds=self.tool_time)) if self.tool_time else "------"])
+        return rows
+
+    def detail_rows(self):
+        """[label, value] rows for the console sections, in print order"""
+        def text(value, fmt):
+            return value.strftime(fmt) if isinstance(value, datetime.datetime) else str(value or "------")
+        def or_missing(value, missing="------"):
+            return value if value is not None else missing
+
+        temp_non_forge = or_missing(self.value(0x4014), "Not available")
+        temp_forge = or_missing(self.value(0x401F), "Not available")
+        charge_count = "------"
+        counts = [self.value(addr) for addr in (0x901A, 0x9020, 0x901E)]
+        if all(isinstance(count, (int, float)) for count in counts):
+            charge_count = f"{counts[0]} (Redlink: {counts[1]}, Dumb: {counts[2]})"
+        return [
+            ["Type", f"{self.bat_type} [{self.bat_text[1]}]"],
+            ["E-Serial", str(self.serial_number) if self.serial_number else "------"],
+            ["Manufacture Date", text(self.value(0x0011), '%Y-%m - %d')],
+            ["Current Date", text(self.value(0x0037), '%Y-%m-%d %H:%M:%S')],
+            ["Days Since First Charge", str(self.value(0x9010) or "------")],
+            ["Temperature (non-Forge)", str(temp_non_forge) + " °F" if temp_non_forge != "Not available" else "Not available"],
+            ["Temperature (Forge)", str(temp_forge) + " °F" if temp_forge != "Not available" else "Not available"],
+            ["Total Charge Count", charge_count],
+            ["Total Charge Time", str(or_missing(self.value(0x9024)))],
+            ["Time Idling on Charger", str(or_missing(self.value(0x9028)))],
+            ["Low-Voltage Charges", str(or_missing(self.value(0x902E)))],
+            ["Total Discharge (Ah)", f"{self.discharge/3600:.2f} Ah" if self.discharge is not None else "------"],
+            ["Total Discharge Cycles", f"{self.discharge_cycles:.2f}"],
+            ["Estimated SoH (%)", f"{self.soh:.1f}"],
+            ["Discharge to Empty", str(self.value(0x9030) or "------")],
+            ["Overheat Events", str(self.value(0x9032) or "------")],
+            ["Low Voltage Events", str(self.value(0x9036) or "------")],
+        ]
+
+    def register_rows(self):
+        """[reg_id, address, length, type, label, formatted value] for every register"""
+        rows = []
+        for reg_id, value in self.registers:
+            addr, length, type, label = data_id[reg_id][:4]
+            if type == "date" and isinstance(value, datetime.datetime):
+                formatted_value = value.strftime('%Y-%m-%d %H:%M:%S')
+            elif type == "cell_v" and isinstance(value, list):
+                formatted_value = f"1: {value[0]:4d}, 2: {value[1]:4d}, 3: {value[2]:4d}, 4: {value[3]:4d}, 5: {value[4]:4d}"
+            elif type == "hhmmss" and isinstance(value, (int, str)):
+                formatted_value = str(value)
+            elif type == "ascii" and isinstance(value, str):
+                formatted_value = f'"{value}"'
+            elif type == "sn" and isinstance(value, str):
+                formatted_value = value
+            elif isinstance(value, (int, float)):
+                formatted_value = str(value)
+            else:
+                formatted_value = "------"
+            rows.append([reg_id, f"0x{addr:04X}", length, type, label, formatted_value])
+        return rows
+
+    def to_dict(self):
+        """JSON-safe {'summary', 'registers', 'timestamp'} dict (the health(return_data=True) result)"""
+        converted_registers = []
+        for reg_id, value in self.registers:
+            if isinstance(value, datetime.datetime):
+                value = value.strftime('%Y-%m-%d %H:%M:%S')
+            elif isinstance(value, list):
+                value = [str(v) for v in value]
+            converted_registers.append([reg_id, value])
+        return {'summary': dict(self.metric_rows()), 'registers': converted_registers, 'timestamp': self.timestamp}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def print_console(self, verbose=False):
+        """Grouped, color-coded console report; verbose adds the full register table"""
+        details = dict(self.detail_rows())
+        print(f"{YELLOW}=== BASIC INFO ==={RESET}")
+        print(f"Type: {details['Type']} {GREEN}✓{RESET}")
+        print(f"E-Serial: {details['E-Serial']}")
+        print(f"Manufacture Date: {details['Manufacture Date']}")
+        print(f"Current Date: {details['Current Date']}")
+        days_since_first = self.value(0x9010)
+        print(f"Days Since First Charge: {days_since_first or '------'} days{' (New battery)' if isinstance(days_since_first, (int, float)) and 0 < days_since_first < 30 else ''}")
+
+        print(f"\n{YELLOW}=== VOLTAGE & TEMPERATURE ==={RESET}")
+        if self.cell_voltages:
+            imbalance = self.imbalance
+            print(f"Pack Voltage: {sum(self.cell_voltages)/1000:.2f} V")
+            print(f"Cell Voltages (mV): {', '.join(map(str, self.cell_voltages))}")
+            print(f"Cell Imbalance: {imbalance} mV {GREEN if imbalance <= 100 else YELLOW}✓{RESET if imbalance <= 100 else '⚠ (Consider balancing charger)'}")
+        else:
+            print("Pack Voltage: ------")
+            print("Cell Voltages (mV): ------")
+            print("Cell Imbalance: ------")
+        for name in ("Temperature (non-Forge)", "Temperature (Forge)"):
+            print(f"{name}: {details[name]}" if details[name] != "Not available" else "Not available")
+
+        print(f"\n{YELLOW}=== CHARGING STATS ==={RESET}")
+        if details["Total Charge Count"] != "------":
+            print(f"Total Charge Count: {details['Total Charge Count']}")
+        print(f"Total Charge Time: {details['Total Charge Time']}")
+        time_idle = self.value(0x9028)
+        print(f"Time Idling on Charger: {details['Time Idling on Charger']} {YELLOW + '⚠ ( Remove after full charge)' if isinstance(time_idle, str) and int(time_idle.split(':')[0]) > 100 else ''}{RESET}")
+        low_v_charge = self.value(0x902E)
+        print(f"Low-Voltage Charges: {details['Low-Voltage Charges']} {GREEN + '✓' if low_v_charge == 0 else YELLOW + '⚠'}{RESET}")
+
+        print(f"\n{YELLOW}=== TOOL USE STATS ==={RESET}")
+        if self.discharge is not None:
+            soh = self.soh
+            print(f"Total Discharge: {details['Total Discharge (Ah)']}")
+            print(f"Estimated Cycles: {self.discharge_cycles:.2f}")
+            print(f"SoH: {soh:.1f}% {GREEN if soh >= 50 else YELLOW}✓{RESET if soh >= 50 else '⚠ (Consider replacement)'}")
+        print(f"Discharge to Empty: {details['Discharge to Empty']} {YELLOW + '⚠ (Avoid deep discharges)' if (self.value(0x9030) or 0) > 0 else ''}{RESET}")
+        print(f"Overheat Events: {details['Overheat Events']} {GREEN + '✓' if not self.value(0x9032) else YELLOW + '⚠'}{RESET}")
+        print(f"Low Voltage Events: {details['Low Voltage Events']} {YELLOW + '⚠' if (self.value(0x9036) or 0) > 0 else ''}{RESET}")
+        print(f"Total Time on Tool (>10A): {str(datetime.timedelta(seconds=self.tool_time)) if self.tool_time else '------'}")
+        if self.tool_time:
+            bands = [(f"{i*10 + 10}-{(i+1)*10 + 10}A", t) for i, t in enumerate(self.tool_time_bands())]
+            bands.append((">200A", self.value(0x90B0)))  # 0x90B0 is @ 200A+
+            for amp_range, t in bands:
+                hhmmss = str(datetime.timedelta(seconds=t)) if isinstance(t, (int, float)) else "------"
+                pct = round((t / self.tool_time) * 100) if isinstance(t, (int, float)) else 0
+                label = f"Time @ {amp_range:>8}:"
+                print(f"{label} {hhmmss} {pct:2d}% {'X' * pct}")
+
+        if self.warnings:
+            print(f"\n{YELLOW}Warnings:{RESET}")
+            for w in self.warnings:
+                print(f" - {w}")
+
+        if verbose:
+            print(f"\n{YELLOW}=== FULL REGISTER DATA ==={RESET}")
+            for reg_id, addr, length, type, label, formatted_value in self.register_rows():
+                print(f"{reg_id:3d} {addr} {length:2d} {type:>6} {label:<39} {formatted_value:<}")
+
+    def write_csv(self, path=None):
+        """
+        Write the summary table and all registers to 'path'
+        (default Milwaukee_Batt_M18_<serial>_<date>.csv); returns the path
+        """
+        import csv
+        path = path or f"Milwaukee_Batt_M18_{self.serial_number or 'unknown'}_{datetime.datetime.now().strftime('%Y-%m-%d_%I-%M%p').lower()}.csv"
+        summary = [["Timestamp", self.timestamp]] + self.metric_rows() + self.detail_rows()
+        if self.warnings:
+            summary.append(["Warnings", "; ".join(self.warnings)])
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            for row in summary:
+                writer.writerow(["Summary"] + row)
+            writer.writerow([])  # Separator
+            writer.writerow(["ID", "Address", "Length", "Type", "Label", "Value"])
+            writer.writerows(self.register_rows())
+        return path
+
+DASHBOARD_URL = 'http://172.25.47.113:5002/data'
+
+class DashboardUploader:
+    """
+    Background dashboard uploader. submit() spools the health dict to disk and returns at once;
+    a worker thread POSTs spooled readings in batches (a JSON list, gzip-compressed) over one pooled
+    requests.Session. Failed batches stay in the spool and are retried with backoff, also on the next run.
+    # url - dashboard endpoint
+    # spool_dir - durable spool, one JSON file per reading (rejected readings move to spool_dir/rejected)
+    # batch_size - most readings per request
+    # linger - seconds to wait for a batch to fill once the first reading is queued
+    # compress - gzip request bodies (Content-Encoding: gzip)
+    """
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+    BACKOFF_CAP = 60.0
+
+    def __init__(self, url=DASHBOARD_URL, spool_dir="m18_spool", batch_size=32, linger=1.0, compress=True, retries=3, timeout=10):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        self.url = url
+        self.spool_dir = spool_dir
+        self.batch_size = batch_size
+        self.linger = linger
+        self.compress = compress
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=self.RETRY_STATUS,
+                      allowed_methods=frozenset(["POST"]), raise_on_status=False)
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=4, max_retries=retry))
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=4, max_retries=retry))
+        self.stats = {"submitted": 0, "sent": 0, "batches": 0, "failures": 0, "rejected": 0, "bytes": 0, "bytes_raw": 0}
+        self.queue = queue.Queue()
+        self.closing = threading.Event()
+        self.idle = threading.Condition()
+        self.count = 0
+        os.makedirs(self.spool_dir, exist_ok=True)
+        spooled = sorted(os.path.join(self.spool_dir, f) for f in os.listdir(self.spool_dir) if f.endswith(".json"))
+        for path in spooled:
+            self.queue.put(path)
+        self.count = self.stats["submitted"] = len(spooled)
+        if spooled:
+            print(f"Dashboard: {len(spooled)} spooled readings from an earlier run will be sent")
+        self.thread = threading.Thread(target=self._run, name="m18-upload", daemon=True)
+        self.thread.start()
+
+    def submit(self, data):
+        """Spool one health(return_data=True) dict for upload; returns immediately"""
+        name = f"{time.time_ns()}_{threading.get_ident()}.json"
+        path = os.path.join(self.spool_dir, name)
+        with open(path + ".tmp", 'w', encoding='utf-8') as file:
+            json.dump(data, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+        with self.idle:
+            self.count += 1
+            self.stats["submitted"] += 1
+        self.queue.put(path)
+
+    def pending(self):
+        """Readings spooled but not yet accepted by the dashboard"""
+        with self.idle:
+            return self.count
+
+    def flush(self, timeout=None):
+        """Wait until everything submitted has been sent; returns False on timeout"""
+        with self.idle:
+            return self.idle.wait_for(lambda: self.count == 0, timeout)
+
+    def close(self, timeout=30):
+        """Send what is pending (up to 'timeout' seconds) and stop; anything unsent stays spooled"""
+        self.flush(timeout)
+        self.closing.set()
+        self.queue.put(None)
+        self.thread.join(timeout=self.timeout + 1)
+        self.session.close()
+
+    def _reject(self, paths):
+        """Move readings that can never be sent to spool_dir/rejected"""
+        rejected = os.path.join(self.spool_dir, "rejected")
+        os.makedirs(rejected, exist_ok=True)
+        for path in paths:
+            try:
+                os.replace(path, os.path.join(rejected, os.path.basename(path)))
+            except FileNotFoundError:
+                pass
+        self.stats["rejected"] += len(paths)
+
+    def _post(self, paths):
+        """POST one batch; True if the dashboard accepted it or rejected it for good"""
+        import requests
+        import gzip
+        batch = []
+        readable = []
+        for path in paths:
+            try:
+                with open(path, encoding='utf-8') as file:
+                    batch.append(json.load(file))
+                readable.append(path)
+            except (OSError, ValueError) as e:
+                # Truncated, corrupt or deleted spool file: set it aside, the rest of the batch still goes out
+                logger.error(f"Dashboard: unreadable spooled reading {path}: {e}")
+                self._reject([path])
+        paths = readable
+        if not paths:
+            return True
+        body = json.dumps(batch).encode()
+        headers = {"Content-Type": "application/json"}
+        raw_size = len(body)
+        if self.compress:
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+        try:
+            response = self.session.post(self.url, data=body, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            logger.warning(f"Dashboard upload of {len(paths)} readings failed: {e}")
+            return False
+        self.stats["bytes"] += len(body)
+        self.stats["bytes_raw"] += raw_size
+        if response.status_code in self.RETRY_STATUS:
+            logger.warning(f"Dashboard upload of {len(paths)} readings failed: status {response.status_code}")
+            return False
+        if response.status_code >= 400:
+            # Retrying would not help; keep the readings for inspection instead of blocking the spool
+            logger.error(f"Dashboard rejected {len(paths)} readings: status {response.status_code}, {response.text[:200]}")
+            self._reject(paths)
+            return True
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.stats["sent"] += len(paths)
+        self.stats["batches"] += 1
+        return True
+
+    def _run(self):
+        pending = []
+        delay = 0
+        stopping = False
+        while not stopping or pending:
+            if not pending:
+                path = self.queue.get()
+                if path is None:
+                    break
+                pending.append(path)
+            deadline = time.monotonic() + self.linger
+            while len(pending) < self.batch_size and not stopping:
+                try:
+                    path = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if path is None:
+                    stopping = True
+                else:
+                    pending.append(path)
+            batch = pending[:self.batch_size]
+            if self._post(batch):
+                del pending[:len(batch)]
+                delay = 0
+                with self.idle:
+                    self.count -= len(batch)
+                    self.idle.notify_all()
+                continue
+            self.stats["failures"] += 1
+            if stopping or self.closing.is_set():
+                break
+            delay = min(self.BACKOFF_CAP, max(1.0, delay * 2))
+            self.closing.wait(delay)
+
+    def report(self):
+        s = self.stats
+        ratio = f"{s['bytes_raw'] / s['bytes']:.1f}x" if s['bytes'] else "------"
+        print(f"Dashboard: {s['sent']}/{s['submitted']} readings sent in {s['batches']} batches, "
+              f"{s['failures']} failed attempts, {s['rejected']} rejected, {self.pending()} spooled, "
+              f"{s['bytes']} bytes on the wire (gzip {ratio})")
+
+def payload_snapshot(data):
+    """(serial, epoch timestamp, {data_id index: raw bytes}) for one health(return_data=True) dict; raises ValueError"""
+    if not isinstance(data, dict) or not isinstance(data.get('registers'), list) or not isinstance(data.get('timestamp'), str):
+        raise ValueError("expected {'summary', 'registers', 'timestamp'}")
+    if not all(isinstance(register, list) and len(register) == 2 for register in data['registers']):
+        raise ValueError("expected registers as [[reg_id, value], ...]")
+    timestamp = datetime.datetime.strptime(data['timestamp'], '%Y-%m-%d %H:%M:%S').timestamp()
+    raw = encode_registers(data['registers'])
+    sn = raw.get(REG_INDEX[0x0004])
+    if sn is None:
+        raise ValueError("payload has no serial number register")
+    return int.from_bytes(sn[2:5], 'big'), timestamp, raw
+
+class IngestServer:
+    """
+    Local stand-in for the dashboard: accepts health(return_data=True) payloads POSTed to /data
+    (one dict or a DashboardUploader batch list, optionally gzip) and appends them to a SnapshotStore.
+    GET /stats returns the ingest counters as JSON.
+    # store - SnapshotStore the snapshots go to
+    # dumps - RawDumpWriter to also write raw dumps to, or None
+    # address - (host, port) to listen on
+    """
+    def __init__(self, store, dumps=None, address=("127.0.0.1", 5002)):
+        import http.server
+        self.store = store
+        self.dumps = dumps
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "snapshots": 0, "rejected": 0, "bytes": 0, "busy": 0.0}
+        ingest = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # Headers and body are separate writes; avoid the delayed-ACK stall on keep-alive
+
+            def reply(self, status, body):
+                body = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path != "/stats":
+                    return self.reply(404, {"error": "not found"})
+                with ingest.lock:
+                    self.reply(200, dict(ingest.stats))
+
+            def do_POST(self):
+                if self.path != "/data":
+                    return self.reply(404, {"error": "not found"})
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status, result = ingest.ingest(body, self.headers.get("Content-Encoding"))
+                self.reply(status, result)
+
+            def log_message(self, format, *args):
+                logger.debug(f"ingest: {self.address_string()} {format % args}")
+
+        self.server = http.server.ThreadingHTTPServer(address, Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{self.server.server_address[0]}:{self.server.server_address[1]}/data"
+
+    def ingest(self, body, encoding=None):
+        """Decode and store one request body; returns (HTTP status, response dict)"""
+        import gzip
+        begin_time = time.perf_counter()
+        wire_size = len(body)
+        try:
+            if encoding == "gzip":
+                body = gzip.decompress(body)
+            data = json.loads(body)
+            snapshots = [payload_snapshot(d) for d in (data if isinstance(data, list) else [data])]
+        except (OSError, EOFError, ValueError, KeyError, TypeError) as e:
+            with self.lock:
+                self.stats["requests"] += 1
+                self.stats["rejected"] += 1
+            return 400, {"error": str(e)}
+        self.store.append_many(snapshots)
+        if self.dumps is not None:
+            for serial, timestamp, raw in snapshots:
+                self.dumps.write(serial, timestamp, raw)
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["snapshots"] += len(snapshots)
+            self.stats["bytes"] += wire_size
+            self.stats["busy"] += time.perf_counter() - begin_time
+        return 200, {"stored": len(snapshots)}
+
+    def start(self):
+        """Serve on a background thread; returns the /data URL"""
+        threading.Thread(target=self.server.serve_forever, name="m18-ingest", daemon=True).start()
+        return self.url
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def synthetic_payloads(count=32, seed=0):
+    """'count' distinct health(return_data=True) payloads from emulator register images (one pack serial each)"""
+    m = M18.offline()
+    payloads = []
+    for n in range(count):
+        values = decode_image({REG_INDEX[addr]: data for addr, data in default_register_image(seed + n).items()})
+        array = [None] + [[i, values[i]] for i in range(len(data_id))]
+        payloads.append(m.health(return_data=True, array=array))
+    return payloads
+
+def ingest_load_test(url, count=2000, batch=1, concurrency=4, compress=True, packs=32):
+    """
+    Replay synthetic payloads against an ingest endpoint and report throughput and request latency.
+    # count - payloads to send in total
+    # batch - payloads per request (a list body, as DashboardUploader sends)
+    # concurrency - client threads, each with its own pooled requests.Session
+    # packs - distinct synthetic packs the payloads cycle through
+    Returns {'payloads', 'requests', 'errors', 'seconds', 'latency'} (latency: sorted seconds per request)
+    """
+    import requests
+    import gzip
+    from concurrent.futures import ThreadPoolExecutor
+    templates = synthetic_payloads(packs)
+    start = datetime.datetime.now() - datetime.timedelta(seconds=count)
+    bodies = []
+    for first in range(0, count, batch):
+        chunk = []
+        for n in range(first, min(first + batch, count)):
+            payload = dict(templates[n % packs])
+            payload['timestamp'] = (start + datetime.timedelta(seconds=n)).strftime('%Y-%m-%d %H:%M:%S')
+            chunk.append(payload)
+        body = json.dumps(chunk if batch > 1 else chunk[0]).encode()
+        bodies.append(gzip.compress(body, compresslevel=6) if compress else body)
+    headers = {"Content-Type": "application/json"}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    local = threading.local()
+
+    def send(body):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        sent_at = time.perf_counter()
+        try:
+            ok = session.post(url, data=body, headers=headers, timeout=30).status_code == 200
+        except requests.RequestException:
+            ok = False
+        return ok, time.perf_counter() - sent_at
+
+    print(f"Sending {count} payloads in {len(bodies)} requests ({batch}/request, {concurrency} clients, "
+          f"{'gzip' if compress else 'plain'}, {sum(map(len, bodies)) / len(bodies) / 1024:.1f} KiB/request) to {url}")
+    begin_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, bodies))
+    seconds = time.perf_counter() - begin_time
+    latency = sorted(t for ok, t in results)
+    errors = sum(1 for ok, t in results if not ok)
+
+    def pct(p):
+        return latency[min(len(latency) - 1, int(len(latency) * p / 100))] * 1000
+
+    print(f"{count} payloads in {seconds:.2f}s: {count / seconds:.0f} payloads/s, {len(bodies) / seconds:.0f} requests/s, {errors} errors")
+    print(f"Latency: p50 {pct(50):.1f} ms, p95 {pct(95):.1f} ms, p99 {pct(99):.1f} ms, max {latency[-1] * 1000:.1f} ms")
+    return {"payloads": count, "requests": len(bodies), "errors": errors, "seconds": seconds, "latency": latency}
+
+# Transports
+# M18 talks to any object with the pyserial subset it uses: read(size), write(data),
+# reset_input_buffer(), close() and the break_condition, dtr and timeout attributes.
+
+def open_transport(port, timeout=0.8):
+    """
+    Open the transport for 'port'.
+    # "emu" or "emu:<seed>" - in-process BatteryEmulator
+    # socket://host:port, rfc2217://, loop:// - pyserial URL handlers
+    # anything else - serial device or pty path
+    """
+    if port == "emu" or port.startswith("emu:"):
+        seed = int(port.split(":", 1)[1]) if ":" in port else 0
+        return BatteryEmulator(seed=seed, timeout=timeout)
+    import serial
+    return serial.serial_for_url(port, baudrate=4800, timeout=timeout, stopbits=2)
+
+def default_register_image(seed=0):
+    """Deterministic register image for BatteryEmulator, as {addr: bytes} for every data_id entry"""
+    rng = random.Random(seed)
+    base = datetime.datetime(2021, 3, 15, tzinfo=datetime.timezone.utc)
+    image = {}
+    for addr, length, type, label in data_id:
+        match type:
+            case "sn":
+                value = (107).to_bytes(2, 'big') + (1234567 + seed).to_bytes(3, 'big')
+            case "date":
+                value = int((base + datetime.timedelta(days=rng.randint(0, 1500))).timestamp()).to_bytes(4, 'big')
+            case "cell_v":
+                value = b"".join(rng.randint(3850, 3950).to_bytes(2, 'big') for _ in range(5))
+            case "adc_t":
+                value = rng.randint(0x01C0, 0x0220).to_bytes(2, 'big')
+            case "dec_t":
+                value = bytes([rng.randint(18, 35), rng.randint(0, 255)])
+            case "ascii":
+                value = "M18 EMULATOR".ljust(length, '-').encode()
+            case "hhmmss":
+                value = rng.randint(0, 400 * 3600).to_bytes(4, 'big')
+            case _:
+                value = rng.randint(0, min(999, 256 ** length - 1)).to_bytes(length, 'big')
+        image[addr] = value
+    image[0x0011] = int(base.timestamp()).to_bytes(4, 'big')
+    image[0x9010] = rng.randint(200, 1500).to_bytes(2, 'big')
+    image[0x9012] = (8 * 3600 * rng.randint(50, 300)).to_bytes(4, 'big')
+    image[0x901A] = rng.randint(50, 300).to_bytes(4, 'big')
+    return image
+
+class BatteryEmulator:
+    """
+    In-process M18 battery implementing the transport interface, for benchmarks and regression runs.
+    # image - {addr: bytes} register image; default is default_register_image(seed)
+    # latency - seconds before each response becomes readable
+    # baudrate - if set, adds on-the-wire time per response byte (11 bits/byte with 2 stop bits)
+    # drop_rate - probability that a response is never sent
+    # corrupt_rate - probability that one response byte is flipped (checksum no longer matches)
+    # seed - seeds the register image and error injection
+    # realtime - if True, short reads block for 'timeout' like a real port; if False they return at once
+    """
+    READ_OK = 0x81
+    ERROR = 0x82
+
+    def __init__(self, image=None, latency=0.0, baudrate=None, drop_rate=0.0, corrupt_rate=0.0,
+                 seed=0, realtime=False, max_len=MAX_READ_LEN, timeout=0.8):
+        self.memory = {}
+        for addr, value in (image or default_register_image(seed)).items():
+            for offset, byte in enumerate(value):
+                self.memory[addr + offset] = byte
+        self.latency = latency
+        self.baudrate = baudrate
+        self.drop_rate = drop_rate
+        self.corrupt_rate = corrupt_rate
+        self.realtime = realtime
+        self.max_len = max_len
+        self.timeout = timeout
+        self.dtr = False
+        self.frames = 0
+        self.rng = random.Random(seed)
+        self._break = False
+        self._rx = bytearray()
+        self._tx = bytearray()
+        self._ready_at = 0.0
+
+    @property
+    def break_condition(self):
+        return self._break
+
+    @break_condition.setter
+    def break_condition(self, value):
+        if value:
+            self._rx.clear()
+            self._tx.clear()
+        self._break = value
+
+    @property
+    def in_waiting(self):
+        return len(self._tx)
+
+    def reset_input_buffer(self):
+        self._tx.clear()
+
+    def close(self):
+        pass
+
+    def write(self, data):
+        self._rx += bytes(data).translate(REVERSE_TABLE)
+        while self._rx:
+            size = self._frame_size(self._rx[0])
+            if size is None:
+                del self._rx[0]  # Not a command byte, resync on the next one
+                continue
+            if len(self._rx) < size:
+                break
+            frame = bytes(self._rx[:size])
+            del self._rx[:size]
+            self.frames += 1
+            self._respond(self._handle(frame))
+        return len(data)
+
+    def read(self, size=1):
+        if size <= 0:
+            return b""
+        wait = self._ready_at - time.monotonic()
+        if wait > 0 and self._tx:
+            time.sleep(wait)
+        data = bytes(self._tx[:size])
+        del self._tx[:size]
+        if len(data) < size and self.realtime:
+            time.sleep(self.timeout or 0)
+        return data
+
+    def _frame_size(self, first):
+        return {M18.SYNC_BYTE: 1, 0x01: 8, M18.CONF_CMD: 13, M18.SNAP_CMD: 5,
+                M18.KEEPALIVE_CMD: 5, M18.CAL_CMD: 5}.get(first)
+
+    def _with_checksum(self, payload):
+        return payload + struct.pack(">H", sum(payload))
+
+    def _handle(self, frame):
+        if frame[0] == M18.SYNC_BYTE:
+            return frame
+        if sum(frame[:-2]) != int.from_bytes(frame[-2:], 'big'):
+            return bytes([self.ERROR, 0x01])
+        match frame[0]:
+            case 0x01:
+                mode, addr, length = frame[1], (frame[3] << 8) | frame[4], frame[5]
+                if mode == 0x05:
+                    if addr not in self.memory:
+                        return bytes([self.ERROR, 0x02])
+                    self.memory[addr] = length  # Write commands carry the value in the length byte
+                    return bytes([self.READ_OK, mode])
+                span = range(addr, addr + length)
+                if length == 0 or length > self.max_len or any(a not in self.memory for a in span):
+                    return bytes([self.ERROR, 0x02])
+                return self._with_checksum(bytes([self.READ_OK, mode, length]) + bytes(self.memory[a] for a in span))
+            case M18.CONF_CMD:
+                return self._with_checksum(bytes([self.READ_OK, frame[1], frame[10]]))
+            case M18.KEEPALIVE_CMD:
+                pack_mv = sum(int.from_bytes(bytes(self.memory.get(0x400A + i, 0) for i in range(j, j + 2)), 'big')
+                              for j in range(0, 10, 2))
+                return self._with_checksum(bytes([self.READ_OK, frame[1]]) + struct.pack(">HHB", pack_mv, 0, 25))
+            case _:
+                return self._with_checksum(bytes([self.READ_OK, frame[1], 0x00, 0x00, 0x00]))
+
+    def _respond(self, response):
+        if self.drop_rate and self.rng.random() < self.drop_rate:
+            return
+        response = bytearray(response)
+        if self.corrupt_rate and len(response) > 2 and self.rng.random() < self.corrupt_rate:
+            response[self.rng.randrange(1, len(response))] ^= 0xFF
+        self._tx += bytes(response).translate(REVERSE_TABLE)
+        delay = self.latency + (len(response) * 11 / self.baudrate if self.baudrate else 0)
+        self._ready_at = time.monotonic() + delay
+
+REGISTER_TTL = [register_ttl(i) for i in range(len(data_id))]
+
+def benchmark_framing(iterations=20000):
+    """
+    Micro-benchmark of the framing hot path: table/translate bit reversal and sum() checksum
+    against the original string-based reversal and Python checksum loop.
+    """
+    import timeit
+
+    def reverse_bits_str(byte):
+        return int(f"{byte:08b}"[::-1], 2)
+
+    def checksum_loop(payload):
+        checksum = 0
+        for byte in payload:
+            checksum += byte & 0xFFFF
+        return checksum
+
+    frame = bytes(range(0x3A + 5))
+    assert bytearray(reverse_bits_str(b) for b in frame) == frame.translate(REVERSE_TABLE)
+    assert checksum_loop(frame) == sum(frame)
+    cases = [
+        ("reverse (str)", lambda: bytearray(reverse_bits_str(b) for b in frame)),
+        ("reverse (table)", lambda: frame.translate(REVERSE_TABLE)),
+        ("checksum (loop)", lambda: checksum_loop(frame)),
+        ("checksum (sum)", lambda: sum(frame)),
+    ]
+    print(f"{len(frame)}-byte frame, {iterations} iterations")
+    for name, fn in cases:
+        elapsed = timeit.timeit(fn, number=iterations)
+        print(f"{name:<16} {elapsed / iterations * 1e6:8.2f} us/frame")
+
+def benchmark_decode(iterations=2000):
+    """Decode a full emulator register image 'iterations' times through the decoder table and through decode_value()"""
+    raw = {i: default_register_image()[x[0]] for i, x in enumerate(data_id)}
+    decoder = M18.offline()
+    begin_time = time.perf_counter()
+    for _ in range(iterations):
+        decode_image(raw)
+    table = time.perf_counter() - begin_time
+    begin_time = time.perf_counter()
+    for _ in range(iterations):
+        for i, data in raw.items():
+            decoder.decode_value(data_id[i][2], data, "array")
+    display = time.perf_counter() - begin_time
+    print(f"{len(raw)}-register image, {iterations} iterations")
+    print(f"decode_image()  {iterations / table:10.0f} images/s")
+    print(f"decode_value()  {iterations / display:10.0f} images/s")
+
+def benchmark_startup(runs=5, history_path="m18_startup.jsonl", top=8):
+    """
+    Startup benchmark: load this script in 'runs' fresh interpreters with -X importtime and report the median
+    wall time over a bare interpreter and the slowest imports. Each result is appended to 'history_path'
+    (one JSON line per run) and compared with the previous one, so startup cost is tracked across versions.
+    """
+    import subprocess, statistics, platform
+    script = os.path.abspath(__file__)
+    load = ("import importlib.util; spec = importlib.util.spec_from_file_location('m18', %r); "
+            "spec.loader.exec_module(importlib.util.module_from_spec(spec))" % script)
+
+    def measure(code):
+        walls, imports = [], []
+        for _ in range(runs):
+            begin_time = time.perf_counter()
+            result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True)
+            walls.append(time.perf_counter() - begin_time)
+            if result.returncode != 0:
+                raise RuntimeError(result.stderr.strip().splitlines()[-1])
+            run = {}
+            for line in result.stderr.splitlines():
+                if line.startswith("import time:") and "self [us]" not in line:
+                    self_us, cumulative, name = line[len("import time:"):].split("|")
+                    if not name[1:].startswith(" "):  # Top-level import
+                        run[name.strip()] = int(cumulative) / 1000
+            imports.append(run)
+        return statistics.median(walls) * 1000, imports
+
+    bare_ms, bare_imports = measure("pass")
+    wall_ms, imports = measure(load)
+    startup = set().union(*bare_imports)  # Imported by the interpreter itself
+    modules = {name: statistics.median(run.get(name, 0) for run in imports)
+               for name in set().union(*imports) - startup}
+    slowest = sorted(modules.items(), key=lambda x: -x[1])[:top]
+    with open(script, encoding='utf-8') as file:
+        version = next((line.split(":", 1)[1].strip() for line in file if line.startswith("# Version:")), "?")
+    entry = {"date": datetime.datetime.now().isoformat(timespec='seconds'), "version": version,
+             "python": platform.python_version(), "machine": platform.machine(), "runs": runs,
+             "wall_ms": round(wall_ms, 1), "interpreter_ms": round(bare_ms, 1), "script_ms": round(wall_ms - bare_ms, 1),
+             "imports_ms": round(sum(modules.values()), 1), "slowest": {name: round(ms, 1) for name, ms in slowest}}
+    previous = None
+    try:
+        with open(history_path, encoding='utf-8') as file:
+            for line in file:
+                previous = json.loads(line)
+    except (OSError, ValueError):
+        pass
+    with open(history_path, 'a', encoding='utf-8') as file:
+        file.write(json.dumps(entry) + "\n")
+    print(f"Startup (median of {runs}): {wall_ms:.1f} ms, interpreter {bare_ms:.1f} ms, script {wall_ms - bare_ms:.1f} ms "
+          f"(imports {entry['imports_ms']:.1f} ms)")
+    for name, ms in slowest:
+        print(f"  {name:<24} {ms:7.1f} ms")
+    if previous:
+        print(f"Previous: script {previous['script_ms']:.1f} ms (version {previous['version']}, {previous['date']}), "
+              f"change {entry['script_ms'] - previous['script_ms']:+.1f} ms")
+    print(f"Appended to {history_path}")
+    return entry
+
+def serve_emulator(emulator, address="pty"):
+    """
+    Expose a BatteryEmulator on a pty ("pty") or TCP port ("tcp:<port>") so the serial and socket
+    code paths can be exercised without a pack. Returns the path or URL to pass as --port.
+    """
+    import socket
+    def pump(recv, send):
+        try:
+            while True:
+                data = recv(4096)
+                if not data:
+                    break
+                emulator.write(data)
+                pending = emulator.read(emulator.in_waiting)
+                if pending:
+                    send(pending)
+        except OSError:
+            pass
+
+    if address == "pty":
+        import tty
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        threading.Thread(target=pump, args=(lambda n: os.read(master, n), lambda b: os.write(master, b)), daemon=True).start()
+        return os.ttyname(slave)
+    if address.startswith("tcp:"):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(("127.0.0.1", int(address.split(":", 1)[1])))
+        server.listen(1)
+
+        def accept():
+            while True:
+                conn, _ = server.accept()
+                with conn:
+                    pump(conn.recv, conn.sendall)
+
+        threading.Thread(target=accept, daemon=True).start()
+        return f"socket://127.0.0.1:{server.getsockname()[1]}"
+    raise ValueError(f"Unknown emulator address: {address}")
 
 class M18:
     SYNC_BYTE = 0xAA
@@ -159,6 +1847,7 @@ class M18:
     PRINT_RX = False
     PRINT_TX_SAVE = False
     PRINT_RX_SAVE = False
+    metrics = None  # BusMetrics recording every command, or None (see BusMetrics)
 
     def txrx_print(self, enable=True):
         self.PRINT_TX = enable
@@ -173,29 +1862,40 @@ class M18:
         self.PRINT_TX = self.PRINT_TX_SAVE
         self.PRINT_RX = self.PRINT_RX_SAVE
 
-    def __init__(self, port=None):
-        if port is None:
-            print("*** NO PORT SPECIFIED ***")
-            print("Available serial ports (choose one that says USB somewhere):")
-            ports = list_ports.comports()
-            i = 1
-            for p in ports:
-                print(f" {i}: {p.device} - {p.manufacturer} - {p.description}")
-                i += 1
-            port_id = 0
-            while (port_id < 1) or (port_id >= i):
-                user_port = input(f"Choose a port (1-{i-1}): ")
-                try:
-                    port_id = int(user_port)
-                except ValueError:
-                    print("Invalid input. Please enter a number")
-            p = ports[port_id - 1]
-            print(f"You selected \"{p.device} - {p.manufacturer} - {p.description}\"")
-            print(f"In future, use \"m18_battery_diagnostics.py --port {p.device}\" to avoid this menu")
-            input("Press Enter to continue")
-            port = p.device
-        self.port = serial.Serial(port, baudrate=4800, timeout=0.8, stopbits=2)
+    def __init__(self, port=None, transport=None, store=None, dumps=None):
+        if port is None and transport is None:
+            if sys.stdin.isatty():
+                port = choose_port()
+            else:
+                ports = find_battery_ports()
+                if len(ports) != 1:
+                    raise ValueError(f"No port specified and {len(ports)} USB serial ports found; use --port")
+                port = ports[0]
+        self.port = transport or open_transport(port)
+        self.adapter = port or getattr(transport, "port", None) or type(transport).__name__
+        self.metrics_key = None
+        self.cache = RegisterCache()
+        self.store = store  # SnapshotStore fed by every register read, or None
+        self.dumps = dumps  # RawDumpWriter fed by every register read, or None
+        self.latency = LatencyTracker()
+        self.sent_at = time.monotonic()
+        self.cache_serial = None
+        self.cache_seen = 0.0
         self.idle()
+
+    @classmethod
+    def offline(cls):
+        """M18 without a transport, for decoding stored data (decode_value, health(array=...))"""
+        m = cls.__new__(cls)
+        m.port = None
+        m.adapter = "offline"
+        m.metrics_key = None
+        m.cache = RegisterCache()
+        m.store = m.dumps = None
+        m.latency = LatencyTracker()
+        m.cache_serial = None
+        m.cache_seen = 0.0
+        return m
         
     def idle(self):  # <--- Add/correct this method here (indented under the class)
         try:
@@ -204,14 +1904,20 @@ class M18:
             print(f"idle: Failed with error: {e}")
 
 
+    def set_lines(self, state):
+        try:
+            self.port.break_condition = state
+            self.port.dtr = state
+        except OSError:
+            pass  # ptys can't signal break/DTR; the sync byte alone resyncs the emulator
+
     def reset(self):
         self.ACC = 4
-        self.port.break_condition = True
-        self.port.dtr = True
+        self.set_lines(True)
         time.sleep(0.3)
-        self.port.break_condition = False
-        self.port.dtr = False
+        self.set_lines(False)
         time.sleep(0.3)
+        self.latency.stats["reset_wait"] += 0.6
         self.send(struct.pack('>B', self.SYNC_BYTE))
         try:
             response = self.read_response(1)
@@ -231,41 +1937,58 @@ class M18:
         self.ACC = acc_values[next_index]
 
     def reverse_bits(self, byte):
-        return int(f"{byte:08b}"[::-1], 2)
+        return REVERSE_TABLE[byte]
 
     def checksum(self, payload):
-        checksum = 0
-        for byte in payload:
-            checksum += byte & 0xFFFF
-        return checksum
+        return sum(payload)
 
     def add_checksum(self, lsb_command):
         lsb_command += struct.pack(">H", self.checksum(lsb_command))
         return lsb_command
 
+    def verify_checksum(self, response):
+        """True if the trailing 16-bit checksum of LSB 'response' matches its payload"""
+        return len(response) > 2 and (self.checksum(response[:-2]) & 0xFFFF) == int.from_bytes(response[-2:], 'big')
+
     def send(self, command):
         self.port.reset_input_buffer()
-        debug_print = " ".join(f"{byte:02X}" for byte in command)
-        msb = bytearray(self.reverse_bits(byte) for byte in command)
+        msb = bytes(command).translate(REVERSE_TABLE)
         if self.PRINT_TX:
-            print(f"Sending: {debug_print}")
+            print(f"Sending: {' '.join(f'{byte:02X}' for byte in command)}")
+        if self.metrics is not None:
+            self.metrics_key = self.metrics.key(self.adapter, command)
+            self.metrics.sent(self.metrics_key, len(msb))
         self.port.write(msb)
+        self.sent_at = time.monotonic()
 
     def send_command(self, command):
         self.send(self.add_checksum(command))
 
     def read_response(self, size):
+        self.port.timeout = self.latency.header_timeout()
         msb_response = self.port.read(1)
+        waited = time.monotonic() - self.sent_at
         if not msb_response or len(msb_response) < 1:
+            self.latency.record_timeout(waited)
+            if self.metrics is not None:
+                self.metrics.timeout(self.metrics_key)
             raise ValueError("Empty response")
-        if self.reverse_bits(msb_response[0]) == 0x82:
-            msb_response += self.port.read(1)
-        else:
-            msb_response += self.port.read(size-1)
-        lsb_response = bytearray(self.reverse_bits(byte) for byte in msb_response)
-        debug_print = " ".join(f"{byte:02X}" for byte in lsb_response)
+        self.latency.record_response(waited)
+        error = self.reverse_bits(msb_response[0]) == 0x82
+        expected = 1 if error else size - 1
+        short = False
+        if expected > 0:
+            self.port.timeout = self.latency.body_timeout(expected)
+            started = time.monotonic()
+            body = self.port.read(expected)
+            short = len(body) < expected
+            self.latency.record_body(time.monotonic() - started, short)
+            msb_response += body
+        if self.metrics is not None:
+            self.metrics.response(self.metrics_key, time.monotonic() - self.sent_at, len(msb_response), error, short)
+        lsb_response = bytearray(msb_response.translate(REVERSE_TABLE))
         if self.PRINT_RX:
-            print(f"Received: {debug_print}")
+            print(f"Received: {' '.join(f'{byte:02X}' for byte in lsb_response)}")
         return lsb_response
 
     def configure(self, state):
@@ -353,9 +2076,89 @@ class M18:
         self.idle()
         self.txrx_restore()
 
+    def backoff(self, attempt):
+        """Sleep before retry 'attempt' (jittered exponential backoff, see LatencyTracker.backoff_delay)"""
+        if self.metrics is not None:
+            self.metrics.retry(self.metrics_key)
+        time.sleep(self.latency.backoff_delay(attempt))
+
     def cmd(self, a, b, c, length, command=0x01):
         self.send_command(struct.pack('>BBBBBB', command, 0x04, 0x03, a, b, c))
-        return self.read_response(length)
+        response = self.read_response(length)
+        if len(response) == length and response[0] == 0x81 and not self.verify_checksum(response):
+            if self.metrics is not None:
+                self.metrics.checksum_failure(self.metrics_key)
+            raise ValueError("Response checksum mismatch")
+        return response
+
+    def read_block(self, addr, length, retries=3):
+        """Read 'length' bytes starting at 'addr'. Returns the data bytes, or None on an invalid response."""
+        addr_h = (addr >> 8) & 0xFF
+        addr_l = addr & 0xFF
+        response = None
+        for attempt in range(retries):
+            try:
+                response = self.cmd(addr_h, addr_l, length, (length + 5))
+                break
+            except Exception as e:
+                print(f"Retry {attempt+1}/{retries} for 0x{addr:04X} failed: {e}")
+                self.backoff(attempt)
+        if response and len(response) >= 4 and response[0] == 0x81 and len(response[3:]) >= length:
+            return response[3:(3+length)]
+        return None
+
+    def read_registers(self, id_list, retries=3):
+        """
+        Read data_id registers using coalesced block reads (see plan_reads).
+        Returns a dict of {id: data bytes or None}
+        """
+        values = {}
+        for addr, length, members in plan_reads(id_list):
+            data = self.read_block(addr, length, retries)
+            if data is None and len(members) > 1:
+                # Block refused, fall back to one read per register
+                for i, offset, reg_len in members:
+                    values[i] = self.read_block(addr + offset, reg_len, retries)
+                continue
+            for i, offset, reg_len in members:
+                values[i] = data[offset:(offset+reg_len)] if data is not None else None
+        return values
+
+    def read_registers_cached(self, id_list, force_refresh=True, retries=3):
+        """
+        read_registers() through self.cache. Every read refreshes the cache; with force_refresh=False,
+        registers still within their TTL for the connected pack are served from it and only stale ones are read.
+        """
+        now = time.monotonic()
+        id_list = list(dict.fromkeys(id_list))
+        serial = None
+        if not force_refresh:
+            if self.cache_serial is not None and now - self.cache_seen < CACHE_TTL_LIVE:
+                serial = self.cache_serial  # Same pack seen moments ago, no need to re-check the serial
+                cached = self.cache.lookup(serial, id_list, now)
+                if len(cached) == len(id_list):
+                    return cached
+        self.reset()
+        if not force_refresh and serial is None:
+            sn = self.read_block(0x0004, 5, retries)
+            serial = int.from_bytes(sn[2:5], 'big') if sn else None
+        cached = self.cache.lookup(serial, id_list, now) if not force_refresh and serial is not None else {}
+        raw = self.read_registers([i for i in id_list if i not in cached], retries)
+        if serial is None and raw.get(2):
+            serial = int.from_bytes(raw[2][2:5], 'big')
+        if serial is not None:
+            self.cache.store(serial, raw, now)
+            self.cache_serial, self.cache_seen = serial, now
+            if raw:
+                try:
+                    if self.store is not None:
+                        self.store.append(serial, time.time(), raw)
+                    if self.dumps is not None:
+                        self.dumps.write(serial, time.time(), raw)
+                except OSError as e:
+                    print(f"Error writing snapshot store/dump: {e}")
+        raw.update(cached)
+        return raw
 
     def brute(self, a, b, len=0xFF, command=0x01):
         self.reset()
@@ -383,6 +2186,11 @@ class M18:
             print(f"\nStopped at address: 0x{addr:04X}")
         finally:
             self.idle()
+            self.latency.report()
+
+    def sweep(self, start=0, stop=0x10000, checkpoint_path="m18_sweep.json", results_path="m18_sweep_hits.csv", max_len=0xFF, skip=None):
+        """Resumable full_brute: see SweepEngine. Returns the run summary."""
+        return SweepEngine(self, checkpoint_path, results_path, max_len, skip).run(start, stop)
 
     def wcmd(self, a, b, c, length):
         self.send_command(struct.pack('>BBBBBB', 0x01, 0x05, 0x03, a, b, c))
@@ -394,6 +2202,7 @@ class M18:
                 print("ERROR: Message too long!")
                 return
             print(f"Writing \"{message}\" to memory")
+            self.cache.invalidate()
             self.reset()
             message = message.ljust(0x14, '-')
             for i, char in enumerate(message):
@@ -401,7 +2210,8 @@ class M18:
         except Exception as e:
             print(f"write_message: Failed with error: {e}")
 
-    def calculate_temperature(self, adc_value):
+    @staticmethod
+    def calculate_temperature(adc_value):
         R1 = 10e3
         R2 = 20e3
         T1 = 50
@@ -416,14 +2226,7 @@ class M18:
         return round(temperature_f, 2)
 
     def bytes2dt(self, time_bytes):
-        try:
-            epoch_time = int.from_bytes(time_bytes, 'big')
-            if epoch_time < 0 or epoch_time > 0x7FFFFFFF:
-                return None
-            dt = datetime.datetime.fromtimestamp(epoch_time, tz=datetime.timezone.utc)
-            return dt
-        except (ValueError, TypeError, OverflowError):
-            return None
+        return bytes2dt(time_bytes)
 
     def read_all(self):
         try:
@@ -456,64 +2259,51 @@ class M18:
         except Exception as e:
             print(f"read_all_spreadsheet: Failed with error: {e}")
 
-    def read_id(self, id_array=[], force_refresh=True, output="label", csv_path=None, retries=3):
+    def decode_value(self, type, data, output="array"):
+        """Decode register bytes of data_id 'type'. Returns (array_value, display value for 'output')"""
+        array_value = TYPE_DECODERS.get(type, decode_unknown)(data)
+        match type:
+            case "date":
+                value = array_value.strftime('%Y-%m-%d %H:%M:%S') if array_value else "------"
+            case "sn":
+                if output not in ["label", "array", "csv", "ndjson"]:
+                    array_value = None
+                    value = f"{int.from_bytes(data[0:2], 'big')}\n{int.from_bytes(data[2:5], 'big')}"
+                else:
+                    value = array_value
+            case "cell_v":
+                cv = array_value
+                if output == "raw":
+                    value = f"{cv[0]:4d}\n{cv[1]:4d}\n{cv[2]:4d}\n{cv[3]:4d}\n{cv[4]:4d}"
+                else:
+                    value = f"1: {cv[0]:4d}, 2: {cv[1]:4d}, 3: {cv[2]:4d}, 4: {cv[3]:4d}, 5: {cv[4]:4d}"
+            case _:
+                value = array_value if array_value is not None else "------"
+        return array_value, value
+
+    def read_id(self, id_array=[], force_refresh=True, output="label", csv_path=None, retries=3, sink=None):
         """
         Read data by ID. Default is print all
         # id_array - array of registers to print
-        # force_refresh - force a read of all registers to ensure they're up to date
-        # output - ["label" | "raw" | "array" | "form" | "csv"]
-        # csv_path - custom CSV path; if None for output='csv', uses serial_number_year_month_day.csv
+        # force_refresh - force a read of all registers to ensure they're up to date; if False, registers
+        #                 still within their cache TTL for this pack are not re-read (see RegisterCache)
+        # output - ["label" | "raw" | "array" | "form" | "csv" | "ndjson"]
+        # csv_path - fixed file for output='csv'/'ndjson'; if None, files rotate per pack and day (<serial>_<YYYY-MM-DD>.csv)
         # retries - number of retry attempts for failed reads
+        # sink - RegisterSink to stream csv/ndjson rows to across calls (long captures); default is one per call
         """
-        if output not in ["label", "raw", "array", "form", "csv"]:
-            print(f"Unrecognised 'output' = {output}. Please choose \"label\", \"raw\", \"array\", \"form\", or \"csv\"")
+        if output not in ["label", "raw", "array", "form", "csv", "ndjson"]:
+            print(f"Unrecognised 'output' = {output}. Please choose \"label\", \"raw\", \"array\", \"form\", \"csv\" or \"ndjson\"")
             output = "label"
         
         array = []
-        csv_data = []
+        own_sink = sink is None and output in ["csv", "ndjson"]
+        if own_sink:
+            sink = RegisterSink(output, csv_path)
         
         try:
-            # Get serial number and manufacture date for CSV filename
-            serial_number = None
-            manufacture_date = None
-            if output == "csv" and csv_path is None:
-                for attempt in range(retries):
-                    try:
-                        self.reset()
-                        response = self.cmd(0x00, 0x04, 0x05, 10)
-                        if response and len(response) >= 4 and response[0] == 0x81:
-                            data = response[3:8]
-                            serial_number = int.from_bytes(data[2:5], 'big')
-                        response = self.cmd(0x00, 0x11, 0x04, 9)
-                        if response and len(response) >= 4 and response[0] == 0x81:
-                            data = response[3:7]
-                            manufacture_date = self.bytes2dt(data)
-                            if manufacture_date:
-                                manufacture_date = manufacture_date.strftime('%Y_%m_%d')
-                        if serial_number and manufacture_date:
-                            csv_path = f"{serial_number}_{manufacture_date}.csv"
-                            break
-                        print(f"Retry {attempt+1}/{retries} for serial number/manufacture date failed")
-                        time.sleep(0.5)
-                    except Exception as e:
-                        print(f"Retry {attempt+1}/{retries} failed: {e}")
-                        time.sleep(0.5)
-                if not csv_path:
-                    csv_path = 'battery_diagnostics.csv'
-                    print("Warning: Using default CSV path due to failed reads")
-            
-            self.reset()
             if force_refresh:
-                for addr_h, addr_l, length in data_matrix:
-                    for attempt in range(retries):
-                        try:
-                            response = self.cmd(addr_h, addr_l, length, (length + 5))
-                            break
-                        except Exception as e:
-                            print(f"Retry {attempt+1}/{retries} for 0x{addr_h:02X}{addr_l:02X} failed: {e}")
-                            time.sleep(0.5)
-                self.idle()
-                time.sleep(0.1)
+                self.reset()
             
             now = datetime.datetime.now()
             formatted_time = now.strftime("%Y-%m-%d %H:%M:%S")
@@ -524,67 +2314,22 @@ class M18:
                 print(formatted_time)
             elif output in ["array", "form"]:
                 array.append(formatted_time)
-            elif output == "csv":
-                csv_data.append(["Timestamp", formatted_time])
-                csv_data.append(["ID", "Address", "Length", "Type", "Label", "Value"])
             
-            self.reset()
-            for i in id_array or range(0, len(data_id)):
+            id_list = id_array or range(0, len(data_id))
+            if output in ["csv", "ndjson"]:
+                sn_id = REG_INDEX[0x0004]  # Serial number, for the per-pack file
+                raw = self.read_registers_cached(list(id_list) + [sn_id], force_refresh, retries)
+                sink.begin(int.from_bytes(raw[sn_id][2:5], 'big') if raw.get(sn_id) else None, now.timestamp())
+            else:
+                raw = self.read_registers_cached(id_list, force_refresh, retries)
+            for i in id_list:
                 addr = data_id[i][0]
-                addr_h = (addr >> 8) & 0xFF
-                addr_l = addr & 0xFF
                 length = data_id[i][1]
                 type = data_id[i][2]
                 label = data_id[i][3]
-                response = None
-                for attempt in range(retries):
-                    try:
-                        response = self.cmd(addr_h, addr_l, length, (length + 5))
-                        break
-                    except Exception as e:
-                        print(f"Retry {attempt+1}/{retries} for ID {i} (0x{addr:04X}) failed: {e}")
-                        time.sleep(0.5)
-                if response and len(response) >= 4 and response[0] == 0x81 and len(response[3:]) >= length:
-                    data = response[3:(3+length)]
-                    match type:
-                        case "uint":
-                            array_value = value = int.from_bytes(data, 'big')
-                        case "date":
-                            array_value = self.bytes2dt(data)
-                            value = array_value.strftime('%Y-%m-%d %H:%M:%S') if array_value else "------"
-                        case "hhmmss":
-                            dur = int.from_bytes(data, 'big')
-                            mm, ss = divmod(dur, 60)
-                            hh, mm = divmod(mm, 60)
-                            array_value = value = f"{hh}:{mm:02d}:{ss:02d}"
-                        case "ascii":
-                            try:
-                                str_val = data.decode('utf-8')
-                                array_value = value = f'"{str_val}"'
-                            except UnicodeDecodeError:
-                                array_value = value = "------"
-                        case "sn":
-                            btype = int.from_bytes(data[0:2], 'big')
-                            serial = int.from_bytes(data[2:5], 'big')
-                            if output in ["label", "array", "csv"]:
-                                array_value = f"Type: {btype:3d}, Serial: {serial:d}"
-                                value = f"Type: {btype:3d}, Serial: {serial:d}"
-                            else:
-                                value = f"{btype}\n{serial}"
-                        case "adc_t":
-                            array_value = value = self.calculate_temperature(int.from_bytes(data, 'big'))
-                        case "dec_t":
-                            temp_c = data[0] + data[1]/256
-                            temp_f = (temp_c * 9/5) + 32  # Convert to Fahrenheit
-                            array_value = value = f"{temp_f:.2f}"
-                        case "cell_v":
-                            array_value = cv = [int.from_bytes(data[i:i+2], 'big') for i in range(0, 10, 2)]
-                            if output == "label":
-                                value = f"1: {cv[0]:4d}, 2: {cv[1]:4d}, 3: {cv[2]:4d}, 4: {cv[3]:4d}, 5: {cv[4]:4d}"
-                            elif output == "raw":
-                                value = f"{cv[0]:4d}\n{cv[1]:4d}\n{cv[2]:4d}\n{cv[3]:4d}\n{cv[4]:4d}"
-                            elif output == "csv":
-                                value = f"1: {cv[0]:4d}, 2: {cv[1]:4d}, 3: {cv[2]:4d}, 4: {cv[3]:4d}, 5: {cv[4]:4d}"
+                data = raw.get(i)
+                if data is not None:
+                    array_value, value = self.decode_value(type, data, output)
                 else:
                     array_value = None
                     value = "------"
@@ -598,39 +2343,30 @@ class M18:
                 elif output == "form":
                     array.append(value)
                 elif output == "csv":
-                    csv_data.append([i, f"0x{addr:04X}", length, type, label, value])
+                    sink.row(i, value)
+                elif output == "ndjson":
+                    sink.row(i, array_value, data)
                 
-            if output == "csv":
-                try:
-                    if not os.access(os.path.dirname(csv_path) or '.', os.W_OK):
-                        print(f"Error: No write permission for {csv_path}")
-                        return
-                    mode = 'a' if os.path.exists(csv_path) else 'w'
-                    with open(csv_path, mode, newline='', encoding='utf-8') as file:
-                        writer = csv.writer(file)
-                        if mode == 'w':
-                            writer.writerow(["Timestamp", formatted_time])
-                            writer.writerow(["ID", "Address", "Length", "Type", "Label", "Value"])
-                        else:
-                            writer.writerow([])
-                            writer.writerow(["Timestamp", formatted_time])
-                        for row in csv_data[2:]:
-                            writer.writerow(row)
-                    print(f"Data appended to {csv_path}")
-                except IOError as e:
-                    print(f"Error writing CSV file: {e}")
+            if output in ["csv", "ndjson"]:
+                sink.end()
+                print(f"Data appended to {sink.current}")
                 
             if output in ["array", "form"] and array:
                 return array
                 
             self.idle()
+        except OSError as e:
+            print(f"read_id: Error writing {output.upper()} file: {e}")
         except Exception as e:
             print(f"read_id: Failed with error: {e}")
+        finally:
+            if own_sink:
+                sink.close()
 
     def plot_voltages(self):
         try:
             import matplotlib.pyplot as plt
-            array = self.read_id(id_array=[12], output="array", retries=3)
+            array = self.read_id(id_array=[12], force_refresh=False, output="array", retries=3)
             if not array or len(array) < 2 or not isinstance(array[1][1], list):
                 print("Failed to read cell voltages")
                 return
@@ -647,334 +2383,1003 @@ class M18:
         except Exception as e:
             print(f"plot_voltages: Failed with error: {e}")
 
-    def health(self, force_refresh=True, verbose=False, return_data=False):
+    def stream(self, rate=2.0, plot=False, duration=None):
+        """Live cell voltage/temperature telemetry without full-register reads (see TelemetryStream)"""
+        telemetry = TelemetryStream(self, rate)
+        if plot:
+            telemetry.live_plot()
+        else:
+            telemetry.terminal_chart(duration)
+        return telemetry
+
+    def health_report(self, force_refresh=True, array=None):
+        """
+        Compute-only health check: read all registers (unless 'array' is given) and return a HealthReport.
+        No console output or files; raises on read failure or incomplete data.
+        """
+        if array is None:
+            array = self.read_id(list(range(0, len(data_id))), force_refresh, "array", retries=5)
+        return HealthReport.from_array(array)
+
+    def health(self, force_refresh=True, verbose=False, return_data=False, array=None):
         """
         Generate a health report with grouped, color-coded console output and CSV summary.
         # force_refresh - force a read of all registers
         # verbose - if True, print all 183 registers in console; if False, show summary only
-        # return_data - if True, returnellett a dict with 'summary' and 'registers' instead of printing
+        # return_data - if True, return a dict with 'summary' and 'registers' instead of printing (no console, CSV or TX/RX output)
+        # array - already-read read_id(output="array") result to report on instead of reading the battery
         """
-        reg_list = list(range(0, len(data_id)))  # Read all registers
-        self.txrx_save_and_set(True)  # Enable debug for troubleshooting
-        csv_data = []
-        summary_data = [["Summary", "Timestamp", datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")]]
-        warnings = []
-        
+        if return_data:
+            try:
+                return self.health_report(force_refresh, array).to_dict()
+            except Exception as e:
+                logger.warning(f"health: Failed with error: {e}")
+                return None
+
         try:
-            print("Reading battery. This will take 10-20sec\n")
-            array = self.read_id(reg_list, force_refresh, "array", retries=5)  # Increased to 5
-            if not array or len(array) < len(reg_list) + 1:
-                raise ValueError("Incomplete data from read_id")
-            
-            # Get serial number and manufacture date for CSV filename
-            serial_number = None
-            manufacture_date = None
-            bat_type = "Unknown"
-            bat_text = [0, "Unknown"]
-            sn_index = next((i for i, x in enumerate(data_id) if x[0] == 0x0004), None)  # ID 2
-            logger.debug(f" Battery Text Index: {sn_index}, Value: {array[sn_index + 1][1] if sn_index is not None else 'None'}")
-            if sn_index is not None and isinstance(array[sn_index + 1][1], str):
-                bat_text = array[sn_index + 1][1].split(', ')
-                if len(bat_text) >= 2 and 'Type: ' in bat_text[0] and 'Serial: ' in bat_text[1]:
-                    bat_type = bat_text[0].split('Type: ')[1].strip()
-                    serial_number = bat_text[1].split('Serial: ')[1].strip()
-                    bat_lookup = {
-                        "37": [2, "2Ah CP (5s1p 18650)"], "40": [5, "5Ah XC (5s2p 18650)"], "165": [5, "5Ah XC (5s2p 18650)"],
-                        "46": [6, "6Ah XC (5s2p 18650)"], "104": [3, "3Ah HO (5s1p 21700)"], "106": [4, "6Ah HO (5s2p 21700)"],
-                        "107": [8, "8Ah HO (5s2p 21700)"], "108": [12, "12Ah HO (5s3p 21700)"],
-                        "383": [12, "12Ah Forge (5s3p 21700 tabless)"], "384": [12, "12Ah Forge (5s3p 21700 tabless)"]
-                    }
-                    bat_text = bat_lookup.get(bat_type, [0, "Unknown"])
-            logger.debug(f"E-Serial: {serial_number or 'None'}, Type: {bat_type}")
-            date_index = next((i for i, x in enumerate(data_id) if x[0] == 0x0011), None)  # ID 4
-            if date_index is not None and isinstance(array[date_index + 1][1], datetime.datetime):
-                manufacture_date = array[date_index + 1][1].strftime('%Y_%m_%d')
-            current_datetime = datetime.datetime.now().strftime('%Y-%m-%d_%I-%M%p').lower()
-            csv_path = f"Milwaukee_Batt_M18_{serial_number or 'unknown'}_{current_datetime}.csv"
-            
-            # Process all registers for CSV
-            csv_data.append(["ID", "Address", "Length", "Type", "Label", "Value"])
-            for i, (reg_id, value) in enumerate(array[1:]):
-                addr = data_id[reg_id][0]
-                length = data_id[reg_id][1]
-                type = data_id[reg_id][2]
-                label = data_id[reg_id][3]
-                if type == "date" and isinstance(value, datetime.datetime):
-                    formatted_value = value.strftime('%Y-%m-%d %H:%M:%S')
-                elif type == "cell_v" and isinstance(value, list):
-                    formatted_value = f"1: {value[0]:4d}, 2: {value[1]:4d}, 3: {value[2]:4d}, 4: {value[3]:4d}, 5: {value[4]:4d}"
-                elif type == "hhmmss" and isinstance(value, (int, str)):
-                    formatted_value = str(value)
-                elif type == "ascii" and isinstance(value, str):
-                    formatted_value = f'"{value}"'
-                elif type == "sn" and isinstance(value, str):
-                    formatted_value = value
-                elif isinstance(value, (int, float)):
-                    formatted_value = str(value)
-                else:
-                    formatted_value = "------"
-                csv_data.append([reg_id, f"0x{addr:04X}", length, type, label, formatted_value])
-                if verbose:
-                    print(f"{reg_id:3d} 0x{addr:04X} {length:2d} {type:>6} {label:<39} {formatted_value:<}")
-            
-            # Additional health metrics
-            imbalance = 0
-            cell_v_index = next((i for i, x in enumerate(data_id) if x[0] == 0x400A), None)  # ID 12
-            logger.debug(f"Cell Voltage Index: {cell_v_index}, Value: {array[cell_v_index + 1][1] if cell_v_index is not None else 'None'}")
-            if cell_v_index is not None and isinstance(array[cell_v_index + 1][1], list) and len(array[cell_v_index + 1][1]) == 5:
-                imbalance = max(array[cell_v_index + 1][1]) - min(array[cell_v_index + 1][1])
-                summary_data.append(["Summary", "Cell Imbalance (mV)", str(imbalance)])
-                summary_data.append(["Summary", "Cell Voltages (mV)", ", ".join(map(str, array[cell_v_index + 1][1]))])
-                summary_data.append(["Summary", "Pack Voltage", f"{sum(array[cell_v_index + 1][1])/1000:.2f} V"])
-                if imbalance > 100:
-                    warnings.append("High cell imbalance (>100 mV). Consider using a balancing charger.")
-            else:
-                logger.debug(f"Cell voltages invalid: {array[cell_v_index + 1][1] if cell_v_index is not None else 'None'}")
-                summary_data.append(["Summary", "Cell Imbalance (mV)ibas", "------"])
-                summary_data.append(["Summary", "Cell Voltages (mV)", "------"])
-                summary_data.append(["Summary", "Pack Voltage", "------"])
-            
-            discharge_index = next((i for i, x in enumerate(data_id) if x[0] == 0x9012), None)  # ID 29
-            logger.debug(f"Discharge Index: {discharge_index}, Value: {array[discharge_index + 1][1] if discharge_index is not None else 'None'}")
-            total_discharge_cycles = 0
-            soh = 0
-            if discharge_index is not None and isinstance(array[discharge_index + 1][1], (int, float)):
-                if bat_text[0] != 0:
-                    total_discharge_cycles = array[discharge_index + 1][1] / 3600 / bat_text[0]
-                    soh = max(0, 100 - (total_discharge_cycles / 500 * 100))
-                    summary_data.append(["Summary", "Total Discharge (Ah)", f"{array[discharge_index + 1][1]/3600:.2f}"])
-                    summary_data.append(["Summary", "Total Discharge Cycles", f"{total_discharge_cycles:.2f}"])
-                    summary_data.append(["Summary", "Estimated SoH (%)", f"{soh:.1f}"])
-                    logger.debug(f"Total Discharge (Ah): {array[discharge_index + 1][1]/3600:.2f}, Cycles: {total_discharge_cycles:.2f}, SoH: {soh:.1f}")
-                    if soh < 50:
-                        warnings.append("Low SoH (<50%). Battery may need replacement soon.")
-            
-            low_voltage_index = next((i for i, x in enumerate(data_id) if x[0] == 0x9030), None)  # ID 39
-            low_voltage_event_index = next((i for i, x in enumerate(data_id) if x[0] == 0x9036), None)  # ID 42
-            logger.debug(f"Low Voltage Index: {low_voltage_index}, Value: {array[low_voltage_index + 1][1] if low_voltage_index is not None else 'None'}")
-            logger.debug(f"Low Voltage Event Index: {low_voltage_event_index}, Value: {array[low_voltage_event_index + 1][1] if low_voltage_event_index is not None else 'None'}")
-            if low_voltage_index is not None and low_voltage_event_index is not None and (array[low_voltage_index + 1][1] or array[low_voltage_event_index + 1][1]):
-                warnings.append("Avoid deep discharges to extend battery life.")
-            
-            tool_time_start = next((i for i, x in enumerate(data_id) if x[0] == 0x903A), None)
-            tool_time_end = next((i for i, x in enumerate(data_id) if x[0] == 0x9060), None)
-            tool_time_index = list(range(tool_time_start, tool_time_end + 1)) if tool_time_start is not None and tool_time_end is not None else []
-            tool_time = sum(array[i + 1][1] for i in tool_time_index if isinstance(array[i + 1][1], (int, float))) if tool_time_index else 0
-            logger.debug(f"Tool Time: {tool_time}")
-            summary_data.append(["Summary", "Total Time on Tool (>10A)", str(datetime.timedelta(seconds=tool_time)) if tool_time else "------"])
-            
-            # Console output for summary
-            if not return_data:
-                print(f"{YELLOW}=== BASIC INFO ==={RESET}")
-                print(f"Type: {bat_type} [{bat_text[1]}] {GREEN}✓{RESET}")
-                summary_data.append(["Summary", "Type", f"{bat_type} [{bat_text[1]}]"])
-                print(f"E-Serial: {serial_number or '------'}")
-                summary_data.append(["Summary", "E-Serial", str(serial_number) if serial_number else "------"])
-                if date_index is not None:
-                    manufacture_date_str = array[date_index + 1][1].strftime('%Y-%m - %d') if isinstance(array[date_index + 1][1], datetime.datetime) else str(array[date_index + 1][1] or "------")
-                    print(f"Manufacture Date: {manufacture_date_str}")
-                    summary_data.append(["Summary", "Manufacture Date", manufacture_date_str])
-                current_date_index = next((i for i, x in enumerate(data_id) if x[0] == 0x0037), None)  # ID 8
-                logger.debug(f"Current Date Index: {current_date_index}, Value: {array[current_date_index + 1][1] if current_date_index is not None else 'None'}")
-                if current_date_index is not None:
-                    current_date_str = array[current_date_index + 1][1].strftime('%Y-%m-%d %H:%M:%S') if isinstance(array[current_date_index + 1][1], datetime.datetime) else str(array[current_date_index + 1][1] or "------")
-                    print(f"Current Date: {current_date_str}")
-                    summary_data.append(["Summary", "Current Date", current_date_str])
-                days_index = next((i for i, x in enumerate(data_id) if x[0] == 0x9010), None)  # ID 28
-                logger.debug(f"Days Index: {days_index}, Value: {array[days_index + 1][1] if days_index is not None else 'None'}")
-                if days_index is not None:
-                    days_since_first = array[days_index + 1][1] or "------"
-                    print(f"Days Since First Charge: {days_since_first} days{' (New battery)' if isinstance(days_since_first, (int, float)) and days_since_first < 30 else ''}")
-                    summary_data.append(["Summary", "Days Since First Charge", str(days_since_first)])
-                
-                print(f"\n{YELLOW}=== VOLTAGE & TEMPERATURE ==={RESET}")
-                if cell_v_index is not None and isinstance(array[cell_v_index + 1][1], list) and len(array[cell_v_index + 1][1]) == 5:
-                    print(f"Pack Voltage: {sum(array[cell_v_index + 1][1])/1000:.2f} V")
-                    print(f"Cell Voltages (mV): {', '.join(map(str, array[cell_v_index + 1][1]))}")
-                    print(f"Cell Imbalance: {imbalance} mV {GREEN if imbalance <= 100 else YELLOW}✓{RESET if imbalance <= 100 else '⚠ (Consider balancing charger)'}")
-                else:
-                    print(f"Pack Voltage: ------")
-                    print(f"Cell Voltages (mV): ------")
-                    print(f"Cell Imbalance: ------")
-                
-                temp_non_forge_index = next((i for i, x in enumerate(data_id) if x[0] == 0x4014), None)  # ID 13
-                temp_forge_index = next((i for i, x in enumerate(data_id) if x[0] == 0x401F), None)  # ID 18
-                logger.debug(f"Temp non-Forge Index: {temp_non_forge_index}, Value: {array[temp_non_forge_index + 1][1] if temp_non_forge_index is not None else 'None'}")
-                logger.debug(f"Temp Forge Index: {temp_forge_index}, Value: {array[temp_forge_index + 1][1] if temp_forge_index is not None else 'None'}")
-                temp_non_forge = array[temp_non_forge_index + 1][1] if temp_non_forge_index is not None and array[temp_non_forge_index + 1][1] is not None else "Not available"
-                temp_forge = array[temp_forge_index + 1][1] if temp_forge_index is not None and array[temp_forge_index + 1][1] is not None else "Not available"
-                print(f"Temperature (non-Forge): {temp_non_forge} °F" if temp_non_forge != "Not available" else "Not available")
-                print(f" Temperature (Forge): {temp_forge} °F" if temp_forge != "Not available" else "Not available")
-                summary_data.append(["Summary", "Temperature (non-Forge)", str(temp_non_forge) + " °F" if temp_non_forge != "Not available" else "Not available"])
-                summary_data.append(["Summary", "Temperature (Forge)", str(temp_forge) + " °F" if temp_forge != "Not available" else "Not available"])
-                
-                print(f"\n{YELLOW}=== CHARGING STATS ==={RESET}")
-                redlink_index = next((i for i, x in enumerate(data_id) if x[0] == 0x9020), None)  # ID 33
-                dumb_index = next((i for i, x in enumerate(data_id) if x[0] == 0x901E), None)  # ID 32
-                total_index = next((i for i, x in enumerate(data_id) if x[0] == 0x901A), None)  # ID 31
-                logger.debug(f"Total Charge Index: {total_index}, Value: {array[total_index + 1][1] if total_index is not None else 'None'}")
-                logger.debug(f"Redlink Index: {redlink_index}, Value: {array[redlink_index + 1][1] if redlink_index is not None else 'None'}")
-                logger.debug(f"Dumb Index: {dumb_index}, Value: {array[dumb_index + 1][1] if dumb_index is not None else 'None'}")
-                charge_count = "------"
-                if redlink_index is not None and dumb_index is not None and total_index is not None and all(isinstance(array[x + 1][1], (int, float)) for x in [redlink_index, dumb_index, total_index]):
-                    charge_count = f"{array[total_index + 1][1]} (Redlink: {array[redlink_index + 1][1]}, Dumb: {array[dumb_index + 1][1]})"
-                    print(f"Total Charge Count: {charge_count}")
-                summary_data.append(["Summary", "Total Charge Count", str(charge_count)])
-                time_charge_index = next((i for i, x in enumerate(data_id) if x[0] == 0x9024), None)  # ID 35
-                logger.debug(f"Time Charge Index: {time_charge_index}, Value: {array[time_charge_index + 1][1] if time_charge_index is not None else 'None'}")
-                time_charge = array[time_charge_index + 1][1] if time_charge_index is not None and array[time_charge_index + 1][1] is not None else "------"
-                print(f"Total Charge Time: {time_charge}")
-                summary_data.append(["Summary", "Total Charge Time", str(time_charge)])
-                time_idle_index = next((i for i, x in enumerate(data_id) if x[0] == 0x9028), None)  # ID 36
-                logger.debug(f"Time Idle Index: {time_idle_index}, Value: {array[time_idle_index + 1][1] if time_idle_index is not None else 'None'}")
-                time_idle = array[time_idle_index + 1][1] if time_idle_index is not None and array[time_idle_index + 1][1] is not None else "------"
-                print(f"Time Idling on Charger: {time_idle} {YELLOW + '⚠ ( Remove after full charge)' if isinstance(time_idle, str) and int(time_idle.split(':')[0]) > 100 else ''}{RESET}")
-                if isinstance(time_idle, str) and int(time_idle.split(':')[0]) > 100:
-                    warnings.append("High idle time on charger. Remove after full charge.")
-                summary_data.append(["Summary", "Time Idling on Charger", str(time_idle)])
-                low_v_charge_index = next((i for i, x in enumerate(data_id) if x[0] == 0x902E), None)  # ID 38
-                logger.debug(f"Low Voltage Charge Index: {low_v_charge_index}, Value: {array[low_v_charge_index + 1][1] if low_v_charge_index is not None else 'None'}")
-                low_v_charge = array[low_v_charge_index + 1][1] if low_v_charge_index is not None and array[low_v_charge_index + 1][1] is not None else "------"
-                print(f"Low-Voltage Charges: {low_v_charge} {GREEN + '✓' if low_v_charge == 0 else YELLOW + '⚠'}{RESET}")
-                summary_data.append(["Summary", "Low-Voltage Charges", str(low_v_charge)])
-                
-                print(f"\n{YELLOW}=== TOOL USE STATS ==={RESET}")
-                total_discharge = "------"
-                if discharge_index is not None and isinstance(array[discharge_index + 1][1], (int, float)):
-                    total_discharge = f"{array[discharge_index + 1][1]/3600:.2f} Ah"
-                    print(f"Total Discharge: {total_discharge}")
-                    print(f"Estimated Cycles: {total_discharge_cycles:.2f}")
-                    print(f"SoH: {soh:.1f}% {GREEN if soh >= 50 else YELLOW}✓{RESET if soh >= 50 else '⚠ (Consider replacement)'}")
-                summary_data.append(["Summary", "Total Discharge (Ah)", total_discharge])
-                summary_data.append(["Summary", "Total Discharge Cycles", f"{total_discharge_cycles:.2f}"])
-                summary_data.append(["Summary", "Estimated SoH (%)", f"{soh:.1f}"])
-                low_voltage_value = array[low_voltage_index + 1][1] if low_voltage_index is not None else 0
-                print(f"Discharge to Empty: {low_voltage_value or '------'} {YELLOW + '⚠ (Avoid deep discharges)' if low_voltage_value > 0 else ''}{RESET}")
-                summary_data.append(["Summary", "Discharge to Empty", str(low_voltage_value or "------")])
-                overheat_index = next((i for i, x in enumerate(data_id) if x[0] == 0x9032), None)  # ID 40
-                overheat_value = array[overheat_index + 1][1] if overheat_index is not None else 0
-                print(f"Overheat Events: {overheat_value or '------'} {GREEN + '✓' if overheat_value == 0 else YELLOW + '⚠'}{RESET}")
-                summary_data.append(["Summary", "Overheat Events", str(overheat_value or "------")])
-                low_voltage_event_value = array[low_voltage_event_index + 1][1] if low_voltage_event_index is not None else 0
-                print(f"Low Voltage Events: {low_voltage_event_value or '------'} {YELLOW + '⚠' if low_voltage_event_value > 0 else ''}{RESET}")
-                summary_data.append(["Summary", "Low Voltage Events", str(low_voltage_event_value or "------")])
-                print(f"Total Time on Tool (>10A): {str(datetime.timedelta(seconds=tool_time)) if tool_time else '------'}")
-                if tool_time:
-                    for i, j in enumerate(tool_time_index):
-                        amp_range = f"{i*10 + 10}-{(i+1)*10 + 10}A"
-                        label = f"Time @ {amp_range:>8}:"
-                        t = array[j + 1][1]
-                        hhmmss = str(datetime.timedelta(seconds=t)) if isinstance(t, (int, float)) else "------"
-                        pct = round((t / tool_time) * 100) if tool_time and isinstance(t, (int, float)) else 0
-                        bar = "X" * pct
-                        print(f"{label} {hhmmss} {pct:2d}% {bar}")
-                    # Handle >200A
-                    high_amp_index = next((k for k, x in enumerate(data_id) if x[0] == 0x90B0), None)  # 0x90B0 is @ 200A+
-                    if high_amp_index is not None:
-                        amp_range = ">200A"
-                        label = f"Time @ {amp_range:>8}:"
-                        t = array[high_amp_index + 1][1]
-                        hhmmss = str(datetime.timedelta(seconds=t)) if isinstance(t, (int, float)) else "------"
-                        pct = round((t / tool_time) * 100) if tool_time and isinstance(t, (int, float)) else 0
-                        bar = "X" * pct
-                        print(f"{label} {hhmmss} {pct:2d}% {bar}")
-                
-                if warnings:
-                    print(f"\n{YELLOW}Warnings:{RESET}")
-                    for w in warnings:
-                        print(f" - {w}")
-                    summary_data.append(["Summary", "Warnings", "; ".join(warnings)])
-                
-                try:
-                    with open(csv_path, 'w', newline='', encoding='utf-8') as file:
-                        writer = csv.writer(file)
-                        for row in summary_data:
-                            writer.writerow(row)
-                        writer.writerow([])  # Separator
-                        for row in csv_data:
-                            writer.writerow(row)
-                    print(f"Health data written to {csv_path}")
-                except IOError as e:
-                    print(f"Error writing CSV: {e}")
-                
-                if verbose:
-                    print(f"\n{YELLOW}=== FULL REGISTER DATA ==={RESET}")
-                else:
-                    print(f"[Full 183 Registers Exported to CSV]")
-            
-            if return_data:
-                # Convert datetime objects in registers to strings for JSON-safe export
-                converted_registers = []
-                for reg_id, value in array[1:]:
-                    if isinstance(value, datetime.datetime):
-                        value = value.strftime('%Y-%m-%d %H:%M:%S')
-                    elif isinstance(value, list):
-                        value = [str(v) for v in value]  # Convert lists to strings
-                    converted_registers.append([reg_id, value])
-                return {'summary': {row[1]: row[2] for row in summary_data[1:] if len(row) == 3}, 'registers': converted_registers, 'timestamp': summary_data[0][2]}
+            if array is None:
+                print("Reading battery. This will take 10-20sec\n")
+            report = self.health_report(force_refresh, array)
+            report.print_console(verbose)
+            try:
+                print(f"Health data written to {report.write_csv()}")
+            except IOError as e:
+                print(f"Error writing CSV: {e}")
+            if not verbose:
+                print("[Full 183 Registers Exported to CSV]")
         except Exception as e:
             print(f"health: Failed with error: {e}")
             print("Check battery is connected and you have correct serial port")
-            if return_data:
+
+    def export_to_dashboard(self, dashboard_url=DASHBOARD_URL, uploader=None):
+        """
+        Export raw battery data to the dashboard through a DashboardUploader (spooled, batched, gzip).
+        # uploader - shared DashboardUploader to queue on; if None, a temporary one is flushed before returning
+        Returns True if the reading was delivered (or queued on 'uploader'), False otherwise.
+        """
+        print("Reading battery data for export...")
+        data = self.health(return_data=True, force_refresh=False, verbose=False)
+        if not data:
+            print("Failed to read battery data. Check battery connection, serial port, and increase retries in health() if needed.")
+            return False
+        if uploader is not None:
+            uploader.submit(data)
+            print(f"Queued for upload to {uploader.url} ({uploader.pending()} pending)")
+            return True
+        print(f"Sending data to {dashboard_url}...")
+        uploader = DashboardUploader(dashboard_url)
+        uploader.submit(data)
+        uploader.close(timeout=15)
+        if uploader.pending():
+            print(f"Dashboard not reachable; {uploader.pending()} readings kept in {uploader.spool_dir} and sent on the next export.")
+            return False
+        print("Data exported successfully!")
+        return True
+
+class SweepEngine:
+    """
+    Resumable, checkpointed address-space sweep (the long-running alternative to full_brute).
+    # m18 - connected M18
+    # checkpoint_path - JSON progress file; an existing one is resumed
+    # results_path - append-only CSV of hits: address, longest valid length, data
+    # max_len - longest length probed per address
+    # skip - [(start, stop), ...] address ranges known to be invalid (stop exclusive)
+    Assumes validity is monotonic in length (if n bytes read, every shorter read does too), so the longest
+    valid read of an address is found with an exponential then binary search, not up to 255 probes.
+    The battery is only reset after a failed exchange, not before every address. Addresses whose exchange
+    kept failing are neither hits nor invalid: they are kept in the checkpoint and probed again at the end.
+    """
+    CHECKPOINT_EVERY = 16
+    ERROR = "error"  # probe() result when no valid answer came back twice (timeout, short or corrupt response)
+
+    def __init__(self, m18, checkpoint_path="m18_sweep.json", results_path="m18_sweep_hits.csv", max_len=0xFF, skip=None):
+        self.m18 = m18
+        self.checkpoint_path = checkpoint_path
+        self.results_path = results_path
+        self.max_len = max_len
+        self.invalid = [list(r) for r in (skip or [])]
+        self.retry = set()  # Addresses to probe again, see ERROR
+        self.errors = 0
+        self.hits = 0
+        self.probes = 0
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, encoding='utf-8') as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return None
+        self.invalid = merge_ranges(self.invalid + state.get("invalid", []))
+        self.errors = state.get("errors", 0)
+        self.hits = state.get("hits", 0)
+        self.retry = set(state.get("retry", []))
+        return state
+
+    def save_checkpoint(self, next_addr, stop):
+        state = {"next": next_addr, "stop": stop, "max_len": self.max_len, "hits": self.hits, "errors": self.errors,
+                 "invalid": merge_ranges(self.invalid), "retry": sorted(self.retry), "updated": datetime.datetime.now().isoformat(timespec='seconds')}
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(state, file)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def is_skipped(self, addr):
+        return any(start <= addr < stop for start, stop in self.invalid)
+
+    def probe(self, addr, length):
+        """
+        Read 'length' bytes at 'addr'; returns the data, None if the battery refused it (0x82) or ERROR.
+        Resets and retries once after an error.
+        """
+        for attempt in range(2):
+            self.probes += 1
+            try:
+                response = self.m18.cmd((addr >> 8) & 0xFF, addr & 0xFF, length, length + 5)
+            except ValueError:
+                response = None
+            if response and response[0] == 0x81 and len(response) >= length + 3:
+                return response[3:3 + length]
+            if response and response[0] == 0x82:
                 return None
+            self.errors += 1
+            self.m18.reset()
+        return self.ERROR
+
+    def longest_read(self, addr):
+        """
+        Returns (length, data) of the longest valid read at 'addr', (0, None) if it is invalid or (None, None)
+        if a probe failed, since the length found so far may be short.
+        """
+        data = self.probe(addr, 1)
+        if data is self.ERROR:
+            return None, None
+        if data is None:
+            return 0, None
+        lo, hi = 1, 2
+        while hi <= self.max_len:
+            block = self.probe(addr, hi)
+            if block is self.ERROR:
+                return None, None
+            if block is None:
+                break
+            lo, data = hi, block
+            hi *= 2
+        hi = min(hi, self.max_len + 1)  # First length known (or assumed) invalid
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            block = self.probe(addr, mid)
+            if block is self.ERROR:
+                return None, None
+            if block is None:
+                hi = mid
+            else:
+                lo, data = mid, block
+        return lo, data
+
+    def record(self, writer, addr, length, data):
+        self.hits += 1
+        writer.writerow([f"0x{addr:04X}", length, " ".join(f"{byte:02X}" for byte in data)])
+        print(f"Valid response from: 0x{addr:04X} with length: 0x{length:02X}")
+
+    def retry_errors(self, writer):
+        """Probe the addresses whose exchange failed again; those failing once more stay queued."""
+        for addr in sorted(self.retry):
+            self.retry.discard(addr)
+            length, data = self.longest_read(addr)
+            if length is None:
+                self.retry.add(addr)
+            elif length:
+                self.record(writer, addr, length, data)
+            else:
+                self.invalid.append([addr, addr + 1])
+
+    def run(self, start=0, stop=0x10000):
+        """Sweep [start, stop), resuming from the checkpoint; returns {'next', 'stop', 'hits', 'probes', 'errors', 'seconds'}"""
+        import csv
+        state = self.load_checkpoint()
+        if state and state.get("stop") == stop:
+            start = state["next"]
+            print(f"Resuming sweep at 0x{start:04X} ({self.hits} hits so far)")
+        else:
+            self.hits = self.errors = 0  # New sweep, only the known-invalid ranges carry over
+            self.retry = set()
+        begin_time = time.time()
+        addr = start
+        run_start = None  # Start of the current run of invalid addresses
+        self.m18.reset()
+        try:
+            with open(self.results_path, 'a', newline='', encoding='utf-8') as results:
+                writer = csv.writer(results)
+                for addr in range(start, stop):
+                    if self.is_skipped(addr):
+                        continue
+                    length, data = self.longest_read(addr)
+                    if length == 0:
+                        if run_start is None:
+                            run_start = addr
+                    else:
+                        if run_start is not None:
+                            self.invalid.append([run_start, addr])
+                            run_start = None
+                        if length is None:
+                            self.retry.add(addr)
+                        else:
+                            self.record(writer, addr, length, data)
+                            results.flush()
+                    if (addr + 1) % self.CHECKPOINT_EVERY == 0:
+                        if run_start is not None:
+                            self.invalid.append([run_start, addr + 1])
+                            run_start = None
+                        self.save_checkpoint(addr + 1, stop)
+                    if (addr % 256) == 0:
+                        print(f"addr = 0x{addr:04X} ", datetime.datetime.now())
+                addr = stop
+                if run_start is not None:
+                    self.invalid.append([run_start, addr])
+                    run_start = None
+                if self.retry:
+                    print(f"Retrying {len(self.retry)} addresses that failed")
+                    self.retry_errors(writer)
+        except KeyboardInterrupt:
+            print("\nSweep interrupted, progress saved. Run again to resume.")
         finally:
-            self.txrx_restore()
-        if return_data:
-            return None
+            if run_start is not None:
+                self.invalid.append([run_start, addr])
+            self.save_checkpoint(addr, stop)
+            self.m18.idle()
+            print(f"Stopped at address: 0x{addr:04X}, {self.hits} hits, {self.probes} probes, "
+                  f"{self.errors} errors, {len(self.retry)} addresses to retry in {time.time() - begin_time:.1f}s")
+            self.m18.latency.report()
+        return {"next": addr, "stop": stop, "hits": self.hits, "probes": self.probes, "errors": self.errors,
+                "retry": [f"0x{a:04X}" for a in sorted(self.retry)], "seconds": round(time.time() - begin_time, 1)}
 
-    def export_to_dashboard(self, dashboard_url='http://172.25.47.113:5002/data'):
+def merge_ranges(ranges):
+    """Merge overlapping/adjacent [start, stop) ranges"""
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return merged
+
+TelemetrySample = collections.namedtuple("TelemetrySample", ["time", "cells", "temp", "temp_forge"])
+
+class TelemetryStream:
+    """
+    Live telemetry: a poller thread reads only the cell voltages (0x400A) and temperatures (0x4014, 0x401F)
+    at 'rate' Hz, pushes samples through a bounded queue and the consumer side keeps them in a ring buffer.
+    Samples that arrive while the queue is full are dropped and counted instead of stalling the poller.
+    # m18 - connected M18, owned by the poller thread while streaming
+    # rate - samples per second
+    # buffer_size - samples kept in the ring buffer
+    """
+    IDS = [REG_INDEX[addr] for addr in (0x400A, 0x4014, 0x401F)]
+
+    def __init__(self, m18, rate=2.0, buffer_size=600):
+        self.m18 = m18
+        self.rate = rate
+        self.queue = queue.Queue(maxsize=64)
+        self.buffer = collections.deque(maxlen=buffer_size)
+        self.samples = 0
+        self.dropped = 0
+        self.errors = 0
+        self.started = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def poll(self):
+        """Generator of TelemetrySample at 'rate' Hz until stopped"""
+        cells_id, temp_id, forge_id = self.IDS
+        next_tick = time.monotonic()
+        while not self.stop_event.is_set():
+            try:
+                raw = self.m18.read_registers(self.IDS, retries=1)
+            except Exception:
+                raw = {}
+            if raw.get(cells_id) is not None:
+                yield TelemetrySample(
+                    time.time(),
+                    self.m18.decode_value("cell_v", raw[cells_id])[0],
+                    self.m18.decode_value("adc_t", raw[temp_id])[0] if raw.get(temp_id) else None,
+                    float(self.m18.decode_value("dec_t", raw[forge_id])[0]) if raw.get(forge_id) else None)
+            else:
+                self.errors += 1
+            next_tick += 1 / self.rate
+            self.stop_event.wait(max(0, next_tick - time.monotonic()))
+
+    def _produce(self):
+        for sample in self.poll():
+            self.samples += 1
+            try:
+                self.queue.put_nowait(sample)
+            except queue.Full:
+                self.dropped += 1
+
+    def start(self):
+        self.m18.reset()
+        self.started = time.monotonic()
+        self.thread = threading.Thread(target=self._produce, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        self.m18.idle()
+
+    def drain(self):
+        """Move queued samples into the ring buffer; returns the new samples"""
+        new = []
+        while True:
+            try:
+                new.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        self.buffer.extend(new)
+        return new
+
+    def measured_rate(self):
+        return self.samples / (time.monotonic() - self.started) if self.started else 0.0
+
+    def status(self):
+        return f"{self.measured_rate():.1f} Hz, {self.samples} samples, {self.dropped} dropped, {self.errors} errors"
+
+    def terminal_chart(self, duration=None):
+        """Print one line per sample: cell voltages with bars (3.0-4.2 V), imbalance and temperatures"""
+        self.start()
+        try:
+            while duration is None or time.monotonic() - self.started < duration:
+                time.sleep(1 / self.rate)
+                for s in self.drain():
+                    bars = " ".join(f"{mv:4d}{'#' * max(0, min(8, (mv - 3000) * 8 // 1200)):<8}" for mv in s.cells)
+                    imbalance = max(s.cells) - min(s.cells)
+                    temp = f"{s.temp:.1f}°F" if s.temp is not None else "------"
+                    print(f"{datetime.datetime.fromtimestamp(s.time).strftime('%H:%M:%S')} {bars} "
+                          f"{GREEN if imbalance <= 100 else YELLOW}Δ{imbalance:3d} mV{RESET} {temp} [{self.status()}]")
+        except KeyboardInterrupt:
+            print("\nStream stopped by user.")
+        finally:
+            self.stop()
+
+    def ndjson(self, file=None, duration=None):
+        """Write one JSON line per sample to 'file' (default stdout) until 'duration' seconds or Ctrl-C"""
+        file = file or sys.stdout
+        self.start()
+        try:
+            while duration is None or time.monotonic() - self.started < duration:
+                time.sleep(1 / self.rate)
+                for s in self.drain():
+                    file.write(json.dumps(s._asdict()) + "\n")
+                file.flush()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def live_plot(self):
+        """Live-updating matplotlib chart of the ring buffer"""
+        try:
+            import matplotlib.pyplot as plt
+            from matplotlib.animation import FuncAnimation
+        except ImportError:
+            print("Install matplotlib: pip install matplotlib")
+            return
+        fig, ax = plt.subplots()
+        lines = [ax.plot([], [], label=f"Cell {n}")[0] for n in range(1, 6)]
+        ax.set_xlabel("Seconds")
+        ax.set_ylabel("Voltage (mV)")
+        ax.legend(loc="upper left")
+
+        def update(_):
+            self.drain()
+            if self.buffer:
+                t0 = self.buffer[0].time
+                x = [s.time - t0 for s in self.buffer]
+                for n, line in enumerate(lines):
+                    line.set_data(x, [s.cells[n] for s in self.buffer])
+                ax.relim()
+                ax.autoscale_view()
+                ax.set_title(f"Battery Cell Voltages ({self.status()})")
+            return lines
+
+        self.start()
+        try:
+            animation = FuncAnimation(fig, update, interval=1000 / self.rate, cache_frame_data=False)
+            plt.show()
+        finally:
+            self.stop()
+        return animation
+
+class EmulatorStream:
+    """asyncio reader/writer pair over a BatteryEmulator, for AsyncM18 runs without a serial port"""
+    def __init__(self, emulator):
+        self.emulator = emulator
+
+    def write(self, data):
+        self.emulator.write(data)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.emulator.close()
+
+    async def readexactly(self, size):
+        import asyncio
+        wait = self.emulator._ready_at - time.monotonic()
+        if wait > 0 and self.emulator.in_waiting:
+            await asyncio.sleep(wait)
+        data = self.emulator.read(min(size, self.emulator.in_waiting))
+        if len(data) < size:
+            if self.emulator.realtime:
+                await asyncio.sleep(self.emulator.timeout or 0)
+            raise asyncio.IncompleteReadError(data, size)
+        return data
+
+    async def read(self, size=-1):
+        """Whatever is waiting (b"" if nothing), like StreamReader.read() on a drained port"""
+        waiting = self.emulator.in_waiting
+        return self.emulator.read(waiting if size < 0 else min(size, waiting))
+
+class AsyncM18(M18):
+    """
+    asyncio M18 driver with the same command set (cmd, configure, keepalive, read_id, health).
+    All traffic goes through one bus task fed by a queue. The next request is taken off the queue as
+    soon as the current response's header byte arrives and is written the moment that response is
+    complete, so concurrent callers (e.g. simulate() keepalives next to read_id()) never wait on sleeps.
+    Framing and decoding helpers are inherited from M18; the blocking I/O methods are replaced.
+    Open with: m = await AsyncM18.open(port)
+    """
+    def __init__(self, reader, writer, lines, timeout=0.8):
+        import asyncio
+        self.reader = reader
+        self.writer = writer
+        self.lines = lines  # Object with break_condition/dtr (the serial port or emulator)
+        self.adapter = getattr(lines, "port", None) or type(lines).__name__
+        self.timeout = timeout
+        self.session = False
+        self.latency = LatencyTracker()
+        self.queue = asyncio.Queue()
+        self.bus_task = asyncio.get_running_loop().create_task(self._bus())
+
+    @classmethod
+    async def open(cls, port, timeout=0.8):
+        """Open 'port' ("emu"/"emu:<seed>" for the emulator; serial ports need pyserial-asyncio)"""
+        if port == "emu" or port.startswith("emu:"):
+            stream = EmulatorStream(open_transport(port, timeout))
+            return cls(stream, stream, stream.emulator, timeout)
+        try:
+            import serial_asyncio
+        except ImportError:
+            raise ImportError("Install pyserial-asyncio: pip install pyserial-asyncio")
+        reader, writer = await serial_asyncio.open_serial_connection(url=port, baudrate=4800, stopbits=2)
+        return cls(reader, writer, writer.transport.serial, timeout)
+
+    async def close(self):
+        self.bus_task.cancel()
+        self.writer.close()
+
+    async def _read(self, size, timeout=None):
+        import asyncio
+        try:
+            return await asyncio.wait_for(self.reader.readexactly(size), timeout or self.timeout)
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+        except asyncio.TimeoutError:
+            return b""
+
+    async def _flush_input(self, quiet=0.0):
+        """
+        Discard bytes left in the reader, e.g. by a late or cut-short response (reset_input_buffer() for asyncio).
+        Reads until nothing arrives within 'quiet' seconds; with 0 only what is already buffered is dropped.
+        """
+        import asyncio
+        while True:
+            read = asyncio.ensure_future(self.reader.read(256))
+            await asyncio.wait([read], timeout=quiet)
+            if not read.done():
+                read.cancel()
+                try:
+                    await read
+                except asyncio.CancelledError:
+                    pass
+                return
+            if not read.result():
+                return
+
+    async def _transfer(self, frame, size, stage=False):
         """
-        Export raw battery data to the dashboard running in a Docker container.
-        Performs a connectivity test before sending data.
+        Write 'frame' and read its response. With 'stage' (only from _bus), the next queued request is taken as
+        soon as the header arrives and returned with the response so _bus can send it next.
         """
+        key = None
+        if self.metrics is not None:
+            key = self.metrics.key(self.adapter, frame.translate(REVERSE_TABLE))
+            self.metrics.sent(key, len(frame))
+        await self._flush_input()
+        self.writer.write(frame)
+        await self.writer.drain()
+        if self.PRINT_TX:
+            print(f"Sending: {' '.join(f'{byte:02X}' for byte in frame.translate(REVERSE_TABLE))}")
+        sent_at = time.monotonic()
+        header = await self._read(1, self.latency.header_timeout())
+        if not header:
+            self.latency.record_timeout(time.monotonic() - sent_at)
+            if key is not None:
+                self.metrics.timeout(key)
+            await self._flush_input(self.latency.MIN_TIMEOUT)
+            raise ValueError("Empty response")
+        self.latency.record_response(time.monotonic() - sent_at)
+        # Header is in: stage the next request while the body is still arriving
+        staged = None if not stage or self.queue.empty() else self.queue.get_nowait()
+        error = REVERSE_TABLE[header[0]] == 0x82
+        expected = 1 if error else size - 1
+        body = b""
+        if expected > 0:
+            started = time.monotonic()
+            body = await self._read(expected, self.latency.body_timeout(expected))
+            self.latency.record_body(time.monotonic() - started, len(body) < expected)
+            if len(body) < expected:
+                await self._flush_input(self.latency.MIN_TIMEOUT)
+        if key is not None:
+            self.metrics.response(key, time.monotonic() - sent_at, len(header + body), error, len(body) < expected)
+        response = bytearray((header + body).translate(REVERSE_TABLE))
+        if self.PRINT_RX:
+            print(f"Received: {' '.join(f'{byte:02X}' for byte in response)}")
+        return response, staged
+
+    async def _bus(self):
+        request = await self.queue.get()
+        while True:
+            frame, size, action, future = request
+            staged = None
+            try:
+                if action:
+                    result = await action()
+                else:
+                    result, staged = await self._transfer(frame, size, stage=True)
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            request = staged or await self.queue.get()
+
+    async def _submit(self, frame=None, size=0, action=None):
+        import asyncio
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((frame, size, action, future))
+        return await future
+
+    async def send_command(self, command, size):
+        return await self._submit(bytes(self.add_checksum(command)).translate(REVERSE_TABLE), size)
+
+    async def _reset(self):
+        import asyncio
+        self.ACC = 4
+        for state in (True, False):
+            try:
+                self.lines.break_condition = state
+                self.lines.dtr = state
+            except OSError:
+                pass
+            await asyncio.sleep(0.3)
+        await self._flush_input(self.latency.MIN_TIMEOUT)
+        response, _ = await self._transfer(bytes([self.SYNC_BYTE]).translate(REVERSE_TABLE), 1)
+        return bool(response) and response[0] == self.SYNC_BYTE
+
+    async def reset(self):
         try:
-            from urllib.parse import urlparse
-            parsed_url = urlparse(dashboard_url)
-            host = parsed_url.hostname
-            port = parsed_url.port or 5002
+            return await self._submit(action=self._reset)
+        except ValueError:
+            return False
+
+    async def cmd(self, a, b, c, length, command=0x01):
+        frame = struct.pack('>BBBBBB', command, 0x04, 0x03, a, b, c)
+        response = await self.send_command(frame, length)
+        if len(response) == length and response[0] == 0x81 and not self.verify_checksum(response):
+            if self.metrics is not None:
+                self.metrics.checksum_failure(self.metrics.key(self.adapter, frame))
+            raise ValueError("Response checksum mismatch")
+        return response
+
+    async def idle(self):
+        try:
+            await self.cmd(0xB0, 0x00, 0x00, 0x00)
+        except Exception as e:
+            print(f"idle: Failed with error: {e}")
+
+    async def configure(self, state):
+        self.ACC = 4
+        return await self.send_command(struct.pack('>BBBHHHBB', self.CONF_CMD, self.ACC, 8,
+                                                   self.CUTOFF_CURRENT, self.MAX_CURRENT, self.MAX_CURRENT, state, 13), 5)
+
+    async def get_snapchat(self):
+        command = struct.pack('>BBB', self.SNAP_CMD, self.ACC, 0)
+        self.update_acc()
+        return await self.send_command(command, 8)
+
+    async def keepalive(self):
+        return await self.send_command(struct.pack('>BBB', self.KEEPALIVE_CMD, self.ACC, 0), 9)
 
-            print(f"Testing connection to {host}:{port}...")
+    async def calibrate(self):
+        command = struct.pack('>BBB', self.CAL_CMD, self.ACC, 0)
+        self.update_acc()
+        return await self.send_command(command, 8)
+
+    async def simulate(self, interval=0.5, duration=None):
+        """Charger handshake, then keepalives every 'interval' seconds until cancelled or 'duration' elapses"""
+        import asyncio
+        begin_time = time.monotonic()
+        await self.reset()
+        await self.configure(2)
+        await self.get_snapchat()
+        await asyncio.sleep(0.6)
+        await self.keepalive()
+        await self.configure(1)
+        await self.get_snapchat()
+        self.session = True
+        try:
+            while duration is None or (time.monotonic() - begin_time) < duration:
+                await asyncio.sleep(interval)
+                await self.keepalive()
+        finally:
+            self.session = False
+            await self.idle()
+
+    async def read_block(self, addr, length, retries=3):
+        import asyncio
+        response = None
+        for attempt in range(retries):
             try:
-                socket.gethostbyname(host)
-                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                s.settimeout(5)
-                s.connect((host, port))
-                s.close()
-                print(f"Connection to {host}:{port} successful!")
+                response = await self.cmd((addr >> 8) & 0xFF, addr & 0xFF, length, (length + 5))
+                break
             except Exception as e:
-                print(f"Connection test failed: {e}")
-                print("Check network/firewall between host and Docker.")
-                return
+                print(f"Retry {attempt+1}/{retries} for 0x{addr:04X} failed: {e}")
+                if self.metrics is not None:
+                    self.metrics.retry(self.metrics.read_key(self.adapter, addr))
+                await asyncio.sleep(self.latency.backoff_delay(attempt))
+        if response and len(response) >= 4 and response[0] == 0x81 and len(response[3:]) >= length:
+            return response[3:(3+length)]
+        return None
 
-            print("Reading battery data for export...")
-            data = self.health(return_data=True, force_refresh=True, verbose=False)
-            if not data:
-                print("Failed to read battery data. Check battery connection, serial port, and increase retries in health() if needed.")
-                return
-            print(f"Data read successfully: {data}")  # Debug print
+    async def read_registers(self, id_list, retries=3):
+        """Async read_registers(): every block is queued at once so the bus task pipelines them"""
+        import asyncio
+        blocks = plan_reads(id_list)
+        results = await asyncio.gather(*(self.read_block(addr, length, retries) for addr, length, _ in blocks))
+        values = {}
+        for (addr, length, members), data in zip(blocks, results):
+            if data is None and len(members) > 1:
+                parts = await asyncio.gather(*(self.read_block(addr + offset, reg_len, retries) for _, offset, reg_len in members))
+                values.update((i, part) for (i, _, _), part in zip(members, parts))
+                continue
+            for i, offset, reg_len in members:
+                values[i] = data[offset:(offset+reg_len)] if data is not None else None
+        return values
 
-            print(f"Sending data to {dashboard_url}...")
-            for attempt in range(3):
-                try:
-                    response = requests.post(dashboard_url, json=data, timeout=10)
-                    print(f"Response status: {response.status_code}, Content: {response.text}")
-                    if response.status_code == 200:
-                        print("Data exported successfully!")
-                        return
-                    else:
-                        print(f"Failed. Status code: {response.status_code}")
-                except requests.RequestException as e:
-                    print(f"Attempt {attempt+1}/3 failed: {e}")
-                    time.sleep(2)
-            print("All attempts failed. Test the endpoint with curl.")
+    async def read_id(self, id_array=[], force_refresh=True, output="array", retries=3):
+        """
+        Async read_id() for output "array" (returned) or "label" (printed).
+        The battery is only reset when no simulate() session is running alongside. There is no register cache
+        here, so every call reads the planned blocks fresh whatever force_refresh says.
+        """
+        if not self.session:
+            await self.reset()
+        id_list = id_array or range(0, len(data_id))
+        raw = await self.read_registers(id_list, retries)
+        formatted_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        array = [formatted_time]
+        if output == "label":
+            print(formatted_time)
+            print("ID ADDR LEN TYPE LABEL VALUE")
+        for i in id_list:
+            addr, length, type, label = data_id[i]
+            data = raw.get(i)
+            array_value, value = self.decode_value(type, data, output) if data is not None else (None, "------")
+            if output == "label":
+                print(f"{i:3d} 0x{addr:04X} {length:2d} {type:>6} {label:<39} {value:<}")
+            array.append([i, array_value])
+        if not self.session:
+            await self.idle()
+        return array if output == "array" else None
+
+    async def health(self, force_refresh=True, verbose=False, return_data=False):
+        array = await self.read_id(force_refresh=force_refresh, output="array", retries=5)
+        return M18.health(self, force_refresh, verbose, return_data, array=array)
+
+def find_battery_ports(match="USB"):
+    """Serial ports whose device, manufacturer or description contains 'match'"""
+    from serial.tools import list_ports
+    return [p.device for p in list_ports.comports()
+            if match.lower() in f"{p.device} {p.manufacturer} {p.description}".lower()]
+
+def scan_fleet(ports=None, match="USB", csv_path=None, store=None, dumps=None, uploader=None):
+    """
+    Run health(return_data=True) on every pack at once, one worker thread per port, and write a combined CSV.
+    # ports - ports to scan; default is find_battery_ports(match)
+    # csv_path - report path; default Milwaukee_Fleet_<date>.csv
+    # store / dumps - SnapshotStore / RawDumpWriter shared by all workers, or None
+    # uploader - DashboardUploader each reading is queued on as soon as it is read, or None
+    Returns {port: health dict or None}
+    """
+    import csv
+    from concurrent.futures import ThreadPoolExecutor
+    ports = ports or find_battery_ports(match)
+    if not ports:
+        print(f"No serial ports matching '{match}' found")
+        return {}
+
+    def scan(port):
+        try:
+            m = M18(port, store=store, dumps=dumps)
+            try:
+                data = m.health(return_data=True)
+                if data and uploader is not None:
+                    uploader.submit(data)
+                return data
+            finally:
+                m.port.close()
         except Exception as e:
-            print(f"Export failed: {e}")
+            print(f"{port}: Failed with error: {e}")
+            return None
+
+    begin_time = time.time()
+    print(f"Scanning {len(ports)} packs: {', '.join(ports)}")
+    with ThreadPoolExecutor(max_workers=len(ports)) as pool:
+        results = dict(zip(ports, pool.map(scan, ports)))
+
+    columns = []
+    for data in results.values():
+        for key in (data or {}).get('summary', {}):
+            if key not in columns:
+                columns.append(key)
+    rows = []
+    for port, data in results.items():
+        if not data:
+            rows.append([port, "------", "------"] + ["------"] * len(columns))
+            continue
+        sn = next((value for reg_id, value in data['registers'] if reg_id == 2 and isinstance(value, str)), "")
+        serial_number = sn.split("Serial: ")[1] if "Serial: " in sn else "------"
+        rows.append([port, serial_number, data['timestamp']] + [data['summary'].get(key, "------") for key in columns])
+
+    csv_path = csv_path or f"Milwaukee_Fleet_{datetime.datetime.now().strftime('%Y-%m-%d_%I-%M%p').lower()}.csv"
+    try:
+        with open(csv_path, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(["Port", "E-Serial", "Timestamp"] + columns)
+            writer.writerows(rows)
+        print(f"Fleet report written to {csv_path}")
+    except IOError as e:
+        print(f"Error writing CSV: {e}")
+
+    print(f"\n{YELLOW}=== FLEET ==={RESET}")
+    for row in rows:
+        summary = dict(zip(columns, row[3:]))
+        print(f"{row[0]:<24} E-Serial: {row[1]:<10} Pack: {summary.get('Pack Voltage', '------'):<9} SoH: {summary.get('Estimated SoH (%)', '------')}")
+    ok = sum(1 for data in results.values() if data)
+    print(f"{ok}/{len(ports)} packs read in {time.time() - begin_time:.1f}s")
+    return results
+
+def choose_port():
+    """Interactive serial port menu; returns the chosen device"""
+    from serial.tools import list_ports
+    print("*** NO PORT SPECIFIED ***")
+    print("Available serial ports (choose one that says USB somewhere):")
+    ports = list_ports.comports()
+    i = 1
+    for p in ports:
+        print(f" {i}: {p.device} - {p.manufacturer} - {p.description}")
+        i += 1
+    port_id = 0
+    while (port_id < 1) or (port_id >= i):
+        user_port = input(f"Choose a port (1-{i-1}): ")
+        try:
+            port_id = int(user_port)
+        except ValueError:
+            print("Invalid input. Please enter a number")
+    p = ports[port_id - 1]
+    print(f"You selected \"{p.device} - {p.manufacturer} - {p.description}\"")
+    print(f"In future, use \"m18_battery_diagnostics.py --port {p.device}\" to avoid this menu")
+    return p.device
+
+def run_command(args, store=None, dumps=None):
+    """
+    Non-interactive subcommands (health, dump, stream, sweep, export, fleet) for cron/systemd use.
+    Results go to stdout as JSON (NDJSON for dump/stream), progress and errors to stderr.
+    Returns the process exit code: 0 success, 1 the battery could not be read or the result was not delivered.
+    """
+    out = sys.stdout
+
+    def emit(result):
+        out.write(json.dumps(result, default=str) + "\n")
+        out.flush()
+
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.command == "fleet":
+            uploader = DashboardUploader(args.upload, args.spool_dir) if args.upload else None
+            results = scan_fleet(args.ports, args.match, args.csv, store=store, dumps=dumps, uploader=uploader)
+            if uploader is not None:
+                uploader.close()
+                uploader.report()
+            if args.format == "json":
+                emit(results)
+            return 0 if results and all(results.values()) else 1
+        try:
+            m = M18(args.port, store=store, dumps=dumps)
+        except (ValueError, OSError) as e:  # serial.SerialException is an OSError
+            print(f"{args.command}: {e}")
+            return 1
+        try:
+            match args.command:
+                case "health":
+                    if args.format == "text":
+                        with contextlib.redirect_stdout(out):
+                            m.health(force_refresh=True, verbose=args.verbose)
+                        return 0
+                    try:
+                        emit(m.health_report().to_dict())
+                    except Exception as e:
+                        print(f"health: Failed with error: {e}")
+                        return 1
+                case "dump":
+                    ids = [int(x, 0) for x in args.ids.split(",")] if args.ids else []
+                    if args.out == "-":
+                        sink = RegisterSink(args.format, stream=out)
+                    else:
+                        sink = RegisterSink(args.format, path=args.out or None, directory=args.dir)
+                    try:
+                        m.read_id(ids, output=args.format, sink=sink)
+                    finally:
+                        sink.close()
+                    return 0 if sink.rows else 1
+                case "stream":
+                    telemetry = TelemetryStream(m, args.rate)
+                    if args.format == "text":
+                        with contextlib.redirect_stdout(out):
+                            telemetry.terminal_chart(args.duration)
+                    else:
+                        telemetry.ndjson(out, args.duration)
+                    print(telemetry.status())
+                    return 0 if telemetry.samples else 1
+                case "sweep":
+                    sweep_start, sweep_stop = (int(x, 0) for x in args.range.split("-"))
+                    emit(m.sweep(sweep_start, sweep_stop + 1, checkpoint_path=args.checkpoint, results_path=args.results))
+                case "export":
+                    sent = m.export_to_dashboard(args.url)
+                    emit({"url": args.url, "exported": sent})
+                    return 0 if sent else 1
+        finally:
+            m.port.close()
+    return 0
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="M18 Battery Diagnostics")
-    parser.add_argument("--port", type=str, help="Serial port (e.g., COM7)")
+    import argparse
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="M18 Battery Diagnostics", epilog="Without a command (or one of the legacy options below) the interactive menu runs.")
+    parser.add_argument("--port", type=str, help="Serial port (e.g., COM7), pty path, pyserial URL (socket://host:port) or 'emu' for the built-in emulator")
+    parser.add_argument("--serve-emulator", metavar="pty|tcp:PORT", help="Serve the battery emulator on a pty or TCP port and wait")
+    parser.add_argument("--bench-framing", action="store_true", help="Run the framing micro-benchmark and exit")
+    parser.add_argument("--bench-decode", action="store_true", help="Run the register decoding benchmark and exit")
+    parser.add_argument("--bench-startup", type=int, nargs="?", const=5, metavar="RUNS", help="Measure startup/import time (default 5 runs), append it to m18_startup.jsonl and exit")
+    parser.add_argument("--fleet", nargs="*", metavar="PORT", help="Read every pack in parallel (all ports matching --fleet-match if none given) and exit")
+    parser.add_argument("--fleet-match", default="USB", help="Port filter for --fleet (default: USB)")
+    parser.add_argument("--sweep", metavar="START-STOP", help="Resumable address sweep, e.g. 0x0000-0xFFFF (see --checkpoint) and exit")
+    parser.add_argument("--checkpoint", default="m18_sweep.json", help="Sweep checkpoint file (default: m18_sweep.json)")
+    parser.add_argument("--store", default="m18_snapshots.m18s", help="Snapshot store fed by every read (default: m18_snapshots.m18s, '' to disable)")
+    parser.add_argument("--stream", type=float, metavar="HZ", help="Stream cell voltages and temperatures at HZ samples/s and exit on Ctrl-C")
+    parser.add_argument("--plot", action="store_true", help="With --stream, show a live plot instead of the terminal chart")
+    parser.add_argument("--dump-dir", default="m18_dumps", help="Raw dump directory fed by every read (default: m18_dumps, '' to disable)")
+    parser.add_argument("--redecode", nargs="+", metavar="DUMP", help="Re-decode raw dump files/directories into one summary CSV and exit")
+    parser.add_argument("--out", default="m18_redecoded.csv", help="Output CSV for --redecode (default: m18_redecoded.csv)")
+    parser.add_argument("--workers", type=int, help="Process pool size for --redecode (default: CPU count)")
+    parser.add_argument("--upload", metavar="URL", nargs="?", const=DASHBOARD_URL, help=f"With --fleet, upload every reading to the dashboard in the background (default URL: {DASHBOARD_URL})")
+    parser.add_argument("--spool-dir", default="m18_spool", help="Spool for readings not yet uploaded (default: m18_spool)")
+    parser.add_argument("--serve-ingest", metavar="[HOST:]PORT", help="Run a local dashboard ingest server storing uploads in --store (and --dump-dir) and wait")
+    parser.add_argument("--ingest-load", metavar="URL", help="Load-test an ingest endpoint with synthetic payloads and exit (see --count, --batch, --concurrency)")
+    parser.add_argument("--count", type=int, default=2000, help="Payloads to send with --ingest-load (default: 2000)")
+    parser.add_argument("--batch", type=int, default=1, help="Payloads per request with --ingest-load (default: 1)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Client threads with --ingest-load (default: 4)")
+    parser.add_argument("--analytics", action="store_true", help="Print fleet analytics from the snapshot store and exit")
+    parser.add_argument("--metrics", metavar="PATH", help="Record per-command bus metrics and write them to PATH on exit (.prom: Prometheus text, else JSON)")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--port", default=argparse.SUPPRESS, help="Serial port, pyserial URL or 'emu' (default: the only USB serial port)")
+    common.add_argument("--store", default=argparse.SUPPRESS, help="Snapshot store fed by every read ('' to disable)")
+    common.add_argument("--dump-dir", default=argparse.SUPPRESS, help="Raw dump directory fed by every read ('' to disable)")
+    common.add_argument("--metrics", default=argparse.SUPPRESS, metavar="PATH", help="Write per-command bus metrics to PATH on exit (.prom: Prometheus text, else JSON)")
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND", title="commands (non-interactive, results on stdout, progress on stderr)")
+    command = commands.add_parser("health", parents=[common], help="Read all registers and print the health report")
+    command.add_argument("--format", choices=["json", "text"], default="json", help="json: one document (default); text: console report and CSV")
+    command.add_argument("--verbose", action="store_true", help="With --format text, list all registers")
+    command = commands.add_parser("dump", parents=[common], help="Read registers and stream one row per register")
+    command.add_argument("--format", choices=["ndjson", "csv"], default="ndjson", help="Row format (default: ndjson)")
+    command.add_argument("--out", default="-", help="File to append to, '-' for stdout (default), '' to rotate per pack and day in --dir")
+    command.add_argument("--dir", default=".", help="Directory for rotated files (default: .)")
+    command.add_argument("--ids", help="Comma-separated data_id indexes (default: all)")
+    command = commands.add_parser("stream", parents=[common], help="Stream cell voltages and temperatures")
+    command.add_argument("--rate", type=float, default=2.0, help="Samples per second (default: 2)")
+    command.add_argument("--duration", type=float, help="Seconds to stream (default: until interrupted)")
+    command.add_argument("--format", choices=["ndjson", "text"], default="ndjson", help="ndjson: one line per sample (default); text: terminal chart")
+    command = commands.add_parser("sweep", parents=[common], help="Resumable address sweep; prints the run summary")
+    command.add_argument("range", metavar="START-STOP", help="Address range, e.g. 0x0000-0xFFFF")
+    command.add_argument("--checkpoint", default="m18_sweep.json", help="Checkpoint file (default: m18_sweep.json)")
+    command.add_argument("--results", default="m18_sweep_hits.csv", help="Hits CSV (default: m18_sweep_hits.csv)")
+    command = commands.add_parser("export", parents=[common], help="Read the pack and upload it to the dashboard")
+    command.add_argument("--url", default=DASHBOARD_URL, help=f"Dashboard URL (default: {DASHBOARD_URL})")
+    command = commands.add_parser("fleet", parents=[common], help="Read every pack in parallel; prints {port: health} as JSON")
+    command.add_argument("ports", nargs="*", metavar="PORT", help="Ports to read (default: all matching --match)")
+    command.add_argument("--match", default="USB", help="Port filter (default: USB)")
+    command.add_argument("--csv", help="Fleet CSV path (default: Milwaukee_Fleet_<date>.csv)")
+    command.add_argument("--upload", metavar="URL", nargs="?", const=DASHBOARD_URL, default=argparse.SUPPRESS, help="Also upload every reading to the dashboard")
+    command.add_argument("--spool-dir", default=argparse.SUPPRESS, help="Upload spool (default: m18_spool)")
+    command.add_argument("--format", choices=["json", "text"], default="json", help="json: results on stdout (default); text: fleet table only")
     args = parser.parse_args()
-    m = M18(args.port)
+    if args.metrics:
+        import atexit
+        M18.metrics = BusMetrics()
+        atexit.register(M18.metrics.save, args.metrics)
+    if args.analytics:
+        FleetAnalytics(SnapshotStore(args.store)).report()
+        sys.exit(0)
+    if args.redecode:
+        redecode_dumps(args.redecode, args.out, args.workers)
+        sys.exit(0)
+    if args.ingest_load:
+        ingest_load_test(args.ingest_load, args.count, args.batch, args.concurrency)
+        sys.exit(0)
+    store = SnapshotStore(args.store) if args.store else None
+    dumps = RawDumpWriter(args.dump_dir) if args.dump_dir else None
+    if args.command:
+        sys.exit(run_command(args, store, dumps))
+    if args.serve_ingest:
+        host, _, port = args.serve_ingest.rpartition(":")
+        ingest = IngestServer(store or SnapshotStore(), dumps, (host or "127.0.0.1", int(port)))
+        print(f"Ingest server listening on {ingest.start()}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            ingest.close()
+            sys.exit(0)
+    if args.stream:
+        M18(args.port, store=store, dumps=dumps).stream(args.stream, plot=args.plot)
+        sys.exit(0)
+    if args.sweep:
+        sweep_start, sweep_stop = (int(x, 0) for x in args.sweep.split("-"))
+        M18(args.port, store=store, dumps=dumps).sweep(sweep_start, sweep_stop + 1, checkpoint_path=args.checkpoint)
+        sys.exit(0)
+    if args.fleet is not None:
+        uploader = DashboardUploader(args.upload, args.spool_dir) if args.upload else None
+        scan_fleet(args.fleet, args.fleet_match, store=store, dumps=dumps, uploader=uploader)
+        if uploader is not None:
+            uploader.close()
+            uploader.report()
+        sys.exit(0)
+    if args.bench_framing:
+        benchmark_framing()
+        sys.exit(0)
+    if args.bench_decode:
+        benchmark_decode()
+        sys.exit(0)
+    if args.bench_startup:
+        benchmark_startup(args.bench_startup)
+        sys.exit(0)
+    if args.serve_emulator:
+        print(f"Battery emulator listening on {serve_emulator(BatteryEmulator(), args.serve_emulator)}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            sys.exit(0)
+    if not sys.stdin.isatty():
+        parser.error("no command given and stdin is not a terminal; use one of: health, dump, stream, sweep, export, fleet")
+    try:
+        import readline  # Line editing for the menu prompts
+    except ImportError:
+        pass
+    m = M18(args.port, store=store, dumps=dumps)
     print("\nMenu:")
     print("1. Health report (with CSV)")
     print("2. Read all registers (CSV)")
@@ -1003,7 +3408,7 @@ if __name__ == "__main__":
             else:
                 print("Failed to read data for form.")
         elif choice == '6':
-            dashboard_url = input("Enter dashboard URL (default: http://172.25.47.113:5002/data): ") or 'http://172.25.47.113:5002/data'
+            dashboard_url = input(f"Enter dashboard URL (default: {DASHBOARD_URL}): ") or DASHBOARD_URL
             m.export_to_dashboard(dashboard_url)
         elif choice == '7':
             print("Exiting...")
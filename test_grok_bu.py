@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+
+import pytest
+
+import grok_bu
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="ChangeWatcher needs inotify")
+
+
+def poll_until_quiet(watcher, rounds=5):
+    for _ in range(rounds):
+        watcher.poll(0.1)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    source = tmp_path / "src"
+    (source / "a" / "sub").mkdir(parents=True)
+    (source / "a" / "sub" / "f").write_text("1")
+    (source / "cache" / "deep").mkdir(parents=True)
+    index_dir = tmp_path / "index"
+    index_dir.mkdir()
+    return source.resolve(), index_dir
+
+
+def test_renamed_directory_stays_watched(tree):
+    source, index_dir = tree
+    previous = grok_bu.FileIndex.scan([source])
+    time.sleep(0.01)
+    watcher = grok_bu.ChangeWatcher([source], index_dir)
+    watcher.start()
+
+    os.rename(source / "a", source / "b")
+    poll_until_quiet(watcher)
+    watcher.dirty.clear()
+
+    (source / "b" / "important.db").write_text("data")
+    (source / "b" / "sub" / "g").write_text("2")
+    poll_until_quiet(watcher)
+    assert str(source / "b") in watcher.dirty
+    assert str(source / "b" / "sub") in watcher.dirty
+
+    watcher.flush()
+    dirty = set((index_dir / grok_bu.ChangeWatcher.JOURNAL).read_text().splitlines()) | {str(source), str(source / "a")}
+    index = previous.update([source], dirty)
+    assert {"src/b/important.db", "src/b/sub/g"} <= index.added
+    assert "src/a/sub/f" in index.deleted
+
+
+def test_directory_moved_out_is_forgotten(tree, tmp_path):
+    source, index_dir = tree
+    watcher = grok_bu.ChangeWatcher([source], index_dir)
+    watcher.start()
+    os.rename(source / "a", tmp_path / "outside")
+    poll_until_quiet(watcher)
+    assert str(source / "a") not in watcher.watches.values()
+    assert grok_bu.ChangeWatcher.OVERFLOW not in watcher.dirty
+
+
+def test_excluded_directories_are_not_watched(tree):
+    source, index_dir = tree
+    watcher = grok_bu.ChangeWatcher([source], index_dir, excludes=["cache"])
+    watcher.start()
+    assert str(source / "cache") not in watcher.watches.values()
+    assert str(source / "cache" / "deep") not in watcher.watches.values()
+    (source / "a" / "cache").mkdir()
+    poll_until_quiet(watcher)
+    assert str(source / "a" / "cache") not in watcher.watches.values()
+
+
+@pytest.mark.parametrize("pattern, path, expected", [
+    ("*.log", "src/a/x.log", True),
+    ("a/*", "src/a/b/x.log", False),
+    ("a/**", "src/a/b/x.log", True),
+    ("/a", "src/a", True),
+    ("/sub", "src/a/sub", False),
+    ("a/***", "src/a", True),
+    ("c?che", "src/cache", True),
+    ("[!x]/sub", "src/a/sub", True),
+])
+def test_excludes_follow_rsync_wildcards(pattern, path, expected):
+    assert grok_bu.ChunkStore.excluded(grok_bu.Path(path), [pattern]) is expected
+
+
+def test_special_files_are_not_hashed(tree):
+    source, _ = tree
+    os.mkfifo(source / "a" / "pipe")
+    index = grok_bu.FileIndex.scan([source], hash_files=True)
+    assert index.entries["src/a/pipe"][0] == "s"
+    assert index.entries["src/a/pipe"][4] is None
+    assert index.entries["src/a/sub/f"][4] is not None
@@ -0,0 +1,77 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+spec = importlib.util.spec_from_file_location("m18", Path(__file__).with_name("m18-1.0.19.py"))
+m18 = importlib.util.module_from_spec(spec)
+sys.modules["m18"] = m18
+spec.loader.exec_module(m18)
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    """reset() waits 0.6 s on break/DTR and backoff() between retries; the emulator needs neither."""
+    monkeypatch.setattr(m18.time, "sleep", lambda seconds: None)
+
+
+def battery(seed=7, **faults):
+    return m18.M18(transport=m18.BatteryEmulator(seed=seed, **faults))
+
+
+def values(array):
+    return dict((i, value) for i, value in array[1:])
+
+
+def test_read_id_reads_every_register():
+    clean = values(battery().read_id(output="array"))
+    assert len(clean) == len(m18.data_id)
+    assert all(value is not None for value in clean.values())
+    assert values(battery().read_id(output="array")) == clean  # Same seed, same image
+
+
+def test_read_id_never_returns_corrupt_data():
+    clean = values(battery().read_id(output="array"))
+    faulty = values(battery(drop_rate=0.1, corrupt_rate=0.1).read_id(output="array"))
+    assert faulty.keys() == clean.keys()
+    read = [i for i, value in faulty.items() if value is not None]
+    assert read
+    assert all(faulty[i] == clean[i] for i in read)
+
+
+def test_health_return_data():
+    emulator = m18.BatteryEmulator(seed=3)
+    report = m18.M18(transport=emulator).health(return_data=True)
+    assert set(report) >= {"summary", "registers", "timestamp"}
+    cells = m18.default_register_image(3)[0x400A]
+    expected = ", ".join(str(int.from_bytes(cells[i:i + 2], "big")) for i in range(0, 10, 2))
+    assert report["summary"]["Cell Voltages (mV)"] == expected
+
+
+def test_brute_finds_register(capsys):
+    battery().brute(0x40, 0x0A, len=0x0C)
+    assert "Valid response from: 0x400A with length: 0x0A" in capsys.readouterr().out
+
+
+def sweep(tmp_path, name, **faults):
+    engine = m18.SweepEngine(battery(**faults), tmp_path / f"{name}.json", tmp_path / f"{name}.csv", max_len=0x20)
+    return engine, engine.run(0x4000, 0x4040)
+
+
+def test_sweep_keeps_failed_addresses_out_of_invalid(tmp_path):
+    clean, clean_summary = sweep(tmp_path, "clean")
+    assert clean_summary["errors"] == 0 and clean_summary["retry"] == []
+    faulty, faulty_summary = sweep(tmp_path, "faulty", drop_rate=0.2, corrupt_rate=0.1)
+    assert faulty_summary["errors"] > 0
+    assert m18.merge_ranges(faulty.invalid) == m18.merge_ranges(clean.invalid)
+    assert faulty_summary["hits"] + len(faulty_summary["retry"]) == clean_summary["hits"]
+
+
+def test_sweep_resumes_from_checkpoint(tmp_path):
+    engine = m18.SweepEngine(battery(), tmp_path / "sweep.json", tmp_path / "sweep.csv", max_len=0x20)
+    engine.save_checkpoint(0x4020, 0x4040)
+    summary = engine.run(0x4000, 0x4040)
+    assert summary["next"] == 0x4040
+    hits = (tmp_path / "sweep.csv").read_text().splitlines()
+    assert hits and all(int(line.split(",")[0], 16) >= 0x4020 for line in hits)